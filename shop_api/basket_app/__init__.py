@@ -0,0 +1 @@
+default_app_config = 'basket_app.apps.BasketAppConfig'
@@ -1,9 +1,16 @@
 from django.contrib import admin
-from basket_app.models import Basket, Discount
+from basket_app.models import Basket, BasketItem, Discount, DiscountRule
+
+
+class BasketItemInline(admin.TabularInline):
+    model = BasketItem
+    raw_id_fields = ('product',)
+    extra = 0
 
 
 @admin.register(Basket)
 class BasketAdmin(admin.ModelAdmin):
+    inlines = (BasketItemInline,)
     list_display = ('owner', 'active')
     search_fields = ('owner', 'active')
     list_filter = ('owner', 'active')
@@ -14,3 +21,11 @@ class DiscountAdmin(admin.ModelAdmin):
     list_display = ('user', 'discount_percent')
     search_fields = ('user', 'discount_percent')
     list_filter = ('user', 'discount_percent')
+
+
+@admin.register(DiscountRule)
+class DiscountRuleAdmin(admin.ModelAdmin):
+    list_display = ('category', 'shop', 'min_quantity', 'discount_percent',
+                    'active')
+    list_filter = ('active', 'category')
+    raw_id_fields = ('shop',)
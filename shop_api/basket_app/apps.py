@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class BasketAppConfig(AppConfig):
     name = 'basket_app'
+
+    def ready(self):
+        import basket_app.signals  # noqa: F401
@@ -0,0 +1,93 @@
+"""Active basket of the current user.
+
+Every user has at most one active basket, it is enforced by a partial
+unique index on owner of active baskets (see Basket.Meta.constraints),
+which also serves the lookup of the active basket. Concurrent requests
+which create the basket at the same time get the same one: the index
+rejects the second insert and the existing basket is read instead.
+
+Id of the active basket is cached in the session, so requests which only
+change the basket do not look it up. The cached id is checked by the
+change itself (see basket_app.items.InactiveBasket), if the basket was
+paid in another session meanwhile the change is repeated with a fresh
+lookup.
+"""
+from django.db import IntegrityError, transaction
+from basket_app.items import InactiveBasket
+from basket_app.models import Basket
+
+ACTIVE_BASKET_SESSION_KEY = 'active_basket_id'
+
+
+def get_or_create_active_basket(user):
+    """Returns active basket of user, creates it if there is none."""
+    basket = Basket.objects.filter(owner=user, active=True).order_by().first()
+    if basket is not None:
+        return basket
+    try:
+        with transaction.atomic():
+            return Basket.objects.create(owner=user)
+    except IntegrityError:
+        # Created by a concurrent request
+        return Basket.objects.get(owner=user, active=True)
+
+
+def get_active_basket_id(request, create=False):
+    """Returns id of active basket of request.user, None if there is none
+    and it should not be created."""
+    pk = request.session.get(ACTIVE_BASKET_SESSION_KEY)
+    if pk is not None:
+        return pk
+    if create:
+        basket = get_or_create_active_basket(request.user)
+    else:
+        basket = (Basket.objects.filter(owner=request.user, active=True)
+                                .order_by().first())
+        if basket is None:
+            return None
+    remember_active_basket(request, basket)
+    return basket.pk
+
+
+def get_active_basket(request):
+    """Returns active basket of request.user or None."""
+    pk = request.session.get(ACTIVE_BASKET_SESSION_KEY)
+    if pk is not None:
+        basket = Basket.objects.filter(pk=pk, owner=request.user,
+                                       active=True).first()
+        if basket is not None:
+            return basket
+        forget_active_basket(request)
+    basket = (Basket.objects.filter(owner=request.user, active=True)
+                            .order_by().first())
+    if basket is not None:
+        remember_active_basket(request, basket)
+    return basket
+
+
+def remember_active_basket(request, basket):
+    request.session[ACTIVE_BASKET_SESSION_KEY] = basket.pk
+
+
+def forget_active_basket(request):
+    request.session.pop(ACTIVE_BASKET_SESSION_KEY, None)
+
+
+def change_active_basket(request, change, create=False):
+    """Calls change(basket id) on active basket of request.user.
+
+    Returns (basket id, result of change), basket id is None if user has
+    no active basket and it should not be created.
+    """
+    pk = get_active_basket_id(request, create)
+    if pk is None:
+        return None, None
+    try:
+        return pk, change(pk)
+    except InactiveBasket:
+        # Cached basket was paid in another session
+        forget_active_basket(request)
+    pk = get_active_basket_id(request, create)
+    if pk is None:
+        return None, None
+    return pk, change(pk)
@@ -0,0 +1,469 @@
+"""Storage of active baskets.
+
+The backend is chosen by settings.CART_STORE:
+
+    CART_STORE = {
+        'BACKEND': 'basket_app.cart_store.RedisCartStore',
+        'OPTIONS': {'url': 'redis://localhost:6379/0'},
+    }
+
+DatabaseCartStore (default) changes basket tables right away
+(see basket_app.items).
+
+KeyValueCartStore keeps active baskets in a key-value store, every basket
+is a hash of quantities and price snapshots of its products. Quantities are
+changed with HINCRBY, so concurrent changes do not read them first.
+Changed baskets are remembered in a set and written behind to basket tables
+in batches by flush_pending: periodically by a thread of every process
+(OPTIONS['flush_interval'] seconds) or by "manage.py flush_carts". A basket
+is written synchronously with flush_basket before it is paid. Basket missing
+in the store (evicted or never loaded) is loaded from its items first.
+
+Before the flush of a payment the basket is marked as closing
+(close_basket): changes check the mark in the same WATCH/MULTI transaction
+as HINCRBY and raise BasketClosing, so no change lands between the flush
+and the discard of the paid basket. A payment which did not close the
+basket removes the mark (reopen_basket), a mark left by a failed
+transaction expires after CLOSING_TIMEOUT seconds.
+
+RedisCartStore is KeyValueCartStore over a Redis server (redis package is
+required), LocalCartStore over a dict of the current process, e.g. for
+tests and development.
+"""
+import logging
+import threading
+import time
+from collections import namedtuple
+from decimal import Decimal
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.db import connections
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from basket_app.items import (add_product, remove_product, replace_items,
+                              InactiveBasket)
+from basket_app.models import Basket, BasketItem
+from product_app.models import Product
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CART_STORE = 'basket_app.cart_store.DatabaseCartStore'
+
+CartItem = namedtuple('CartItem', ['product', 'quantity', 'unit_price'])
+Totals = namedtuple('Totals', ['item_count', 'subtotal'])
+
+_store = None
+_store_lock = threading.Lock()
+
+
+class BasketClosing(Exception):
+    """Basket is being paid, it can not be changed."""
+
+
+def get_cart_store():
+    """Returns cart store configured in settings.CART_STORE."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            config = getattr(settings, 'CART_STORE', {})
+            backend = import_string(config.get('BACKEND',
+                                               DEFAULT_CART_STORE))
+            _store = backend(**config.get('OPTIONS', {}))
+        return _store
+
+
+@receiver(setting_changed)
+def reset_cart_store(setting, **kwargs):
+    global _store
+    if setting == 'CART_STORE':
+        with _store_lock:
+            if _store is not None:
+                _store.close()
+            _store = None
+
+
+def read_items(basket_id):
+    """Returns CartItems of basket stored in the database ordered by
+    product."""
+    items = (BasketItem.objects.filter(basket=basket_id)
+                               .select_related('product__shop')
+                               .order_by('product__name', 'product__price'))
+    return [CartItem(item.product, item.quantity, item.unit_price_snapshot)
+            for item in items]
+
+
+class DatabaseCartStore:
+    """Baskets are changed in the database right away."""
+
+    write_behind = False
+
+    def add(self, basket_id, product, quantity):
+        add_product(basket_id, product, quantity)
+
+    def remove(self, basket_id, product_id, quantity=None):
+        return remove_product(basket_id, product_id, quantity)
+
+    def get_items(self, basket_id):
+        """Returns CartItems of basket ordered by product."""
+        return read_items(basket_id)
+
+    def get_totals(self, basket):
+        """Returns Totals of basket instance."""
+        return Totals(basket.item_count, basket.subtotal)
+
+    def flush_basket(self, basket_id):
+        return False
+
+    def flush_pending(self, batch_size=None):
+        return 0
+
+    def discard(self, basket_id):
+        pass
+
+    def close_basket(self, basket_id):
+        # Changes wait for the lock of the basket row taken by payment
+        pass
+
+    def reopen_basket(self, basket_id):
+        pass
+
+    def close(self):
+        pass
+
+
+class KeyValueCartStore:
+    """Baskets are kept in a key-value store and written behind.
+
+    client - object with the interface of redis.Redis (hash and set
+    commands are used).
+    """
+
+    write_behind = True
+
+    LOADED = b'loaded'
+    CLOSING = 'closing'
+    QUANTITY = 'q:'
+    PRICE = 'p:'
+    CLOSING_TIMEOUT = 60
+
+    def __init__(self, client, prefix='cart', timeout=7 * 24 * 60 * 60,
+                 flush_interval=None, batch_size=100):
+        self.client = client
+        self.prefix = prefix
+        self.timeout = timeout
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.pending_key = f'{prefix}:pending'
+        self._flusher = None
+        self._closed = threading.Event()
+
+    def key(self, basket_id):
+        return f'{self.prefix}:{basket_id}'
+
+    def _load(self, basket_id):
+        """Loads basket from the database unless it is in the store.
+
+        Quantities are added with HINCRBY in a transaction which fails if
+        the basket was changed meanwhile (WATCH), so the basket is loaded
+        once and pieces added to a basket evicted from the store are kept.
+        """
+        key = self.key(basket_id)
+        if self.client.hget(key, self.LOADED) is not None:
+            return
+        if not Basket.objects.filter(pk=basket_id, active=True).exists():
+            raise InactiveBasket()
+        items = list(BasketItem.objects.filter(basket=basket_id)
+                                       .values_list('product_id', 'quantity',
+                                                    'unit_price_snapshot'))
+
+        def load(pipe):
+            if pipe.hget(key, self.LOADED) is not None:
+                return
+            pipe.multi()
+            for product_id, quantity, price in items:
+                pipe.hincrby(key, f'{self.QUANTITY}{product_id}', quantity)
+                pipe.hsetnx(key, f'{self.PRICE}{product_id}', str(price))
+            pipe.hsetnx(key, self.LOADED, 1)
+
+        self.client.transaction(load, key)
+
+    def _changed(self, basket_id):
+        self.client.expire(self.key(basket_id), self.timeout)
+        self.client.sadd(self.pending_key, basket_id)
+        self._start_flusher()
+
+    def _read(self, basket_id):
+        """Returns {product id: (quantity, unit price)} of basket,
+        None if it is not in the store."""
+        fields = self.client.hgetall(self.key(basket_id))
+        if fields.get(self.LOADED) is None:
+            return None
+        items = {}
+        for field, value in fields.items():
+            field = field.decode()
+            if field.startswith(self.QUANTITY) and int(value) > 0:
+                product_id = field[len(self.QUANTITY):]
+                price = fields.get(f'{self.PRICE}{product_id}'.encode())
+                if price is not None:
+                    items[int(product_id)] = (int(value),
+                                              Decimal(price.decode()))
+        return items
+
+    def _check_open(self, pipe, key):
+        deadline = pipe.hget(key, self.CLOSING)
+        if deadline is not None and float(deadline) > time.time():
+            raise BasketClosing()
+
+    def add(self, basket_id, product, quantity):
+        self._load(basket_id)
+        key = self.key(basket_id)
+        field = f'{self.QUANTITY}{product.pk}'
+        price = f'{self.PRICE}{product.pk}'
+
+        def add(pipe):
+            self._check_open(pipe, key)
+            current = pipe.hget(key, field)
+            pipe.multi()
+            pipe.hincrby(key, field, quantity)
+            if current is None or int(current) <= 0:
+                # Product was not in basket, its price is taken anew
+                pipe.hset(key, price, str(product.price))
+            else:
+                pipe.hsetnx(key, price, str(product.price))
+
+        self.client.transaction(add, key)
+        self._changed(basket_id)
+
+    def remove(self, basket_id, product_id, quantity=None):
+        """Removes pieces with a single HINCRBY, a line with no pieces
+        left is set to zero (lines without pieces are not in basket)."""
+        self._load(basket_id)
+        key = self.key(basket_id)
+        field = f'{self.QUANTITY}{product_id}'
+        removed = []
+
+        def remove(pipe):
+            del removed[:]
+            self._check_open(pipe, key)
+            current = int(pipe.hget(key, field) or 0)
+            if current <= 0:
+                return
+            pipe.multi()
+            pipe.hincrby(key, field, -min(quantity or current, current))
+            removed.append(True)
+
+        self.client.transaction(remove, key)
+        if not removed:
+            return False
+        self._changed(basket_id)
+        return True
+
+    def get_items(self, basket_id):
+        self._load(basket_id)
+        items = self._read(basket_id) or {}
+        products = (Product.objects.filter(pk__in=list(items))
+                                   .select_related('shop')
+                                   .order_by('name', 'price'))
+        return [CartItem(product, *items[product.pk])
+                for product in products]
+
+    def get_totals(self, basket):
+        self._load(basket.pk)
+        items = (self._read(basket.pk) or {}).values()
+        return Totals(sum(quantity for quantity, _ in items),
+                      sum((quantity * price for quantity, price in items),
+                          Decimal('0.00')))
+
+    def flush_basket(self, basket_id):
+        """Writes basket to the database, returns False if it is not in
+        the store."""
+        # A change after this point marks the basket again
+        self.client.srem(self.pending_key, basket_id)
+        items = self._read(basket_id)
+        if items is None:
+            return False
+        if not replace_items(basket_id, items):
+            # Paid meanwhile, changes after the payment are dropped
+            self.discard(basket_id)
+        return True
+
+    def flush_pending(self, batch_size=None):
+        """Writes changed baskets to the database, returns their number.
+
+        Baskets which failed are logged and kept pending for the next flush.
+        """
+        flushed = 0
+        failed = []
+        while True:
+            basket_ids = self.client.spop(self.pending_key,
+                                          batch_size or self.batch_size)
+            if not basket_ids:
+                break
+            for basket_id in basket_ids:
+                try:
+                    self.flush_basket(int(basket_id))
+                except Exception:
+                    logger.exception('Basket %s was not written',
+                                     basket_id.decode())
+                    failed.append(basket_id)
+                else:
+                    flushed += 1
+        if failed:
+            self.client.sadd(self.pending_key, *failed)
+        return flushed
+
+    def close_basket(self, basket_id):
+        """Marks basket as being paid, changes raise BasketClosing until
+        it is discarded or reopened."""
+        self.client.hset(self.key(basket_id), self.CLOSING,
+                         time.time() + self.CLOSING_TIMEOUT)
+
+    def reopen_basket(self, basket_id):
+        self.client.hdel(self.key(basket_id), self.CLOSING)
+
+    def discard(self, basket_id):
+        """Removes basket from the store, e.g. after it was paid."""
+        self.client.delete(self.key(basket_id))
+        self.client.srem(self.pending_key, basket_id)
+
+    def _start_flusher(self):
+        if not self.flush_interval or self._flusher is not None:
+            return
+        with _store_lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop,
+                                                 daemon=True)
+                self._flusher.start()
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.flush_pending()
+            except Exception:
+                logger.exception('Writing of changed baskets failed')
+            finally:
+                connections.close_all()
+
+    def close(self):
+        self._closed.set()
+
+
+class LocalClient:
+    """Hash and set commands of Redis over dicts of the current process.
+
+    Keys do not expire, transactions hold the lock of the client.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.RLock()
+
+    def transaction(self, func, *watches):
+        """Calls func(pipeline) with commands of the client, no other
+        command runs meanwhile."""
+        with self.lock:
+            func(_LocalPipeline(self))
+
+    @staticmethod
+    def _bytes(value):
+        if isinstance(value, bytes):
+            return value
+        return str(value).encode()
+
+    def hget(self, name, key):
+        with self.lock:
+            return self.data.get(name, {}).get(self._bytes(key))
+
+    def hgetall(self, name):
+        with self.lock:
+            return dict(self.data.get(name, {}))
+
+    def hset(self, name, key, value):
+        with self.lock:
+            fields = self.data.setdefault(name, {})
+            created = self._bytes(key) not in fields
+            fields[self._bytes(key)] = self._bytes(value)
+            return int(created)
+
+    def hsetnx(self, name, key, value):
+        with self.lock:
+            fields = self.data.setdefault(name, {})
+            if self._bytes(key) in fields:
+                return 0
+            fields[self._bytes(key)] = self._bytes(value)
+            return 1
+
+    def hincrby(self, name, key, amount=1):
+        with self.lock:
+            fields = self.data.setdefault(name, {})
+            value = int(fields.get(self._bytes(key), 0)) + amount
+            fields[self._bytes(key)] = self._bytes(value)
+            return value
+
+    def hdel(self, name, *keys):
+        with self.lock:
+            fields = self.data.get(name, {})
+            return sum(fields.pop(self._bytes(key), None) is not None
+                       for key in keys)
+
+    def sadd(self, name, *values):
+        with self.lock:
+            members = self.data.setdefault(name, set())
+            added = {self._bytes(value) for value in values} - members
+            members.update(added)
+            return len(added)
+
+    def srem(self, name, *values):
+        with self.lock:
+            members = self.data.get(name, set())
+            removed = {self._bytes(value) for value in values} & members
+            members.difference_update(removed)
+            return len(removed)
+
+    def spop(self, name, count=None):
+        with self.lock:
+            members = self.data.get(name, set())
+            popped = [members.pop() for _ in range(min(count or 1,
+                                                       len(members)))]
+            return popped if count is not None else next(iter(popped), None)
+
+    def expire(self, name, seconds):
+        return name in self.data
+
+    def delete(self, *names):
+        with self.lock:
+            return sum(self.data.pop(name, None) is not None
+                       for name in names)
+
+
+class _LocalPipeline:
+    """Pipeline of LocalClient, commands are run right away."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def multi(self):
+        pass
+
+
+class LocalCartStore(KeyValueCartStore):
+    """Baskets are kept in memory of the current process."""
+
+    def __init__(self, **options):
+        super().__init__(LocalClient(), **options)
+
+
+class RedisCartStore(KeyValueCartStore):
+    """Baskets are kept in Redis at url."""
+
+    def __init__(self, url='redis://localhost:6379/0', **options):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured('RedisCartStore requires redis '
+                                       'package')
+        super().__init__(redis.Redis.from_url(url), **options)
@@ -0,0 +1,82 @@
+"""Idempotency-Key header of unsafe requests.
+
+A client which retries a request sends the same Idempotency-Key with it.
+The response of the first request is stored with the key in the same
+transaction as the changes made by it, so a retry either finds the stored
+response and gets it back (with Idempotent-Replayed header) without
+touching anything else, or finds nothing because the first request was
+rolled back and is processed anew. Concurrent requests with the same key
+are serialized by the unique index on (owner, key): the second insert
+waits for the first transaction and fails once it is committed (see
+replay_or_conflict).
+
+Keys are kept for IDEMPOTENCY_KEY_TTL seconds, expired ones are deleted
+by a single DELETE in "manage.py expire_idempotency_keys".
+"""
+import hashlib
+from datetime import timedelta
+from http import HTTPStatus
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils import timezone
+from basket_app.models import IdempotencyKey
+
+IDEMPOTENCY_KEY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = IdempotencyKey._meta.get_field('key').max_length
+
+
+def get_idempotency_key(request):
+    """Returns Idempotency-Key of request, None if it was not sent."""
+    return request.META.get(IDEMPOTENCY_KEY_HEADER) or None
+
+
+def fingerprint(request):
+    return hashlib.sha256(request.body).hexdigest()
+
+
+def find_response(request, key):
+    """Returns stored response of key, None if there is none.
+
+    Returns 422 if the key was used for another request.
+    """
+    stored = IdempotencyKey.objects.filter(owner=request.user,
+                                           key=key).first()
+    if stored is None:
+        return None
+    if stored.fingerprint != fingerprint(request):
+        return HttpResponse('Idempotency-Key was used for another request',
+                            status=HTTPStatus.UNPROCESSABLE_ENTITY)
+    response = HttpResponse(stored.content, status=stored.status_code,
+                            content_type=stored.content_type)
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def store_response(request, key, response):
+    """Stores response of key, must be called in the transaction of the
+    request, raises IntegrityError if the key was stored meanwhile."""
+    IdempotencyKey.objects.create(
+        owner=request.user, key=key, fingerprint=fingerprint(request),
+        status_code=response.status_code,
+        content=response.content.decode(response.charset),
+        content_type=response['Content-Type'])
+
+
+def replay_or_conflict(request, key):
+    """Returns response of a request which stored key concurrently."""
+    response = find_response(request, key)
+    if response is None:
+        return HttpResponse('Request with this Idempotency-Key is in '
+                            'progress', status=HTTPStatus.CONFLICT)
+    return response
+
+
+def expire_keys(now=None):
+    """Deletes keys older than IDEMPOTENCY_KEY_TTL, returns their number."""
+    now = now or timezone.now()
+    ttl = getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60)
+    # Nothing refers to keys, so it is a single DELETE
+    deleted, _ = IdempotencyKey.objects.filter(
+        created__lt=now - timedelta(seconds=ttl)).delete()
+    return deleted
@@ -0,0 +1,201 @@
+"""Adding and removing products of baskets.
+
+A product is kept in basket as BasketItem, unique per (basket, product).
+Quantities are changed with a single UPDATE ... SET quantity = quantity + n,
+so concurrent adds of the same product are summed up by the database
+without reading the item first. The item is inserted only if the update
+found nothing, if a concurrent add inserted it in the meantime the unique
+index rejects the second insert and the update is repeated.
+
+Basket keeps number of pieces (item_count) and their total price
+(subtotal), they are changed in the same transaction as the item. Every
+change locks the basket row first (SELECT ... FOR UPDATE) and its items
+after it, so concurrent changes of a basket lock rows in the same order
+and do not deadlock. Deleted items are subtracted by basket_app.signals,
+which also covers items deleted by cascade with their product. Totals of
+paid baskets are what was paid, they are not changed when their products
+are deleted. Drift of totals of active baskets is found and repaired by
+find_drifted_baskets and repair_basket_totals.
+
+Baskets may be given as instances or primary keys. Only active baskets
+are changed, InactiveBasket is raised (and nothing is changed) if the
+basket was paid in the meantime.
+"""
+from decimal import Decimal
+from django.db import IntegrityError, transaction
+from django.db.models import (F, Q, DecimalField, ExpressionWrapper,
+                              OuterRef, Subquery, Sum, Value)
+from django.db.models.functions import Coalesce
+from basket_app.models import Basket, BasketItem
+from product_app.models import Product
+
+# Price of basket item: quantity * price of product when it was added
+LINE_TOTAL = ExpressionWrapper(
+    F('quantity') * F('unit_price_snapshot'),
+    output_field=DecimalField(max_digits=19, decimal_places=2))
+
+
+class InactiveBasket(Exception):
+    pass
+
+
+def _pk(basket):
+    return getattr(basket, 'pk', basket)
+
+
+def _lock_active(basket):
+    """Locks row of basket, raises InactiveBasket if it is not active."""
+    if not list(Basket.objects.select_for_update()
+                              .filter(pk=_pk(basket), active=True)
+                              .order_by().values_list('pk')):
+        raise InactiveBasket()
+
+
+def _increment(basket, product, quantity):
+    return (BasketItem.objects.filter(basket=basket, product=product)
+                              .update(quantity=F('quantity') + quantity))
+
+
+def _change_totals(basket, product, quantity):
+    """Adds quantity pieces of basket item to totals of basket,
+    the price is read from the item by the same UPDATE."""
+    price = (BasketItem.objects.filter(basket=OuterRef('pk'), product=product)
+                               .values('unit_price_snapshot')[:1])
+    updated = Basket.objects.filter(pk=_pk(basket), active=True).update(
+        item_count=F('item_count') + quantity,
+        subtotal=F('subtotal') + quantity * Subquery(
+            price, output_field=DecimalField(max_digits=19,
+                                             decimal_places=2)))
+    if not updated:
+        # Rolls back the change of item
+        raise InactiveBasket()
+
+
+def add_product(basket, product, quantity=1):
+    """Adds quantity of product to basket."""
+    with transaction.atomic():
+        _lock_active(basket)
+        if not _increment(basket, product, quantity):
+            try:
+                with transaction.atomic():
+                    BasketItem.objects.create(
+                        basket_id=_pk(basket), product=product,
+                        quantity=quantity,
+                        unit_price_snapshot=product.price)
+            except IntegrityError:
+                # Inserted by a concurrent add
+                _increment(basket, product, quantity)
+        _change_totals(basket, product, quantity)
+
+
+def remove_product(basket, product, quantity=None):
+    """Removes quantity of product from basket, the whole item without
+    quantity or if it has no more than that.
+
+    Returns False if product is not in basket.
+    """
+    with transaction.atomic():
+        _lock_active(basket)
+        items = BasketItem.objects.filter(basket=basket, product=product)
+        if quantity is not None:
+            if items.filter(quantity__gt=quantity).update(
+                    quantity=F('quantity') - quantity):
+                _change_totals(basket, product, -quantity)
+                return True
+            # Concurrent adds in between are not deleted
+            items = items.filter(quantity__lte=quantity)
+        # Totals are changed by basket_app.signals
+        deleted, _ = items.delete()
+    return bool(deleted)
+
+
+def replace_items(basket, items):
+    """Makes items of active basket equal to items
+    {product id: (quantity, unit price)} and recounts its totals.
+
+    Used to write baskets kept outside of the database
+    (see basket_app.cart_store). Products which no longer exist are
+    skipped. Returns False if basket is not active.
+    """
+    with transaction.atomic():
+        try:
+            _lock_active(basket)
+        except InactiveBasket:
+            return False
+        existing = {item.product_id: item for item in
+                    BasketItem.objects.filter(basket=basket)}
+        products = set(Product.objects.filter(pk__in=list(items))
+                                      .values_list('pk', flat=True))
+        # Totals are changed by basket_app.signals and recounted below
+        BasketItem.objects.filter(basket=basket).exclude(
+            product__in=products).delete()
+        changed, created = [], []
+        for product_id in products:
+            quantity, price = items[product_id]
+            item = existing.get(product_id)
+            if item is None:
+                created.append(BasketItem(basket_id=_pk(basket),
+                                          product_id=product_id,
+                                          quantity=quantity,
+                                          unit_price_snapshot=price))
+            elif item.quantity != quantity:
+                item.quantity = quantity
+                changed.append(item)
+        BasketItem.objects.bulk_create(created)
+        BasketItem.objects.bulk_update(changed, ['quantity'])
+        Basket.objects.filter(pk=_pk(basket)).update(
+            item_count=sum(items[pk][0] for pk in products),
+            subtotal=sum((items[pk][0] * items[pk][1] for pk in products),
+                         Decimal(0)))
+    return True
+
+
+def subtract_item(item):
+    """Subtracts deleted item from totals of its basket unless the basket
+    was paid."""
+    Basket.objects.filter(pk=item.basket_id, active=True).update(
+        item_count=F('item_count') - item.quantity,
+        subtotal=F('subtotal') - item.quantity * item.unit_price_snapshot)
+
+
+def with_actual_totals(baskets):
+    """Annotates baskets with totals counted from their items."""
+    return baskets.annotate(
+        actual_item_count=Coalesce(Sum('items__quantity'), Value(0)),
+        actual_subtotal=Coalesce(
+            Sum(ExpressionWrapper(
+                F('items__quantity') * F('items__unit_price_snapshot'),
+                output_field=DecimalField(max_digits=19, decimal_places=2))),
+            Value(0), output_field=DecimalField(max_digits=19,
+                                                decimal_places=2)))
+
+
+def find_drifted_baskets(baskets=None):
+    """Returns baskets which totals differ from their items, annotated
+    with actual totals. Only active baskets are checked by default."""
+    baskets = (Basket.objects.filter(active=True) if baskets is None
+               else baskets)
+    return (with_actual_totals(baskets.order_by('pk'))
+            .filter(~Q(item_count=F('actual_item_count')) |
+                    ~Q(subtotal=F('actual_subtotal'))))
+
+
+def repair_basket_totals(baskets):
+    """Recounts totals of baskets from their items.
+
+    Every basket is recounted in its own transaction with its row locked,
+    so items changed in the meantime are not lost.
+    """
+    repaired = 0
+    for pk in baskets.values_list('pk', flat=True):
+        with transaction.atomic():
+            list(Basket.objects.select_for_update().filter(pk=pk)
+                               .values_list('pk'))
+            actual = with_actual_totals(Basket.objects.filter(pk=pk)).values(
+                'actual_item_count', 'actual_subtotal').first()
+            if actual is None:
+                continue
+            repaired += Basket.objects.filter(pk=pk).update(
+                item_count=actual['actual_item_count'],
+                subtotal=actual['actual_subtotal'])
+    return repaired
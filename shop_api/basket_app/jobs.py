@@ -0,0 +1,134 @@
+"""Queue of jobs run by workers after the request which enqueued them.
+
+Jobs are rows of Job, so a job is enqueued in the transaction of the
+request and exists only if the request was committed. Job.task is the
+dotted path of a function called with keyword arguments from Job.payload.
+
+Delivery is at least once: a worker takes due jobs and moves their run_at
+forward by JOB_LEASE seconds in one short transaction, then runs them.
+A job of a worker which crashed becomes due again once its lease is over,
+so tasks have to be idempotent. A failed job is retried with growing
+delays, after JOB_MAX_ATTEMPTS attempts it is marked as failed.
+
+On PostgreSQL due jobs are taken with SELECT ... FOR UPDATE SKIP LOCKED,
+concurrent workers skip rows taken by each other without waiting. Other
+databases (SQLite) have no SKIP LOCKED, a job is taken there by an UPDATE
+conditional on its run_at, which only one of concurrent workers wins.
+Idle workers poll the queue every JOB_POLL_INTERVAL seconds.
+"""
+import json
+import logging
+import threading
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from basket_app.models import Job
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def enqueue(task, owner_id=None, **payload):
+    """Creates job which calls task(**payload), owner may see its status."""
+    return Job.objects.create(task=task, owner_id=owner_id,
+                              payload=json.dumps(payload))
+
+
+def _due_jobs(now):
+    return (Job.objects.filter(status=Job.QUEUED, run_at__lte=now)
+                       .order_by('run_at'))
+
+
+def take_jobs(limit=1):
+    """Takes up to limit due jobs for JOB_LEASE seconds, returns them."""
+    now = timezone.now()
+    lease_until = now + timedelta(seconds=_setting('JOB_LEASE', 60))
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            jobs = list(_due_jobs(now).select_for_update(skip_locked=True)
+                                      [:limit])
+            Job.objects.filter(pk__in=[job.pk for job in jobs]).update(
+                run_at=lease_until)
+    else:
+        jobs = []
+        for job in _due_jobs(now)[:limit]:
+            # Taken by another worker if run_at has changed meanwhile
+            if Job.objects.filter(pk=job.pk, status=Job.QUEUED,
+                                  run_at=job.run_at).update(
+                                      run_at=lease_until):
+                jobs.append(job)
+    for job in jobs:
+        job.run_at = lease_until
+    return jobs
+
+
+def run_job(job):
+    """Runs job taken by take_jobs, returns True if it is done."""
+    try:
+        task = import_string(job.task)
+        task(**json.loads(job.payload))
+    except Exception:
+        job.attempts += 1
+        job.error = traceback.format_exc()
+        if job.attempts >= _setting('JOB_MAX_ATTEMPTS', 5):
+            job.status = Job.FAILED
+            job.finished = timezone.now()
+        else:
+            job.run_at = timezone.now() + timedelta(
+                seconds=_setting('JOB_RETRY_DELAY', 10) * 2 **
+                (job.attempts - 1))
+        logger.exception('Job %s (%s) failed', job.pk, job.task)
+        job.save(update_fields=['attempts', 'error', 'status', 'finished',
+                                'run_at'])
+        return False
+    job.attempts += 1
+    job.status = Job.DONE
+    job.finished = timezone.now()
+    job.save(update_fields=['attempts', 'status', 'finished'])
+    return True
+
+
+def run_pending(limit=None):
+    """Runs due jobs until there are none (or limit of them was run),
+    returns number of run jobs."""
+    run = 0
+    while limit is None or run < limit:
+        jobs = take_jobs(1)
+        if not jobs:
+            return run
+        run_job(jobs[0])
+        run += 1
+    return run
+
+
+def work(stop, poll_interval=None):
+    """Runs jobs until stop event is set."""
+    poll_interval = poll_interval or _setting('JOB_POLL_INTERVAL', 1)
+    try:
+        while not stop.is_set():
+            try:
+                if not run_pending(limit=100):
+                    stop.wait(poll_interval)
+            except Exception:
+                # Database is not available, the next poll retries
+                logger.exception('Taking of jobs failed')
+                connections.close_all()
+                stop.wait(poll_interval)
+    finally:
+        connections.close_all()
+
+
+def start_workers(number, stop, poll_interval=None):
+    """Starts number of worker threads, returns them."""
+    workers = [threading.Thread(target=work, args=(stop, poll_interval),
+                                name=f'job-worker-{index}', daemon=True)
+               for index in range(number)]
+    for worker in workers:
+        worker.start()
+    return workers
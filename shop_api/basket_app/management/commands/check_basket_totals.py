@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from basket_app.items import find_drifted_baskets, repair_basket_totals
+
+
+class Command(BaseCommand):
+    help = ('Checks that item_count and subtotal of every active basket '
+            'match its items, --repair recounts baskets which do not.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true',
+                            help='Recount totals of drifted baskets')
+
+    def handle(self, *args, **options):
+        drifted = find_drifted_baskets()
+        for basket in drifted.iterator():
+            self.stdout.write(
+                f'Basket {basket.pk}: {basket.item_count} items for '
+                f'{basket.subtotal}, actual {basket.actual_item_count} '
+                f'items for {basket.actual_subtotal}')
+        if options['repair']:
+            repaired = repair_basket_totals(drifted)
+            self.stdout.write(f'Totals of {repaired} baskets were repaired.')
+        elif drifted.exists():
+            raise CommandError('Totals of some baskets do not match their '
+                               'items, run with --repair to recount them.')
+        else:
+            self.stdout.write('Totals of all active baskets match their '
+                              'items.')
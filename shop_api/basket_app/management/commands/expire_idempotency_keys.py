@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from basket_app.idempotency import expire_keys
+
+
+class Command(BaseCommand):
+    help = ('Deletes Idempotency-Key responses older than '
+            'IDEMPOTENCY_KEY_TTL seconds.')
+
+    def handle(self, *args, **options):
+        deleted = expire_keys()
+        self.stdout.write(f'{deleted} idempotency keys were deleted.')
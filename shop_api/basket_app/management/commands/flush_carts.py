@@ -0,0 +1,24 @@
+import time
+from django.core.management.base import BaseCommand
+from basket_app.cart_store import get_cart_store
+
+
+class Command(BaseCommand):
+    help = ('Writes baskets changed in the cart store to the database '
+            '(see CART_STORE setting).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', type=float, metavar='SECONDS',
+                            help='Repeat every SECONDS until interrupted')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Baskets taken from the store at once')
+
+    def handle(self, *args, **options):
+        store = get_cart_store()
+        while True:
+            flushed = store.flush_pending(options['batch_size'])
+            if flushed or not options['loop']:
+                self.stdout.write(f'{flushed} baskets were written.')
+            if not options['loop']:
+                return
+            time.sleep(options['loop'])
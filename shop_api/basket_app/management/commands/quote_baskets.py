@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from basket_app.cart_store import get_cart_store
+from basket_app.quotes import quote_baskets, iter_quote_lines
+
+
+class Command(BaseCommand):
+    help = ('Writes totals of given baskets (every active basket by '
+            'default) with current discounts as NDJSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('baskets', nargs='*', type=int,
+                            help='Ids of baskets')
+        parser.add_argument('--output', help='File, stdout by default')
+        parser.add_argument('--chunk-size', type=int,
+                            help='Baskets quoted at once')
+
+    def handle(self, *args, **options):
+        # Changes kept in the cart store are quoted too
+        get_cart_store().flush_pending()
+        quotes = quote_baskets(options['baskets'] or None,
+                               options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.writelines(iter_quote_lines(quotes))
+        else:
+            for line in iter_quote_lines(quotes):
+                self.stdout.write(line, ending='')
@@ -0,0 +1,37 @@
+import signal
+import threading
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from basket_app.jobs import run_pending, start_workers
+
+
+class Command(BaseCommand):
+    help = ('Runs queued jobs (finalization of paid baskets) with a pool '
+            'of worker threads until interrupted.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int,
+                            default=getattr(settings, 'JOB_WORKERS', 2),
+                            help='Number of worker threads')
+        parser.add_argument('--poll-interval', type=float,
+                            help='Seconds idle workers wait for new jobs')
+        parser.add_argument('--once', action='store_true',
+                            help='Run due jobs and exit')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            run = run_pending()
+            self.stdout.write(f'{run} jobs were run.')
+            return
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *args: stop.set())
+        workers = start_workers(options['workers'], stop,
+                                options['poll_interval'])
+        self.stdout.write(f'{len(workers)} workers are running.')
+        try:
+            while not stop.wait(1):
+                pass
+        except KeyboardInterrupt:
+            stop.set()
+        for worker in workers:
+            worker.join()
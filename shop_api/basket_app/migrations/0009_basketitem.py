@@ -0,0 +1,34 @@
+# Generated by Django 3.0.3 on 2026-10-18 18:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_app', '0013_product_image_hash'),
+        ('basket_app', '0008_auto_20200208_1407'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BasketItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('unit_price_snapshot', models.DecimalField(decimal_places=2, max_digits=19)),
+                ('basket', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='basket_app.Basket')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='basket_items', to='product_app.Product')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='basket',
+            name='products',
+            field=models.ManyToManyField(related_name='baskets', through='basket_app.BasketItem', to='product_app.Product'),
+        ),
+        migrations.AddConstraint(
+            model_name='basketitem',
+            constraint=models.UniqueConstraint(fields=('basket', 'product'), name='unique_basket_product'),
+        ),
+    ]
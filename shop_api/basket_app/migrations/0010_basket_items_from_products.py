@@ -0,0 +1,40 @@
+from django.db import migrations
+
+
+def items_from_products(apps, schema_editor):
+    """Every product which was in a basket becomes its item."""
+    Product = apps.get_model('product_app', 'Product')
+    BasketItem = apps.get_model('basket_app', 'BasketItem')
+    products = (Product.objects.filter(basket__isnull=False)
+                               .values_list('pk', 'basket_id', 'price')
+                               .iterator())
+    items = []
+    for pk, basket_id, price in products:
+        items.append(BasketItem(basket_id=basket_id, product_id=pk,
+                                quantity=1, unit_price_snapshot=price))
+        if len(items) >= 1000:
+            BasketItem.objects.bulk_create(items)
+            items = []
+    BasketItem.objects.bulk_create(items)
+
+
+def products_from_items(apps, schema_editor):
+    """Product can be in one basket only, the latest one is kept."""
+    Product = apps.get_model('product_app', 'Product')
+    BasketItem = apps.get_model('basket_app', 'BasketItem')
+    items = (BasketItem.objects.order_by('product_id', 'basket_id')
+                               .values_list('product_id', 'basket_id')
+                               .iterator())
+    for product_id, basket_id in items:
+        Product.objects.filter(pk=product_id).update(basket_id=basket_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basket_app', '0009_basketitem'),
+    ]
+
+    operations = [
+        migrations.RunPython(items_from_products, products_from_items),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 3.0.3 on 2026-10-18 18:49
+
+from django.db import migrations, models
+from django.db.models import F, Sum, DecimalField, ExpressionWrapper
+
+
+def count_totals(apps, schema_editor):
+    Basket = apps.get_model('basket_app', 'Basket')
+    BasketItem = apps.get_model('basket_app', 'BasketItem')
+    totals = (BasketItem.objects.order_by().values('basket_id').annotate(
+        item_count=Sum('quantity'),
+        subtotal=Sum(ExpressionWrapper(
+            F('quantity') * F('unit_price_snapshot'),
+            output_field=DecimalField(max_digits=19, decimal_places=2)))))
+    for row in totals.iterator():
+        Basket.objects.filter(pk=row['basket_id']).update(
+            item_count=row['item_count'], subtotal=row['subtotal'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basket_app', '0010_basket_items_from_products'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='basket',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='basket',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=19),
+        ),
+        migrations.RunPython(count_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 3.0.3 on 2026-10-18 18:55
+
+from django.db import migrations, models
+from django.db.models import Count, F
+
+
+def merge_active_baskets(apps, schema_editor):
+    """Items of older active baskets of a user are moved to the newest
+    one, the emptied baskets are deleted."""
+    Basket = apps.get_model('basket_app', 'Basket')
+    BasketItem = apps.get_model('basket_app', 'BasketItem')
+    owners = (Basket.objects.filter(active=True).order_by()
+                            .values('owner_id')
+                            .annotate(baskets=Count('pk'))
+                            .filter(baskets__gt=1)
+                            .values_list('owner_id', flat=True))
+    for owner_id in list(owners):
+        kept, *merged = (Basket.objects.filter(owner_id=owner_id, active=True)
+                                       .order_by('-pk'))
+        for item in BasketItem.objects.filter(basket__in=merged):
+            updated = (BasketItem.objects
+                       .filter(basket=kept, product_id=item.product_id)
+                       .update(quantity=F('quantity') + item.quantity))
+            if updated:
+                item.delete()
+            else:
+                BasketItem.objects.filter(pk=item.pk).update(basket=kept)
+        Basket.objects.filter(pk__in=[basket.pk for basket in merged]).delete()
+        Basket.objects.filter(pk=kept.pk).update(
+            item_count=sum(basket.item_count for basket in merged) +
+            kept.item_count,
+            subtotal=sum(basket.subtotal for basket in merged) +
+            kept.subtotal)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basket_app', '0011_basket_totals'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_active_baskets, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='basket',
+            constraint=models.UniqueConstraint(condition=models.Q(active=True), fields=('owner',), name='one_active_basket_per_owner'),
+        ),
+    ]
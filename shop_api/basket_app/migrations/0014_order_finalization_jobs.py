@@ -0,0 +1,58 @@
+# Generated by Django 3.0.3 on 2026-10-18 18:58
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def finalize_paid_baskets(apps, schema_editor):
+    # Baskets paid before were finished by the payment itself
+    Basket = apps.get_model('basket_app', 'Basket')
+    Basket.objects.filter(active=False).update(finalized=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_app', '0014_remove_product_basket'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('basket_app', '0013_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSales',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='sales', serialize=False, to='product_app.Product')),
+                ('quantity', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=19)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='basket',
+            name='finalized',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(finalize_paid_baskets,
+                             migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(max_length=255)),
+                ('payload', models.TextField(default='{}')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=16)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('run_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('error', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('owner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['status', 'run_at'], name='basket_app__status_ed4fac_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.0.3 on 2026-10-18 19:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop_app', '0003_shop_name_index'),
+        ('basket_app', '0014_order_finalization_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiscountRule',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(blank=True, max_length=255)),
+                ('min_quantity', models.PositiveIntegerField(default=1)),
+                ('discount_percent', models.DecimalField(decimal_places=2, max_digits=3)),
+                ('active', models.BooleanField(default=True)),
+                ('shop', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='shop_app.Shop')),
+            ],
+            options={
+                'ordering': ['category', 'shop', 'min_quantity'],
+            },
+        ),
+    ]
@@ -1,20 +1,71 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 
 class Basket(models.Model):
 
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
     active = models.BooleanField(default=True)
+    products = models.ManyToManyField('product_app.Product',
+                                      through='BasketItem',
+                                      related_name='baskets')
+    # Sums of quantities and prices of items, changed in the same
+    # transaction as items (see basket_app.items)
+    item_count = models.PositiveIntegerField(default=0)
+    subtotal = models.DecimalField(max_digits=19, decimal_places=2,
+                                   default=0)
+    # Paid basket is closed at once and finalized by a job
+    # (see basket_app.orders)
+    finalized = models.BooleanField(default=False)
 
     class Meta:
         ordering = ['owner']
+        # At most one active basket per user, the index also serves
+        # lookups of the active basket (see basket_app.baskets)
+        constraints = [models.UniqueConstraint(
+            fields=['owner'], condition=models.Q(active=True),
+            name='one_active_basket_per_owner')]
+
+    def save(self, *args, **kwargs):
+        # Totals and finalized are changed by atomic updates only, saving
+        # a basket loaded before them does not overwrite them.
+        if not self._state.adding and not args and \
+                kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and
+                field.name not in ('item_count', 'subtotal', 'finalized')]
+        super().save(*args, **kwargs)
 
     def __str__(self):
         name = self.owner.get_full_name()
         return f'Basket of customer: {name}'
 
 
+class BasketItem(models.Model):
+    """Product in basket with its quantity.
+
+    Price of the product is kept as it was when the product was added.
+    Items are changed with atomic increments (see basket_app.items).
+    """
+    basket = models.ForeignKey(Basket, related_name='items',
+                               on_delete=models.CASCADE)
+    product = models.ForeignKey('product_app.Product',
+                                related_name='basket_items',
+                                on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField(default=1)
+    unit_price_snapshot = models.DecimalField(max_digits=19,
+                                              decimal_places=2)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['basket', 'product'],
+                                               name='unique_basket_product')]
+
+    def __str__(self):
+        return f'{self.quantity} x {self.product_id} in basket {self.basket_id}'
+
+
 class Discount(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     discount_percent = models.DecimalField(max_digits=3,
@@ -28,3 +79,92 @@ class Discount(models.Model):
         discount = int(100 * self.discount_percent)
         return (f"User: {self.user.username} has discount "
                 f"{discount} %")
+
+
+class IdempotencyKey(models.Model):
+    """Response of a request sent with Idempotency-Key header.
+
+    A repeated request with the same key gets the stored response
+    (see basket_app.idempotency).
+    """
+    owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    # Hash of the request body, the key may not be reused for another one
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField()
+    content = models.TextField()
+    content_type = models.CharField(max_length=100)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['owner', 'key'],
+                                               name='unique_owner_key')]
+
+    def __str__(self):
+        return f'{self.key} of {self.owner_id}'
+
+
+class DiscountRule(models.Model):
+    """Discount of basket lines (see basket_app.pricing).
+
+    Rule applies to lines of products of category and shop (any of them
+    if empty) with at least min_quantity pieces, so a rule without
+    category and shop is a quantity tier of every product.
+    """
+    category = models.CharField(max_length=255, blank=True)
+    shop = models.ForeignKey('shop_app.Shop', null=True, blank=True,
+                             on_delete=models.CASCADE)
+    min_quantity = models.PositiveIntegerField(default=1)
+    discount_percent = models.DecimalField(max_digits=3, decimal_places=2)
+    active = models.BooleanField(default=True)
+
+    class Meta:
+        ordering = ['category', 'shop', 'min_quantity']
+
+    def __str__(self):
+        discount = int(100 * self.discount_percent)
+        return (f'{discount} % of {self.category or "any category"}, '
+                f'{self.shop or "any shop"} from {self.min_quantity} pieces')
+
+
+class ProductSales(models.Model):
+    """Number of sold pieces of product and their price, counted by
+    finalization of paid baskets (see basket_app.orders)."""
+    product = models.OneToOneField('product_app.Product', primary_key=True,
+                                   related_name='sales',
+                                   on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=19, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f'{self.quantity} x {self.product_id} for {self.revenue}'
+
+
+class Job(models.Model):
+    """Task run by workers after the request which enqueued it
+    (see basket_app.jobs)."""
+    QUEUED = 'queued'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [(QUEUED, 'Queued'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    # Dotted path of function called with arguments from payload
+    task = models.CharField(max_length=255)
+    payload = models.TextField(default='{}')
+    owner = models.ForeignKey(User, null=True, blank=True,
+                              on_delete=models.CASCADE)
+    status = models.CharField(max_length=16, choices=STATUSES,
+                              default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Job is taken by a worker when it is due, taking it moves the time
+    # forward by the lease, so the job of a crashed worker is run again
+    run_at = models.DateTimeField(default=timezone.now)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_at'])]
+
+    def __str__(self):
+        return f'{self.task} ({self.status})'
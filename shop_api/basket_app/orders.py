@@ -0,0 +1,57 @@
+"""Finalization of paid baskets.
+
+Payment only closes the basket (it is no longer active, so it can not be
+changed or paid again) and enqueues finalize_order (see basket_app.jobs),
+the rest is done by workers: sold pieces and revenue of every product are
+added to ProductSales and the basket is marked as finalized.
+
+Jobs are delivered at least once, the basket is marked in the same
+transaction as its sales are counted, so a repeated job counts nothing.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from basket_app.jobs import enqueue
+from basket_app.models import Basket, BasketItem, ProductSales
+
+FINALIZE_ORDER = 'basket_app.orders.finalize_order'
+
+
+def enqueue_finalization(basket):
+    """Enqueues finalization of paid basket, returns the job."""
+    return enqueue(FINALIZE_ORDER, owner_id=basket.owner_id,
+                   basket=basket.pk)
+
+
+def _add_sales(product_id, quantity, revenue):
+    return ProductSales.objects.filter(product_id=product_id).update(
+        quantity=F('quantity') + quantity, revenue=F('revenue') + revenue)
+
+
+def add_sales(product_id, quantity, revenue):
+    """Adds sold pieces of product and their price to its sales."""
+    if not _add_sales(product_id, quantity, revenue):
+        try:
+            with transaction.atomic():
+                ProductSales.objects.create(product_id=product_id,
+                                            quantity=quantity,
+                                            revenue=revenue)
+        except IntegrityError:
+            # Created by a concurrent finalization
+            _add_sales(product_id, quantity, revenue)
+
+
+def finalize_order(basket):
+    """Counts sales of paid basket once, returns False if it was already
+    finalized."""
+    with transaction.atomic():
+        if not Basket.objects.filter(pk=basket, active=False,
+                                     finalized=False).update(finalized=True):
+            return False
+        items = (BasketItem.objects.filter(basket=basket)
+                                   .order_by('product_id')
+                                   .values_list('product_id', 'quantity',
+                                                'unit_price_snapshot'))
+        # Products are locked in the same order by concurrent jobs
+        for product_id, quantity, price in items:
+            add_sales(product_id, quantity, quantity * price)
+    return True
@@ -0,0 +1,151 @@
+"""Prices of baskets with discounts.
+
+Discount rules are read once and kept in memory of the process: percents
+of users (Discount) and line rules (DiscountRule) indexed by category and
+shop, so pricing a basket needs no queries besides its items with their
+products.
+
+Every line gets the biggest discount of rules matching its product and
+quantity, rules do not add up. Discount of the user is applied to the sum
+of lines. Line totals and the total are rounded to cents (half up).
+
+Changes of Discount and DiscountRule drop rules of the current process
+and bump "discounts" catalog version (see basket_app.signals). Other
+processes compare the version with the one of their rules at most every
+PRICING_RULES_CHECK_INTERVAL seconds and reload rules if it has changed.
+Bulk updates bypass signals, call invalidate_rules() after them.
+"""
+import threading
+import time
+from collections import namedtuple
+from decimal import Decimal, ROUND_HALF_UP
+from django.conf import settings
+from django.db import transaction
+from basket_app.models import Discount, DiscountRule
+from product_app.catalog import bump_catalog_version
+from product_app.models import CatalogVersion
+
+DISCOUNTS = 'discounts'
+
+CENT = Decimal('0.01')
+ZERO = Decimal('0.00')
+
+# Lines of Quote: item with its discount percent and discounted total
+Line = namedtuple('Line', ['item', 'discount_percent', 'total'])
+Quote = namedtuple('Quote', ['lines', 'subtotal', 'discount', 'total'])
+
+_rules = None
+_checked = None
+_lock = threading.Lock()
+
+
+def _cents(amount):
+    return amount.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+class PricingRules:
+    """Discounts of users and basket lines loaded at once."""
+
+    def __init__(self, user_percents, line_rules, version=0):
+        # {user id: percent}
+        self.user_percents = user_percents
+        # {(category or '', shop id or None): [(min quantity, percent)]}
+        self.line_rules = {}
+        for category, shop_id, min_quantity, percent in line_rules:
+            self.line_rules.setdefault((category, shop_id), []).append(
+                (min_quantity, percent))
+        self.version = version
+
+    @classmethod
+    def load(cls, version=0):
+        return cls(dict(Discount.objects.exclude(discount_percent=0)
+                                        .values_list('user_id',
+                                                     'discount_percent')),
+                   DiscountRule.objects.filter(active=True).values_list(
+                       'category', 'shop_id', 'min_quantity',
+                       'discount_percent'),
+                   version)
+
+    def user_percent(self, user_id):
+        return self.user_percents.get(user_id, ZERO)
+
+    def line_percent(self, category, shop_id, quantity):
+        """Returns the biggest discount of quantity pieces of product of
+        category and shop."""
+        best = ZERO
+        for key in ((category, shop_id), (category, None), ('', shop_id),
+                    ('', None)):
+            for min_quantity, percent in self.line_rules.get(key, ()):
+                if quantity >= min_quantity and percent > best:
+                    best = percent
+        return best
+
+    def price_line(self, category, shop_id, quantity, unit_price):
+        """Returns (amount, discount percent, discounted total) of line."""
+        amount = quantity * unit_price
+        percent = self.line_percent(category, shop_id, quantity)
+        return amount, percent, _cents(amount - amount * percent)
+
+    def total(self, user_id, lines_total):
+        """Returns total of lines with discount of user applied."""
+        return _cents(lines_total - lines_total *
+                      self.user_percent(user_id))
+
+    def price(self, user_id, items):
+        """Returns Quote of basket items of user.
+
+        items - objects with product, quantity and unit_price
+        (see basket_app.cart_store.CartItem).
+        """
+        lines = []
+        subtotal = discounted = ZERO
+        for item in items:
+            amount, percent, line_total = self.price_line(
+                item.product.category, item.product.shop_id, item.quantity,
+                item.unit_price)
+            lines.append(Line(item, percent, line_total))
+            subtotal += amount
+            discounted += line_total
+        total = self.total(user_id, discounted)
+        return Quote(lines, _cents(subtotal), _cents(subtotal) - total, total)
+
+
+def _stored_version():
+    return (CatalogVersion.objects.filter(name=DISCOUNTS)
+                                  .values_list('version', flat=True)
+                                  .first() or 0)
+
+
+def get_rules():
+    """Returns PricingRules of the current process, reloads them if they
+    were changed."""
+    global _rules, _checked
+    interval = getattr(settings, 'PRICING_RULES_CHECK_INTERVAL', 5)
+    with _lock:
+        now = time.monotonic()
+        if _rules is not None and now - _checked < interval:
+            return _rules
+        version = _stored_version()
+        if _rules is None or _rules.version != version:
+            _rules = PricingRules.load(version)
+        _checked = now
+        return _rules
+
+
+def clear_rules():
+    """Drops rules of the current process."""
+    global _rules
+    with _lock:
+        _rules = None
+
+
+def invalidate_rules():
+    """Makes all processes reload rules."""
+    bump_catalog_version(DISCOUNTS)
+    clear_rules()
+    # Rules could be read again before the change is committed
+    transaction.on_commit(clear_rules)
+
+
+def quote_basket(user_id, items):
+    return get_rules().price(user_id, items)
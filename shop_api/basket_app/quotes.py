@@ -0,0 +1,82 @@
+"""Quotes of many baskets at once, e.g. after discount rules are changed.
+
+Baskets are read in chunks of QUOTE_CHUNK_SIZE, every chunk takes two
+queries: baskets with their owners and lines of all of them joined with
+category and shop of their products. Lines are priced with the same rules
+as a single basket (see basket_app.pricing) in one pass over the rows;
+lines with the same category, shop, quantity and price are priced once.
+Memory does not depend on the number of baskets.
+"""
+import json
+from collections import namedtuple
+from itertools import islice
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from basket_app.models import Basket, BasketItem
+from basket_app.pricing import get_rules, ZERO
+
+BasketQuote = namedtuple('BasketQuote', ['basket', 'owner', 'item_count',
+                                         'subtotal', 'discount', 'total'])
+
+
+def _chunks_of_ids(basket_ids, chunk_size):
+    ids = iter(sorted(set(basket_ids)))
+    while True:
+        chunk = list(islice(ids, chunk_size))
+        if not chunk:
+            return
+        yield list(Basket.objects.filter(pk__in=chunk).order_by('pk')
+                                 .values_list('pk', 'owner_id'))
+
+
+def _chunks_of_active(chunk_size):
+    last = 0
+    while True:
+        chunk = list(Basket.objects.filter(active=True, pk__gt=last)
+                                   .order_by('pk')
+                                   .values_list('pk', 'owner_id')
+                                   [:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last = chunk[-1][0]
+
+
+def quote_baskets(basket_ids=None, chunk_size=None):
+    """Yields BasketQuote of every basket of basket_ids (missing ones are
+    skipped) or of every active basket, ordered by basket."""
+    chunk_size = chunk_size or getattr(settings, 'QUOTE_CHUNK_SIZE', 5000)
+    chunks = (_chunks_of_active(chunk_size) if basket_ids is None
+              else _chunks_of_ids(basket_ids, chunk_size))
+    rules = get_rules()
+    for chunk in chunks:
+        priced = {}
+        # [pieces, amount, discounted amount] of every basket
+        sums = {pk: [0, ZERO, ZERO] for pk, _ in chunk}
+        lines = (BasketItem.objects.filter(basket__in=list(sums))
+                                   .order_by()
+                                   .values_list('basket_id',
+                                                'product__category',
+                                                'product__shop_id',
+                                                'quantity',
+                                                'unit_price_snapshot'))
+        for basket, *line in lines.iterator():
+            line = tuple(line)
+            if line not in priced:
+                priced[line] = rules.price_line(*line)
+            amount, _, line_total = priced[line]
+            basket_sums = sums[basket]
+            basket_sums[0] += line[2]
+            basket_sums[1] += amount
+            basket_sums[2] += line_total
+        for pk, owner in chunk:
+            item_count, subtotal, discounted = sums[pk]
+            total = rules.total(owner, discounted)
+            yield BasketQuote(pk, owner, item_count, subtotal,
+                              subtotal - total, total)
+
+
+def iter_quote_lines(quotes):
+    """Yields NDJSON lines of quotes, amounts are strings."""
+    for quote in quotes:
+        yield json.dumps(quote._asdict(), cls=DjangoJSONEncoder) + '\n'
@@ -0,0 +1,19 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from basket_app.items import subtract_item
+from basket_app.models import BasketItem, Discount, DiscountRule
+from basket_app.pricing import invalidate_rules
+
+
+@receiver(post_delete, sender=BasketItem)
+def basket_item_deleted(sender, instance, **kwargs):
+    # Removed from basket or deleted by cascade with its product
+    subtract_item(instance)
+
+
+@receiver(post_save, sender=Discount)
+@receiver(post_delete, sender=Discount)
+@receiver(post_save, sender=DiscountRule)
+@receiver(post_delete, sender=DiscountRule)
+def discount_changed(sender, **kwargs):
+    invalidate_rules()
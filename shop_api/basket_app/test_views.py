@@ -1,11 +1,14 @@
 from decimal import Decimal
 import json
 from django.test import TestCase, tag, Client
+from basket_app.items import add_product
 from basket_app.models import Basket, Discount
 from django.contrib.auth.models import User, Permission
 from product_app.models import Product
 from django.urls import reverse
 from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 
 class TestBasketViews(TestCase):
@@ -45,8 +48,8 @@ class TestBasketViews(TestCase):
     @tag('view_active_basket')
     def test_user_look_through_basket(self):
         user_basket = self.user.basket_set.get(active=True)
-        user_basket.product_set.add(self.product_set[0])
-        user_basket.product_set.add(self.product_set[1])
+        add_product(user_basket, self.product_set[0])
+        add_product(user_basket, self.product_set[1])
         self.client.login(username=self.user.username,
                           password='test_password')
         response = self.client.get(reverse('view_active_basket'))
@@ -78,8 +81,8 @@ class TestBasketViews(TestCase):
     @tag('get_total_basket_price')
     def test_user_get_total_price_of_prod_in_basket(self):
         user_basket = self.user.basket_set.get(active=True)
-        user_basket.product_set.add(self.product_set[0])
-        user_basket.product_set.add(self.product_set[1])
+        add_product(user_basket, self.product_set[0])
+        add_product(user_basket, self.product_set[1])
         self.client.login(username=self.user.username,
                           password='test_password')
         response = self.client.get(reverse('view_total_basket_price'))
@@ -98,8 +101,8 @@ class TestBasketViews(TestCase):
         self.user_discount.discount_percent = 0.1
         self.user_discount.save()
         self.user_discount.refresh_from_db()
-        user_basket.product_set.add(self.product_set[0])
-        user_basket.product_set.add(self.product_set[1])
+        add_product(user_basket, self.product_set[0])
+        add_product(user_basket, self.product_set[1])
         self.client.login(username=self.user.username,
                           password='test_password')
         response = self.client.get(reverse('view_total_basket_price'))
@@ -129,8 +132,8 @@ class TestBasketViews(TestCase):
     def test_user_pay_for_basket_positive_case(self):
         # Add product to the basket
         user_basket = self.user.basket_set.get(active=True)
-        user_basket.product_set.add(self.product_set[0])
-        user_basket.product_set.add(self.product_set[1])
+        add_product(user_basket, self.product_set[0])
+        add_product(user_basket, self.product_set[1])
         # Emulates login process
         self.client.login(username=self.user.username,
                           password='test_password')
@@ -138,16 +141,18 @@ class TestBasketViews(TestCase):
         response = self.client.post(reverse('pay_for_products'),
                                     data,
                                     content_type='application/json')
-        self.assertEqual(response.status_code, 200)
-        content = str(response.content, encoding='utf-8')
-        self.assertInHTML('Transaction was successfull', content)
+        self.assertEqual(response.status_code, 202)
+        content = response.json()
+        self.assertEqual(content['message'], 'Transaction was successfull')
+        response = self.client.get(content['status_url'])
+        self.assertEqual(response.json()['status'], 'queued')
 
     @tag('user_pay_for_basket_neg')
     def test_user_pay_for_basket_negative_case(self):
         # Add product to the basket
         user_basket = self.user.basket_set.get(active=True)
-        user_basket.product_set.add(self.product_set[0])
-        user_basket.product_set.add(self.product_set[1])
+        add_product(user_basket, self.product_set[0])
+        add_product(user_basket, self.product_set[1])
         # Emulates login process
         self.client.login(username=self.user.username,
                           password='test_password')
@@ -164,8 +169,8 @@ class TestBasketViews(TestCase):
     def test_user_pay_more(self):
         # Add product to the basket
         user_basket = self.user.basket_set.get(active=True)
-        user_basket.product_set.add(self.product_set[0])
-        user_basket.product_set.add(self.product_set[1])
+        add_product(user_basket, self.product_set[0])
+        add_product(user_basket, self.product_set[1])
         # Emulates login process
         self.client.login(username=self.user.username,
                           password='test_password')
@@ -178,3 +183,138 @@ class TestBasketViews(TestCase):
                   "Would you like to buy something else?"
         content = str(response.content, encoding='utf-8')
         self.assertInHTML(message, content)
+
+    @tag('basket_history')
+    def test_basket_history_with_products_and_totals(self):
+        add_product(self.basket, self.product_set[0])
+        self.basket.active = False
+        self.basket.save()
+        active = Basket.objects.create(owner=self.user)
+        add_product(active, self.product_set[1])
+        add_product(active, self.product_set[2])
+        self.client.login(username=self.user.username,
+                          password='test_password')
+        response = self.client.get(reverse('user_basket_list'),
+                                   {'totals': '1'})
+        self.assertEqual(response.status_code, 200)
+        baskets = response.json()
+        self.assertEqual([basket['pk'] for basket in baskets],
+                         [active.pk, self.basket.pk])
+        self.assertEqual(baskets[1]['products'][0]['fields']['name'],
+                         'apple')
+        self.assertEqual(len(baskets[0]['products']), 2)
+        self.assertEqual(baskets[0]['products_count'], 2)
+        self.assertEqual(Decimal(baskets[0]['total']),
+                         self.product_set[1].price +
+                         self.product_set[2].price)
+        self.assertEqual(Decimal(baskets[1]['total']),
+                         self.product_set[0].price)
+
+        # Without totals products are listed only
+        response = self.client.get(reverse('user_basket_list'))
+        self.assertNotIn('total', response.json()[0])
+
+    @tag('basket_history_queries')
+    def test_basket_history_queries_do_not_depend_on_baskets(self):
+        self.client.login(username=self.user.username,
+                          password='test_password')
+        add_product(self.basket, self.product_set[0])
+        with CaptureQueriesContext(connection) as one_basket:
+            self.client.get(reverse('user_basket_list'), {'totals': '1'})
+        for product in self.product_set[1:]:
+            Basket.objects.filter(owner=self.user).update(active=False)
+            add_product(Basket.objects.create(owner=self.user), product)
+        with CaptureQueriesContext(connection) as many_baskets:
+            response = self.client.get(reverse('user_basket_list'),
+                                       {'totals': '1'})
+        self.assertEqual(len(response.json()), len(self.product_set))
+        self.assertEqual(len(many_baskets), len(one_basket))
+
+    @tag('basket_history_pages')
+    def test_basket_history_is_paginated_by_basket(self):
+        other = User.objects.create_user(username='other',
+                                         password='test_password')
+        Basket.objects.create(owner=other)
+        for _ in range(2):
+            Basket.objects.create(owner=self.user, active=False)
+        self.client.login(username=self.user.username,
+                          password='test_password')
+        response = self.client.get(reverse('user_basket_list'),
+                                   {'limit': 2})
+        first_page = [basket['pk'] for basket in response.json()]
+        self.assertEqual(len(first_page), 2)
+        response = self.client.get(reverse('user_basket_list'), {
+            'limit': 2, 'after': response['X-Next-Cursor']})
+        self.assertEqual([basket['pk'] for basket in response.json()],
+                         [self.basket.pk])
+        self.assertFalse(response.has_header('X-Next-Cursor'))
+        response = self.client.get(reverse('user_basket_list'),
+                                   {'after': 'broken'})
+        self.assertEqual(response.status_code, 400)
+
+    @tag('add_quantity_to_basket')
+    def test_user_adds_and_removes_quantities(self):
+        self.client.login(username=self.user.username,
+                          password='test_password')
+        url = reverse('add_prod_to_bask', kwargs={'prod_pk': 1})
+        self.client.get(url)
+        response = self.client.get(url, {'quantity': 2})
+        self.assertEqual(response.json()[0]['quantity'], 3)
+        self.assertEqual(self.client.get(url, {'quantity': 0}).status_code,
+                         400)
+
+        url = reverse('remove_prod_from_bask', kwargs={'prod_pk': 1})
+        response = self.client.post(f'{url}?quantity=2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['quantity'], 1)
+        response = self.client.post(url)
+        self.assertEqual(response.json(), [])
+        self.assertEqual(self.client.post(url).status_code, 404)
+
+    @tag('same_product_in_two_baskets')
+    def test_product_stays_in_basket_of_other_user(self):
+        other = User.objects.create_user(username='other_user',
+                                         password='test_password')
+        other.user_permissions.add(
+            Permission.objects.get(codename='change_basket'))
+        other_basket = Basket.objects.create(owner=other)
+        add_product(other_basket, self.product_set[0])
+        self.client.login(username=self.user.username,
+                          password='test_password')
+        self.client.get(reverse('add_prod_to_bask',
+                                kwargs={'prod_pk': self.product_set[0].pk}))
+        self.assertEqual(list(other_basket.products.all()),
+                         [self.product_set[0]])
+        self.assertEqual(list(self.basket.products.all()),
+                         [self.product_set[0]])
+
+    @tag('active_basket_in_session')
+    def test_active_basket_id_is_cached_in_session(self):
+        self.client.login(username=self.user.username,
+                          password='test_password')
+        url = reverse('add_prod_to_bask', kwargs={'prod_pk': 1})
+        with CaptureQueriesContext(connection) as first:
+            self.client.get(url)
+        self.assertEqual(self.client.session['active_basket_id'],
+                         self.basket.pk)
+        with CaptureQueriesContext(connection) as second:
+            self.client.get(url)
+        self.assertLess(len(second), len(first))
+        # Active basket is not looked up by owner
+        self.assertFalse([query for query in second.captured_queries
+                          if 'owner_id' in query['sql']])
+        self.assertEqual(self.basket.items.get().quantity, 2)
+
+        # Basket paid in another session is not changed
+        Basket.objects.filter(pk=self.basket.pk).update(active=False)
+        response = self.client.get(url)
+        new_basket = self.user.basket_set.get(active=True)
+        self.assertEqual(response.json()[0]['quantity'], 1)
+        self.assertEqual(self.client.session['active_basket_id'],
+                         new_basket.pk)
+        self.assertEqual(self.basket.items.get().quantity, 2)
+
+        data = json.dumps({'money': float(new_basket.subtotal)})
+        self.client.post(reverse('pay_for_products'), data,
+                         content_type='application/json')
+        self.assertNotIn('active_basket_id', self.client.session)
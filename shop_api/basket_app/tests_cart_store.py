@@ -0,0 +1,171 @@
+import json
+from decimal import Decimal
+from unittest import mock
+from io import StringIO
+from django.contrib.auth.models import User, Permission
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import TestCase, tag, override_settings
+from django.urls import reverse
+from basket_app.cart_store import (BasketClosing, get_cart_store,
+                                   reset_cart_store)
+from basket_app.items import add_product, replace_items, InactiveBasket
+from basket_app.models import Basket, BasketItem
+from product_app.models import Product
+
+LOCAL_CART_STORE = {'BACKEND': 'basket_app.cart_store.LocalCartStore'}
+
+
+@override_settings(CART_STORE=LOCAL_CART_STORE)
+class TestKeyValueCartStore(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer',
+                                             password='test_password')
+        self.user.user_permissions.add(
+            Permission.objects.get(codename='change_basket'),
+            Permission.objects.get(codename='view_basket'))
+        self.basket = Basket.objects.create(owner=self.user)
+        self.apple = Product.objects.create(name='Apple', price=15,
+                                            category='Fruits',
+                                            description='Fresh')
+        self.ball = Product.objects.create(name='Ball', price='20.34',
+                                           category='Toys',
+                                           description='Round',
+                                           available=True)
+        # Baskets of previous tests are dropped with their store
+        reset_cart_store('CART_STORE')
+        self.store = get_cart_store()
+
+    def items(self):
+        return dict(BasketItem.objects.filter(basket=self.basket)
+                                      .values_list('product', 'quantity'))
+
+    @tag('cart_store_write_behind')
+    def test_changes_are_written_behind(self):
+        add_product(self.basket, self.apple, 2)
+        self.store.add(self.basket.pk, self.apple, 1)
+        self.store.add(self.basket.pk, self.ball, 3)
+        self.assertTrue(self.store.remove(self.basket.pk, self.apple.pk, 2))
+        self.assertFalse(self.store.remove(self.basket.pk, 0))
+        # The database is not changed yet
+        self.assertEqual(self.items(), {self.apple.pk: 2})
+        self.assertEqual(self.store.get_totals(self.basket),
+                         (4, Decimal('76.02')))
+        self.assertEqual([(item.product, item.quantity)
+                          for item in self.store.get_items(self.basket.pk)],
+                         [(self.apple, 1), (self.ball, 3)])
+
+        self.assertEqual(self.store.flush_pending(), 1)
+        self.assertEqual(self.items(), {self.apple.pk: 1, self.ball.pk: 3})
+        self.basket.refresh_from_db()
+        self.assertEqual((self.basket.item_count, self.basket.subtotal),
+                         (4, Decimal('76.02')))
+        self.assertEqual(self.store.flush_pending(), 0)
+
+        self.store.remove(self.basket.pk, self.apple.pk)
+        call_command('flush_carts', stdout=StringIO())
+        self.assertEqual(self.items(), {self.ball.pk: 3})
+        self.basket.refresh_from_db()
+        self.assertEqual(self.basket.item_count, 3)
+
+    @tag('cart_store_atomic_load')
+    def test_load_keeps_changes_made_meanwhile(self):
+        add_product(self.basket, self.apple, 2)
+        key = self.store.key(self.basket.pk)
+        # Added by another request before the basket is loaded
+        self.store.client.hincrby(key, f'q:{self.apple.pk}', 1)
+        self.store.add(self.basket.pk, self.ball, 1)
+        self.store.add(self.basket.pk, self.ball, 1)
+        self.assertEqual([(item.product, item.quantity)
+                          for item in self.store.get_items(self.basket.pk)],
+                         [(self.apple, 3), (self.ball, 2)])
+
+        self.assertTrue(self.store.remove(self.basket.pk, self.ball.pk, 5))
+        self.assertFalse(self.store.remove(self.basket.pk, self.ball.pk, 1))
+        self.store.add(self.basket.pk, self.ball, 1)
+        self.assertEqual(self.store.get_totals(self.basket),
+                         (4, Decimal('65.34')))
+
+    @tag('cart_store_flush_failure')
+    def test_failed_basket_does_not_stop_flush(self):
+        baskets = [self.basket] + [
+            Basket.objects.create(owner=User.objects.create(username=name))
+            for name in ('second', 'third')]
+        for basket in baskets:
+            self.store.add(basket.pk, self.apple, 1)
+
+        def replace(basket_id, items):
+            if basket_id == baskets[1].pk:
+                raise DatabaseError('Lost connection')
+            return replace_items(basket_id, items)
+
+        with mock.patch('basket_app.cart_store.replace_items', replace), \
+                self.assertLogs('basket_app.cart_store', 'ERROR'):
+            self.assertEqual(self.store.flush_pending(batch_size=3), 2)
+        self.assertEqual(self.items(), {self.apple.pk: 1})
+        self.assertFalse(BasketItem.objects.filter(basket=baskets[1]))
+        self.assertTrue(BasketItem.objects.filter(basket=baskets[2]))
+        # Written by the next flush
+        self.assertEqual(self.store.flush_pending(), 1)
+        self.assertTrue(BasketItem.objects.filter(basket=baskets[1]))
+
+    @tag('cart_store_inactive_basket')
+    def test_paid_basket_is_not_changed(self):
+        self.store.add(self.basket.pk, self.apple, 1)
+        Basket.objects.filter(pk=self.basket.pk).update(active=False)
+        self.store.flush_pending()
+        self.assertEqual(self.items(), {})
+        with self.assertRaises(InactiveBasket):
+            self.store.add(self.basket.pk, self.apple, 1)
+
+    @tag('cart_store_closing')
+    def test_basket_being_paid_is_not_changed(self):
+        self.store.add(self.basket.pk, self.apple, 1)
+        self.store.close_basket(self.basket.pk)
+        with self.assertRaises(BasketClosing):
+            self.store.add(self.basket.pk, self.ball, 1)
+        with self.assertRaises(BasketClosing):
+            self.store.remove(self.basket.pk, self.apple.pk)
+        self.client.login(username='buyer', password='test_password')
+        response = self.client.get(reverse('add_prod_to_bask',
+                                           args=[self.ball.pk]))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.store.get_totals(self.basket),
+                         (1, Decimal('15.00')))
+
+        self.store.reopen_basket(self.basket.pk)
+        self.store.add(self.basket.pk, self.ball, 1)
+        # A payment which was not made reopens the basket
+        response = self.client.post(reverse('pay_for_products'),
+                                    json.dumps({'money': 1}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(self.store.remove(self.basket.pk, self.ball.pk))
+        # Mark of a payment which failed to finish expires
+        self.store.close_basket(self.basket.pk)
+        with mock.patch('basket_app.cart_store.time.time',
+                        return_value=10 ** 10):
+            self.store.add(self.basket.pk, self.ball, 1)
+        self.assertEqual(self.store.get_totals(self.basket),
+                         (2, Decimal('35.34')))
+
+    @tag('cart_store_views')
+    def test_views_pay_for_basket_kept_in_store(self):
+        self.client.login(username='buyer', password='test_password')
+        response = self.client.get(reverse('add_prod_to_bask',
+                                           args=[self.ball.pk]),
+                                   {'quantity': 2})
+        self.assertEqual(json.loads(response.content)[0]['quantity'], 2)
+        self.assertEqual(self.items(), {})
+        response = self.client.get(reverse('view_total_basket_price'))
+        total = json.loads(json.loads(response.content)[0]['total_cost'])
+        self.assertEqual(Decimal(str(total['total'])), Decimal('40.68'))
+
+        response = self.client.post(reverse('pay_for_products'),
+                                    json.dumps({'money': 40.68}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        self.basket.refresh_from_db()
+        self.assertFalse(self.basket.active)
+        self.assertEqual(self.items(), {self.ball.pk: 2})
@@ -0,0 +1,77 @@
+import json
+from datetime import timedelta
+from io import StringIO
+from django.contrib.auth.models import User, Permission
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, tag
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from basket_app.items import add_product
+from basket_app.models import Basket, IdempotencyKey
+from product_app.models import Product
+
+
+class TestIdempotentPayment(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer',
+                                             password='test_password')
+        self.user.user_permissions.add(
+            Permission.objects.get(codename='change_basket'))
+        self.basket = Basket.objects.create(owner=self.user)
+        add_product(self.basket, Product.objects.create(
+            name='Ball', price=20, category='Toys', description='Round'), 2)
+        self.client.login(username='buyer', password='test_password')
+
+    def pay(self, money, key=None):
+        headers = {} if key is None else {'HTTP_IDEMPOTENCY_KEY': key}
+        return self.client.post(reverse('pay_for_products'),
+                                json.dumps({'money': money}),
+                                content_type='application/json', **headers)
+
+    @tag('idempotent_payment_replay')
+    def test_retry_gets_response_of_first_payment(self):
+        response = self.pay(40, key='order-1')
+        self.assertEqual(response.status_code, 202)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.basket.refresh_from_db()
+        self.assertFalse(self.basket.active)
+        # New basket of the user is not paid by the retry
+        Basket.objects.create(owner=self.user, item_count=1, subtotal=40)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.pay(40, key='order-1')
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'basket_app_basket' in query['sql']])
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        self.assertEqual(response.json()['message'],
+                         'Transaction was successfull')
+        self.assertTrue(Basket.objects.get(owner=self.user,
+                                           active=True).active)
+
+        response = self.pay(50, key='order-1')
+        self.assertEqual(response.status_code, 422)
+
+    @tag('idempotent_payment_failure_stored')
+    def test_rejected_payment_is_replayed(self):
+        self.assertEqual(self.pay(10, key='order-2').status_code, 400)
+        response = self.pay(10, key='order-2')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        # Without key the payment is processed again
+        self.assertEqual(self.pay(40).status_code, 202)
+
+    @tag('idempotency_keys_expire')
+    def test_expired_keys_are_deleted(self):
+        self.pay(40, key='old')
+        self.pay(40, key='new')
+        IdempotencyKey.objects.filter(key='old').update(
+            created=timezone.now() - timedelta(days=2))
+        out = StringIO()
+        call_command('expire_idempotency_keys', stdout=out)
+        self.assertIn('1 idempotency keys were deleted.', out.getvalue())
+        self.assertEqual(list(IdempotencyKey.objects.values_list(
+            'key', flat=True)), ['new'])
@@ -0,0 +1,120 @@
+import json
+import threading
+from datetime import timedelta
+from io import StringIO
+from django.contrib.auth.models import User, Permission
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, tag, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from basket_app.items import add_product
+from basket_app.jobs import enqueue, take_jobs, run_job, run_pending, work
+from basket_app.models import Basket, Job, ProductSales
+from basket_app.orders import finalize_order
+from product_app.models import Product
+
+calls = []
+
+
+def record(value):
+    calls.append(value)
+
+
+def fail():
+    raise ValueError('Broken')
+
+
+class TestJobs(TestCase):
+
+    def setUp(self):
+        calls.clear()
+        self.user = User.objects.create_user(username='buyer',
+                                             password='test_password')
+        self.user.user_permissions.add(
+            Permission.objects.get(codename='change_basket'))
+        self.basket = Basket.objects.create(owner=self.user)
+        self.ball = Product.objects.create(name='Ball', price=20,
+                                           category='Toys',
+                                           description='Round')
+        add_product(self.basket, self.ball, 2)
+
+    @tag('job_lease')
+    def test_taken_job_is_run_again_after_lease(self):
+        job = enqueue('basket_app.tests_jobs.record', value=1)
+        self.assertEqual(take_jobs(), [job])
+        # Taken by a worker which crashed
+        self.assertEqual(take_jobs(), [])
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        self.assertEqual(run_pending(), 1)
+        self.assertEqual(calls, [1])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.DONE, 1))
+        self.assertEqual(run_pending(), 0)
+
+    @tag('job_retry')
+    @override_settings(JOB_MAX_ATTEMPTS=2)
+    def test_failed_job_is_retried_later(self):
+        job = enqueue('basket_app.tests_jobs.fail')
+        self.assertFalse(run_job(take_jobs()[0]))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertIn('Broken', job.error)
+        self.assertGreater(job.run_at, timezone.now())
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+
+    @tag('order_finalized_once')
+    def test_order_is_finalized_once(self):
+        Basket.objects.filter(pk=self.basket.pk).update(active=False)
+        self.assertTrue(finalize_order(self.basket.pk))
+        self.assertFalse(finalize_order(self.basket.pk))
+        sales = ProductSales.objects.get(product=self.ball)
+        self.assertEqual((sales.quantity, sales.revenue), (2, 40))
+        self.basket.refresh_from_db()
+        self.assertTrue(self.basket.finalized)
+
+    @tag('payment_enqueues_finalization')
+    def test_payment_is_finalized_by_worker(self):
+        self.client.login(username='buyer', password='test_password')
+        response = self.client.post(reverse('pay_for_products'),
+                                    json.dumps({'money': 40}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        status_url = response.json()['status_url']
+        self.basket.refresh_from_db()
+        self.assertFalse(self.basket.active)
+        self.assertFalse(self.basket.finalized)
+
+        call_command('run_workers', '--once', stdout=StringIO())
+        self.assertEqual(self.client.get(status_url).json()['status'],
+                         Job.DONE)
+        self.assertEqual(ProductSales.objects.get(product=self.ball).quantity,
+                         2)
+        other = User.objects.create_user(username='other', password='other')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(status_url).status_code, 404)
+
+
+class TestWorkers(TransactionTestCase):
+
+    @tag('job_workers')
+    def test_every_job_is_run_by_one_of_workers(self):
+        calls.clear()
+        for value in range(20):
+            enqueue('basket_app.tests_jobs.record', value=value)
+        stop = threading.Event()
+        workers = [threading.Thread(target=work, args=(stop, 0.01))
+                   for _ in range(3)]
+        for worker in workers:
+            worker.start()
+        deadline = timezone.now() + timedelta(seconds=30)
+        while len(set(calls)) < 20 and timezone.now() < deadline:
+            stop.wait(0.05)
+        stop.set()
+        for worker in workers:
+            worker.join()
+        # Delivery is at least once
+        self.assertEqual(set(calls), set(range(20)))
@@ -1,7 +1,14 @@
+from decimal import Decimal
+from io import StringIO
+from django.core.management import call_command, CommandError
 from django.test import TestCase, tag
 from django.contrib.auth.models import User
-from basket_app.models import Basket
-from django.db import IntegrityError
+from basket_app.baskets import get_or_create_active_basket
+from basket_app.items import (add_product, remove_product, replace_items,
+                               find_drifted_baskets, InactiveBasket)
+from basket_app.models import Basket, BasketItem
+from django.db import IntegrityError, connection, transaction
+from django.test.utils import CaptureQueriesContext
 from product_app.models import Product
 
 
@@ -41,24 +48,151 @@ class TestBasketModel(TestCase):
     def test_add_remove_product_to_basket(self):
         Basket.objects.create(owner=self.owner)
         basket = Basket.objects.first()
-        basket.product_set.add(self.product_1)
-        basket.product_set.add(self.product_2)
-        self.assertEqual(len(basket.product_set.all()), 2)
-        self.assertEqual(basket.product_set.first().name,
+        add_product(basket, self.product_1)
+        add_product(basket, self.product_2)
+        self.assertEqual(len(basket.products.all()), 2)
+        self.assertEqual(basket.products.first().name,
                          self.product_1.name)
-        self.assertEqual(basket.product_set.all()[1].name,
+        self.assertEqual(basket.products.all()[1].name,
                          self.product_2.name)
 
         # asserts removing products from basket
-        basket.product_set.remove(self.product_1)
-        self.assertEqual(len(basket.product_set.all()), 1)
-        self.assertEqual(basket.product_set.all()[0].name,
+        remove_product(basket, self.product_1)
+        self.assertEqual(len(basket.products.all()), 1)
+        self.assertEqual(basket.products.all()[0].name,
                          self.product_2.name)
 
+    @tag('basket_item_quantity')
+    def test_basket_item_quantity_is_incremented(self):
+        basket = Basket.objects.create(owner=self.owner)
+        add_product(basket, self.product_1)
+        add_product(basket, self.product_1, 3)
+        item = BasketItem.objects.get(basket=basket)
+        self.assertEqual(item.quantity, 4)
+        self.assertEqual(item.unit_price_snapshot, self.product_1.price)
+
+        self.assertTrue(remove_product(basket, self.product_1, 3))
+        item.refresh_from_db()
+        self.assertEqual(item.quantity, 1)
+        self.assertTrue(remove_product(basket, self.product_1, 3))
+        self.assertFalse(BasketItem.objects.filter(basket=basket).exists())
+        self.assertFalse(remove_product(basket, self.product_1))
+
+    @tag('basket_item_unique')
+    def test_product_is_in_basket_once(self):
+        basket = Basket.objects.create(owner=self.owner)
+        add_product(basket, self.product_1)
+        with self.assertRaises(IntegrityError):
+            BasketItem.objects.create(basket=basket, product=self.product_1,
+                                      unit_price_snapshot=1)
+
+    @tag('product_in_several_baskets')
+    def test_product_in_several_baskets(self):
+        first = Basket.objects.create(owner=self.owner)
+        other = User.objects.create(username='other')
+        second = Basket.objects.create(owner=other)
+        add_product(first, self.product_1)
+        add_product(second, self.product_1)
+        self.assertEqual(list(self.product_1.baskets.order_by('pk')),
+                         [first, second])
+
     @tag('create_several_baskets')
     def test_user_creates_several_basket(self):
-        Basket.objects.create(owner=self.owner)
+        Basket.objects.create(owner=self.owner, active=False)
         Basket.objects.create(owner=self.owner)
         self.assertEqual(len(self.owner.basket_set.all()), 2)
         baskets = Basket.objects.filter(owner=self.owner).all()
         self.assertEqual(len(baskets), 2)
+
+    @tag('basket_totals')
+    def test_basket_totals_follow_items(self):
+        basket = Basket.objects.create(owner=self.owner)
+        add_product(basket, self.product_1, 2)
+        add_product(basket, self.product_2)
+        add_product(basket, self.product_1)
+        basket.refresh_from_db()
+        self.assertEqual(basket.item_count, 4)
+        self.assertEqual(basket.subtotal, Decimal('65.34'))
+
+        # Price of added pieces is the price snapshot of the item
+        Product.objects.filter(pk=self.product_1.pk).update(price=100)
+        add_product(basket, self.product_1)
+        remove_product(basket, self.product_2)
+        remove_product(basket, self.product_1, 1)
+        basket.refresh_from_db()
+        self.assertEqual(basket.item_count, 3)
+        self.assertEqual(basket.subtotal, Decimal('45.00'))
+
+        # Items deleted with their product are subtracted too, unless
+        # their basket was paid
+        paid = Basket.objects.create(owner=User.objects.create(
+            username='paid'))
+        add_product(paid, self.product_1, 2)
+        add_product(paid, self.product_2)
+        Basket.objects.filter(pk=paid.pk).update(active=False)
+        self.product_1.delete()
+        basket.refresh_from_db()
+        self.assertEqual(basket.item_count, 0)
+        self.assertEqual(basket.subtotal, 0)
+        paid.refresh_from_db()
+        self.assertEqual((paid.item_count, paid.subtotal),
+                         (3, Decimal('50.34')))
+        self.assertFalse(find_drifted_baskets().filter(pk=paid.pk))
+
+    @tag('basket_totals_repair')
+    def test_drifted_basket_totals_are_repaired(self):
+        basket = Basket.objects.create(owner=self.owner)
+        other = Basket.objects.create(
+            owner=User.objects.create(username='other'))
+        add_product(basket, self.product_1)
+        add_product(other, self.product_2)
+        Basket.objects.filter(pk=basket.pk).update(item_count=5, subtotal=1)
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('check_basket_totals', stdout=out)
+        self.assertIn(f'Basket {basket.pk}: 5 items for 1', out.getvalue())
+
+        call_command('check_basket_totals', '--repair', stdout=out)
+        self.assertIn('Totals of 1 baskets were repaired.', out.getvalue())
+        basket.refresh_from_db()
+        self.assertEqual((basket.item_count, basket.subtotal),
+                         (1, Decimal('15.00')))
+        call_command('check_basket_totals', stdout=out)
+
+    @tag('one_active_basket')
+    def test_user_has_one_active_basket(self):
+        basket = get_or_create_active_basket(self.owner)
+        self.assertEqual(get_or_create_active_basket(self.owner), basket)
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                Basket.objects.create(owner=self.owner)
+        basket.active = False
+        basket.save()
+        self.assertNotEqual(get_or_create_active_basket(self.owner), basket)
+
+    @tag('paid_basket_is_not_changed')
+    def test_paid_basket_is_not_changed(self):
+        basket = Basket.objects.create(owner=self.owner)
+        add_product(basket, self.product_1)
+        Basket.objects.filter(pk=basket.pk).update(active=False)
+        with self.assertRaises(InactiveBasket):
+            add_product(basket.pk, self.product_2)
+        with self.assertRaises(InactiveBasket):
+            remove_product(basket.pk, self.product_1)
+        self.assertEqual(list(basket.products.all()), [self.product_1])
+
+    @tag('basket_lock_order')
+    def test_basket_row_is_locked_before_items(self):
+        basket = Basket.objects.create(owner=self.owner)
+        changes = [lambda: add_product(basket, self.product_1, 2),
+                   lambda: remove_product(basket, self.product_1, 1),
+                   lambda: replace_items(basket, {self.product_2.pk: (
+                       1, Decimal('20.34'))})]
+        for change in changes:
+            with CaptureQueriesContext(connection) as queries:
+                change()
+            statements = [query['sql'] for query in queries
+                          if 'basket_app_' in query['sql']]
+            self.assertTrue(statements[0].startswith(
+                'SELECT "basket_app_basket"."id" FROM "basket_app_basket"'),
+                statements[0])
@@ -0,0 +1,99 @@
+import json
+from decimal import Decimal
+from django.contrib.auth.models import User, Permission
+from django.test import TestCase, tag
+from django.urls import reverse
+from basket_app.cart_store import CartItem
+from basket_app.items import add_product
+from basket_app.models import Basket, Discount, DiscountRule
+from basket_app.pricing import get_rules, clear_rules, PricingRules
+from product_app.catalog import bump_catalog_version
+from product_app.models import Product
+from shop_app.models import Shop
+
+
+class TestPricing(TestCase):
+
+    def setUp(self):
+        # Rules of previous tests were rolled back
+        clear_rules()
+        self.user = User.objects.create_user(username='buyer',
+                                             password='test_password')
+        self.shop = Shop.objects.create(name='Toys', city='Lviv',
+                                        owner='Owner')
+        self.ball = Product.objects.create(name='Ball', price='20.34',
+                                           category='Toys',
+                                           description='Round',
+                                           shop=self.shop, available=True)
+        self.apple = Product.objects.create(name='Apple', price=15,
+                                            category='Fruits',
+                                            description='Fresh',
+                                            available=True)
+
+    @tag('pricing_rules')
+    def test_best_matching_rule_is_applied_to_line(self):
+        rules = PricingRules({self.user.pk: Decimal('0.10')}, [
+            ('Toys', None, 1, Decimal('0.05')),
+            ('', self.shop.pk, 3, Decimal('0.20')),
+            ('', None, 10, Decimal('0.15'))])
+        quote = rules.price(self.user.pk, [
+            CartItem(self.ball, 3, Decimal('20.34')),
+            CartItem(self.apple, 2, Decimal('15.00'))])
+        self.assertEqual([line.discount_percent for line in quote.lines],
+                         [Decimal('0.20'), Decimal('0')])
+        # 61.02 - 20 % = 48.816
+        self.assertEqual([line.total for line in quote.lines],
+                         [Decimal('48.82'), Decimal('30.00')])
+        self.assertEqual(quote.subtotal, Decimal('91.02'))
+        # 78.82 - 10 %
+        self.assertEqual(quote.total, Decimal('70.94'))
+        self.assertEqual(quote.discount, Decimal('20.08'))
+        self.assertEqual(rules.line_percent('Fruits', None, 10), Decimal('0.15'))
+
+    @tag('pricing_cache')
+    def test_rules_are_cached_until_discounts_change(self):
+        rules = get_rules()
+        items = [CartItem(self.ball, 1, Decimal('20.34'))]
+        with self.assertNumQueries(0):
+            self.assertEqual(get_rules().price(self.user.pk, items).total,
+                             Decimal('20.34'))
+        Discount.objects.create(user=self.user, discount_percent='0.50')
+        self.assertIsNot(get_rules(), rules)
+        self.assertEqual(get_rules().price(self.user.pk, items).total,
+                         Decimal('10.17'))
+        rule = DiscountRule.objects.create(category='Toys',
+                                           discount_percent='0.50')
+        self.assertEqual(get_rules().price(self.user.pk, items).total,
+                         Decimal('5.09'))
+        rule.delete()
+        self.assertEqual(get_rules().price(self.user.pk, items).total,
+                         Decimal('10.17'))
+
+    @tag('pricing_other_process')
+    def test_rules_changed_by_other_process_are_reloaded(self):
+        with self.settings(PRICING_RULES_CHECK_INTERVAL=0):
+            rules = get_rules()
+            self.assertIs(get_rules(), rules)
+            bump_catalog_version('discounts')
+            self.assertIsNot(get_rules(), rules)
+
+    @tag('pricing_views_agree')
+    def test_payment_accepts_total_of_total_view(self):
+        self.user.user_permissions.add(
+            Permission.objects.get(codename='change_basket'),
+            Permission.objects.get(codename='view_basket'))
+        Discount.objects.create(user=self.user, discount_percent='0.10')
+        DiscountRule.objects.create(shop=self.shop, min_quantity=2,
+                                    discount_percent='0.25')
+        basket = Basket.objects.create(owner=self.user)
+        add_product(basket, self.ball, 2)
+        add_product(basket, self.apple)
+        self.client.login(username='buyer', password='test_password')
+        response = self.client.get(reverse('view_total_basket_price'))
+        total = json.loads(response.json()[0]['total_cost'])['total']
+        # (30.51 + 15) - 10 %
+        self.assertEqual(Decimal(str(total)), Decimal('40.96'))
+        response = self.client.post(reverse('pay_for_products'),
+                                    json.dumps({'money': total}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 202)
@@ -0,0 +1,93 @@
+import json
+from decimal import Decimal
+from io import StringIO
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, tag
+from django.urls import reverse
+from basket_app.cart_store import read_items
+from basket_app.items import add_product
+from basket_app.models import Basket, Discount, DiscountRule
+from basket_app.pricing import get_rules, clear_rules, quote_basket
+from basket_app.quotes import quote_baskets
+from product_app.models import Product
+
+
+class TestBatchQuotes(TestCase):
+
+    def setUp(self):
+        clear_rules()
+        self.staff = User.objects.create_user(username='admin',
+                                              password='admin_password',
+                                              is_staff=True)
+        ball = Product.objects.create(name='Ball', price='20.34',
+                                      category='Toys', description='Round')
+        apple = Product.objects.create(name='Apple', price=15,
+                                       category='Fruits', description='')
+        DiscountRule.objects.create(category='Toys', min_quantity=2,
+                                    discount_percent='0.25')
+        self.baskets = []
+        for index in range(3):
+            owner = User.objects.create_user(username=f'buyer{index}')
+            basket = Basket.objects.create(owner=owner)
+            add_product(basket, ball, index + 1)
+            if index:
+                add_product(basket, apple)
+            self.baskets.append(basket)
+        Discount.objects.create(user=self.baskets[2].owner,
+                                discount_percent='0.10')
+        self.paid = Basket.objects.create(owner=self.staff, active=False)
+
+    @tag('batch_quotes_match_single')
+    def test_batch_quotes_match_quotes_of_single_baskets(self):
+        get_rules()
+        # Chunks of two baskets: baskets and lines of each, the last
+        # (empty) chunk of baskets
+        with self.assertNumQueries(5):
+            quotes = list(quote_baskets(chunk_size=2))
+        self.assertEqual([quote.basket for quote in quotes],
+                         [basket.pk for basket in self.baskets])
+        for quote, basket in zip(quotes, self.baskets):
+            single = quote_basket(basket.owner_id, read_items(basket.pk))
+            self.assertEqual((quote.subtotal, quote.discount, quote.total),
+                             (single.subtotal, single.discount,
+                              single.total))
+        self.assertEqual(quotes[2].item_count, 4)
+        # (61.02 - 25 % + 15) - 10 %
+        self.assertEqual(quotes[2].total, Decimal('54.69'))
+
+        quotes = list(quote_baskets([self.paid.pk, self.baskets[0].pk, 0]))
+        self.assertEqual([(quote.basket, quote.total) for quote in quotes],
+                         [(self.baskets[0].pk, Decimal('20.34')),
+                          (self.paid.pk, Decimal('0.00'))])
+
+    @tag('batch_quotes_endpoint')
+    def test_endpoint_streams_quotes_for_staff(self):
+        url = reverse('quote_baskets')
+        self.client.force_login(self.baskets[0].owner)
+        self.assertEqual(self.client.post(url).status_code, 302)
+
+        self.client.force_login(self.staff)
+        response = self.client.post(
+            url, json.dumps({'baskets': [self.baskets[1].pk]}),
+            content_type='application/json')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in
+                 b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(lines, [{'basket': self.baskets[1].pk,
+                                  'owner': self.baskets[1].owner_id,
+                                  'item_count': 3,
+                                  'subtotal': '55.68',
+                                  'discount': '10.17',
+                                  'total': '45.51'}])
+        response = self.client.post(url, '{"baskets": "1"}',
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    @tag('batch_quotes_command')
+    def test_command_writes_quotes_of_active_baskets(self):
+        out = StringIO()
+        call_command('quote_baskets', stdout=out)
+        self.assertEqual([json.loads(line)['basket']
+                          for line in out.getvalue().splitlines()],
+                         [basket.pk for basket in self.baskets])
@@ -1,9 +1,12 @@
 from django.urls import path
 from basket_app.views import (get_list_of_all_user_baskets,
                               add_product_to_basket,
+                              remove_product_from_basket,
                               view_active_basket,
                               view_total_basket_price,
-                              user_payment_view)
+                              user_payment_view,
+                              view_order_status,
+                              quote_baskets_view)
 
 urlpatterns = [path('user-basket-list/',
                     get_list_of_all_user_baskets,
@@ -11,6 +14,9 @@ urlpatterns = [path('user-basket-list/',
                path('add-product-to-basket/<int:prod_pk>',
                     add_product_to_basket,
                     name='add_prod_to_bask'),
+               path('remove-product-from-basket/<int:prod_pk>',
+                    remove_product_from_basket,
+                    name='remove_prod_from_bask'),
                path('view-active-basket',
                     view_active_basket,
                     name='view_active_basket'),
@@ -19,4 +25,10 @@ urlpatterns = [path('user-basket-list/',
                     name='view_total_basket_price'),
                path('pay-for-products',
                     user_payment_view,
-                    name='pay_for_products')]
+                    name='pay_for_products'),
+               path('order-status/<int:job_pk>',
+                    view_order_status,
+                    name='order_status'),
+               path('quotes/',
+                    quote_baskets_view,
+                    name='quote_baskets')]
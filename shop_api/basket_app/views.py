@@ -1,34 +1,113 @@
 import json
 from decimal import Decimal
 from django.contrib.auth.decorators import login_required, permission_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.views.decorators.http import require_http_methods
 from django.core import serializers
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
+from django.urls import reverse
 from http import HTTPStatus
-from basket_app.models import Basket
-from django.db.models import Sum
+from basket_app.models import Basket, BasketItem, Job
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from basket_app.baskets import (get_active_basket, get_active_basket_id,
+                                change_active_basket, forget_active_basket)
+from basket_app.cart_store import (BasketClosing, get_cart_store,
+                                   read_items)
+from basket_app.orders import enqueue_finalization
+from basket_app.pricing import quote_basket
+from basket_app.quotes import quote_baskets, iter_quote_lines
+from basket_app.idempotency import (get_idempotency_key, find_response,
+                                    store_response, replay_or_conflict,
+                                    MAX_KEY_LENGTH)
 from product_app.models import Product
+from product_app.serialization import PRODUCT_FIELDS
+from shop_api.pagination import paginate_queryset, NEXT_CURSOR_HEADER
 from shop_api.utils import DecimalJSONEncoder
 from django.views.decorators.csrf import csrf_exempt
 
 
+def _item_dicts(items, fields=PRODUCT_FIELDS):
+    """Serializes products of items with their quantities."""
+    products = serializers.serialize('python',
+                                     [item.product for item in items],
+                                     fields=fields,
+                                     use_natural_foreign_keys=True)
+    for product, item in zip(products, items):
+        product['quantity'] = item.quantity
+    return products
+
+
+def _serialize_items(items, fields=PRODUCT_FIELDS):
+    return json.dumps(_item_dicts(items, fields), cls=DjangoJSONEncoder)
+
+
+def _parse_quantity(request, default=None):
+    """Returns positive quantity from query string, None if it is wrong."""
+    try:
+        quantity = int(request.GET.get('quantity', default))
+    except (TypeError, ValueError):
+        return None
+    return quantity if quantity > 0 else None
+
+
+def _basket_closing():
+    return HttpResponse('Your basket is being paid, try again later',
+                        status=HTTPStatus.CONFLICT)
+
+
+def _serialize_basket(basket, totals):
+    data = {'pk': basket.pk, 'active': basket.active,
+            'products': _item_dicts(basket.items.all())}
+    if totals:
+        data['products_count'] = basket.item_count
+        data['total'] = basket.subtotal
+    return data
+
+
 @login_required
 @permission_required(('basket_app.view_basket',), raise_exception=True)
 @require_http_methods(['GET'])
 def get_list_of_all_user_baskets(request):
-    """Returns list of all products from basket of particular user."""
-    owner = request.user
-    baskets = Basket.objects.filter(owner__pk=owner).all()
-    basket_set = [(basket, basket.product_set.all())
-                  for basket in baskets]
-    data_to_return = []
-    for item in basket_set:
-        data_to_return.append(
-            serializers.serialize('json',
-                                  baskets,
-                                  use_natural_foreign_keys=True))
-    return HttpResponse(data_to_return,
-                        status=HTTPStatus.OK, content_type='application/json')
+    """Returns baskets of user with their products, the newest first.
+
+    Baskets are paginated with ?limit=N&after=<cursor> (cursor of the
+    next page is sent in X-Next-Cursor header), the first
+    PAGINATION_DEFAULT_LIMIT baskets are returned by default.
+    ?totals=1 adds number of products and their total price of every
+    basket (stored in the basket itself).
+    Products of the whole page are read with a single query.
+    """
+    totals = request.GET.get('totals') in ('1', 'true')
+    store = get_cart_store()
+    if store.write_behind:
+        # Changes of the active basket may not be written yet
+        basket_pk = get_active_basket_id(request)
+        if basket_pk is not None:
+            store.flush_basket(basket_pk)
+    baskets = Basket.objects.filter(owner=request.user).order_by('-pk')
+    try:
+        page = paginate_queryset(
+            request, baskets,
+            default_limit=getattr(settings, 'PAGINATION_DEFAULT_LIMIT', 50))
+    except ValidationError:
+        return HttpResponse('Wrong pagination parameters.',
+                            status=HTTPStatus.BAD_REQUEST)
+    prefetch_related_objects(page.rows, Prefetch(
+        'items', queryset=BasketItem.objects.select_related('product__shop')
+                                            .order_by('product__name',
+                                                      'product__price')))
+    data_to_return = [_serialize_basket(basket, totals)
+                      for basket in page.rows]
+    response = HttpResponse(json.dumps(data_to_return, cls=DjangoJSONEncoder),
+                            status=HTTPStatus.OK,
+                            content_type='application/json')
+    if page.next_cursor:
+        response[NEXT_CURSOR_HEADER] = page.next_cursor
+    return response
 
 
 @login_required
@@ -36,41 +115,75 @@ def get_list_of_all_user_baskets(request):
 @require_http_methods(['GET'])
 def add_product_to_basket(request, prod_pk=None):
     """ Retrieve product from database via primary key.
-    Get user from request.user and add product to user.basket_set.
+    Get user from request.user and add product to user's active basket.
+    ?quantity=N adds N pieces of the product (1 by default).
 
     This view requires login and permissions for changing basket
     """
-    active_basket = request.user.basket_set.filter(active=True).first()
-    if not active_basket:
-        active_basket = Basket.objects.create(owner=request.user)
+    quantity = _parse_quantity(request, default=1)
+    if quantity is None:
+        return HttpResponse('Quantity should be a positive integer',
+                            status=HTTPStatus.BAD_REQUEST)
     product_to_add = Product.objects.filter(id=prod_pk,
                                             available=True).first()
     if product_to_add:
-        active_basket.product_set.add(product_to_add)
-        response = serializers.serialize('json',
-                                         active_basket.product_set.all(),
-                                         use_natural_foreign_keys=True)
-
-        return HttpResponse(response,
+        try:
+            basket_pk, _ = change_active_basket(
+                request,
+                lambda pk: get_cart_store().add(pk, product_to_add,
+                                                quantity),
+                create=True)
+        except BasketClosing:
+            return _basket_closing()
+        items = get_cart_store().get_items(basket_pk)
+        return HttpResponse(_serialize_items(items),
                             status=HTTPStatus.OK,
                             content_type='application/json')
     return HttpResponse('Product you are looking for is absent at the moment',
                         status=HTTPStatus.NOT_FOUND)
 
 
+@csrf_exempt
+@login_required
+@permission_required(('basket_app.change_basket',), raise_exception=True)
+@require_http_methods(['POST'])
+def remove_product_from_basket(request, prod_pk=None):
+    """Removes product from user's active basket.
+    ?quantity=N removes N pieces only, the product is removed completely
+    when no pieces are left.
+    """
+    quantity = _parse_quantity(request)
+    if quantity is None and 'quantity' in request.GET:
+        return HttpResponse('Quantity should be a positive integer',
+                            status=HTTPStatus.BAD_REQUEST)
+    try:
+        basket_pk, removed = change_active_basket(
+            request,
+            lambda pk: get_cart_store().remove(pk, prod_pk, quantity))
+    except BasketClosing:
+        return _basket_closing()
+    if not removed:
+        return HttpResponse('Product is not in your basket',
+                            status=HTTPStatus.NOT_FOUND)
+    items = get_cart_store().get_items(basket_pk)
+    return HttpResponse(_serialize_items(items),
+                        status=HTTPStatus.OK,
+                        content_type='application/json')
+
+
 @login_required
 @permission_required(('basket_app.view_basket',))
 def view_active_basket(request):
     """Returns user's basket with products that have not been paid yet.
 
     """
-    active_basket = request.user.basket_set.filter(active=True).first()
-    if not active_basket or len(active_basket.product_set.all()) == 0:
+    active_basket = get_active_basket(request)
+    if not active_basket or \
+            get_cart_store().get_totals(active_basket).item_count == 0:
         return HttpResponse('Your basket is empty',
                             status=HTTPStatus.NOT_FOUND)
-    response = serializers.serialize('json',
-                                     active_basket.product_set.all(),
-                                     use_natural_foreign_keys=True)
+    response = _serialize_items(
+        get_cart_store().get_items(active_basket.pk))
     return HttpResponse(response,
                         status=HTTPStatus.OK,
                         content_type='application/json')
@@ -81,25 +194,17 @@ def view_active_basket(request):
 def view_total_basket_price(request):
     """Returns user's basket with products that have not been paid yet.
 
+    Total cost is priced with discounts of the user and of basket lines
+    (see basket_app.pricing), as the payment is.
     """
-    discount = 0
-    if hasattr(request.user, 'discount'):
-        discount = request.user.discount.discount_percent
-
-    active_basket = request.user.basket_set.filter(active=True).first()
-    if not active_basket or len(active_basket.product_set.all()) == 0:
+    active_basket = get_active_basket(request)
+    items = active_basket and get_cart_store().get_items(active_basket.pk)
+    if not items:
         return HttpResponse('Your basket is empty',
                             status=HTTPStatus.NOT_FOUND)
-    product_list = serializers.serialize('json',
-                                         active_basket.product_set.all(),
-                                         fields=['name', 'price'],
-                                         use_natural_foreign_keys=True)
-    # Following code block calculates total cost(total - total * percent)
-    # according to the user discount, if any(default=0).
-    # Than serialize it to JSON.
-    total_cost = json.dumps(active_basket.product_set.aggregate(
-                            total=(Sum('price') - Sum('price') * discount)),
-                            cls=DecimalJSONEncoder)
+    product_list = _serialize_items(items, fields=['name', 'price'])
+    quote = quote_basket(request.user.pk, items)
+    total_cost = json.dumps({'total': quote.total}, cls=DecimalJSONEncoder)
     response = [{"product_list": product_list,
                 "total_cost": total_cost}]
     return HttpResponse(json.dumps(response),
@@ -107,29 +212,41 @@ def view_total_basket_price(request):
                         content_type='application/json')
 
 
-@csrf_exempt
-@login_required
-@permission_required(('basket_app.change_basket',))
-@require_http_methods(['POST'])
-def user_payment_view(request):
-    """ This view just an emulation of real payment process.
-    It receives amount of money in JSON format: {"money": <amount_of_money>}
-    if money == total cost it returns OK
-    if money < total cost it returns BAD_REQUEST
-    """
-    discount = 0
-    if hasattr(request.user, 'discount'):
-        discount = request.user.discount.discount_percent
-
-    active_basket = request.user.basket_set.filter(active=True).first()
+def _pay_for_basket(request):
+    # Concurrent changes and payments of the basket wait for the payment
+    active_basket = (Basket.objects.select_for_update()
+                                   .filter(owner=request.user, active=True)
+                                   .order_by().first())
+    if not active_basket:
+        return HttpResponse('Your basket is empty',
+                            status=HTTPStatus.NOT_FOUND)
     money = json.loads(str(request.body, encoding='utf-8'))['money']
-    total_cost = active_basket.product_set.aggregate(
-                             total=(Sum('price') - Sum('price') * discount))
-    if Decimal(str(money)) == total_cost['total']:
-        message = 'Transaction was successfull'
-        active_basket.active = False
-        active_basket.save()
-        return HttpResponse(message, status=HTTPStatus.OK)
+    store = get_cart_store()
+    # Changes are rejected from now on, the basket is paid with items
+    # written to the database
+    store.close_basket(active_basket.pk)
+    paid = False
+    try:
+        store.flush_basket(active_basket.pk)
+        quote = quote_basket(request.user.pk, read_items(active_basket.pk))
+        total_cost = {'total': quote.total}
+        if Decimal(str(money)) == total_cost['total']:
+            active_basket.active = False
+            active_basket.save()
+            # The rest is done by workers after the payment is committed
+            job = enqueue_finalization(active_basket)
+            transaction.on_commit(lambda: store.discard(active_basket.pk))
+            forget_active_basket(request)
+            paid = True
+    finally:
+        if not paid:
+            store.reopen_basket(active_basket.pk)
+    if paid:
+        return HttpResponse(
+            json.dumps({'message': 'Transaction was successfull',
+                        'status_url': request.build_absolute_uri(
+                            reverse('order_status', args=[job.pk]))}),
+            status=HTTPStatus.ACCEPTED, content_type='application/json')
     elif Decimal(str(money)) < total_cost['total']:
         message = 'The sum of money you have sent is not enough'
         return HttpResponse(message, status=HTTPStatus.BAD_REQUEST)
@@ -139,3 +256,83 @@ def user_payment_view(request):
         message = (f"You still have some money: {result}!"
                    f" Would you like to buy something else?")
         return HttpResponse(message, status=HTTPStatus.OK)
+
+
+@csrf_exempt
+@login_required
+@permission_required(('basket_app.change_basket',))
+@require_http_methods(['POST'])
+def user_payment_view(request):
+    """ This view just an emulation of real payment process.
+    It receives amount of money in JSON format:
+    {"money": <amount_of_money>}
+    if money == total cost it returns ACCEPTED with URL of order status
+    if money < total cost it returns BAD_REQUEST
+
+    The basket is locked and priced (see basket_app.pricing) in the
+    transaction which closes it. A request with Idempotency-Key header is
+    processed once, its retries get the first response
+    (see basket_app.idempotency).
+    """
+    key = get_idempotency_key(request)
+    if key is not None:
+        if len(key) > MAX_KEY_LENGTH:
+            return HttpResponse('Idempotency-Key is too long',
+                                status=HTTPStatus.BAD_REQUEST)
+        response = find_response(request, key)
+        if response is not None:
+            return response
+    try:
+        with transaction.atomic():
+            response = _pay_for_basket(request)
+            if key is not None:
+                store_response(request, key, response)
+    except IntegrityError:
+        if key is None:
+            raise
+        # Stored by a concurrent request with the same key
+        return replay_or_conflict(request, key)
+    return response
+
+
+@login_required
+@require_http_methods(['GET'])
+def view_order_status(request, job_pk=None):
+    """Returns status of finalization of a paid basket:
+    queued, done or failed."""
+    job = Job.objects.filter(pk=job_pk, owner=request.user).first()
+    if job is None:
+        return HttpResponse('Order is not found',
+                            status=HTTPStatus.NOT_FOUND)
+    data = {'status': job.status, 'attempts': job.attempts,
+            'created': job.created, 'finished': job.finished}
+    return HttpResponse(json.dumps(data, cls=DjangoJSONEncoder),
+                        status=HTTPStatus.OK,
+                        content_type='application/json')
+
+
+@csrf_exempt
+@staff_member_required(login_url='/login/')
+@require_http_methods(['POST'])
+def quote_baskets_view(request):
+    """Streams totals of many baskets as NDJSON, one basket per line.
+    Require staff permissions.
+
+    Receives JSON {"baskets": [<basket id>, ...]}, every active basket is
+    quoted without "baskets".
+    """
+    try:
+        data = json.loads(request.body or b'{}')
+        basket_ids = data.get('baskets')
+        if basket_ids is not None:
+            if not isinstance(basket_ids, list):
+                raise TypeError()
+            basket_ids = [int(pk) for pk in basket_ids]
+    except (ValueError, TypeError, AttributeError):
+        return HttpResponse('Wrong list of baskets.',
+                            status=HTTPStatus.BAD_REQUEST)
+    # Changes kept in the cart store are quoted too
+    get_cart_store().flush_pending()
+    return StreamingHttpResponse(iter_quote_lines(quote_baskets(basket_ids)),
+                                 status=HTTPStatus.OK,
+                                 content_type='application/x-ndjson')
@@ -0,0 +1 @@
+default_app_config = 'product_app.apps.ProductAppConfig'
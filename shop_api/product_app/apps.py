@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class ProductAppConfig(AppConfig):
     name = 'product_app'
+
+    def ready(self):
+        import product_app.signals  # noqa: F401
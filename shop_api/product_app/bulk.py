@@ -0,0 +1,484 @@
+"""Bulk and partial writes of products.
+
+Rows of bulk ingest are parsed incrementally from NDJSON or from a JSON
+array, validated one by one and inserted with bulk_create, one transaction
+per batch. A broken row does not stop the ingest, it is reported with its
+number.
+
+Updates write only the changed columns with a single UPDATE, without loading
+the row. Every update increments Product.version; if client passes the
+version it has read, the row is updated only if it was not changed since
+(optimistic concurrency, no row locks are held between read and write).
+Bulk updates of prices and availability are applied to a batch of products
+with one UPDATE using CASE WHEN per column. Rows whose previous prices or
+versions are read before the UPDATE are locked for the transaction of the
+update, so price statistics get exactly the prices it replaced.
+
+bulk_create and update() do not send model signals, so data derived from
+products (catalog version, trigram and full-text indexes, price
+statistics, see product_app.signals) is updated by
+sync_created_products and sync_updated_products once per batch. SQLite
+does not return primary keys of bulk inserted rows, they are read back
+while the batch transaction holds the write lock of the database; on other
+databases without returned keys new products are saved one by one.
+"""
+import codecs
+import json
+from functools import partial
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import F, Q, Case, When, Value
+from product_app.catalog import bump_catalog_version, PRODUCTS
+from product_app.models import Product
+from product_app.price_stats import add_prices, remove_prices
+from product_app.search import (uses_native_search, index_products,
+                                unindex_product, FIELD_WEIGHTS)
+from product_app.trigram import TRIGRAM_INDEXES
+from shop_app.models import Shop
+
+# Fields accepted from clients, shop is given by primary key
+INGEST_FIELDS = ('name', 'price', 'available', 'category', 'description',
+                 'shop')
+
+READ_CHUNK_SIZE = 64 * 1024
+
+# Fields changed by partial updates: every field of product but its
+# primary key and version, shop is given by primary key
+UPDATE_FIELDS = tuple(field.name for field in Product._meta.concrete_fields
+                      if not field.primary_key and field.name != 'version')
+BULK_UPDATE_FIELDS = ('price', 'available')
+
+# Fields read back for full-text index and price statistics
+SYNCED_FIELDS = {'price', 'category', 'shop_id', *FIELD_WEIGHTS}
+PRICE_FIELDS = ('price', 'category', 'shop_id')
+TRIGRAM_FIELDS = set(TRIGRAM_INDEXES[Product].fields)
+
+
+def _iter_text(stream, chunk_size):
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            tail = decoder.decode(b'', final=True)
+            if tail:
+                yield tail
+            return
+        yield decoder.decode(chunk)
+
+
+def iter_json_rows(stream, chunk_size=READ_CHUNK_SIZE, max_row_size=None):
+    """Parses rows from binary stream without reading it whole.
+
+    Stream holds either a JSON array or NDJSON (one JSON value per line).
+    Yields (row number, value), value is ValidationError if the row
+    could not be parsed or is longer than max_row_size characters
+    (DATA_UPLOAD_MAX_MEMORY_SIZE by default). Parsing of an array stops at
+    the first such row, as the rest of it can not be located reliably.
+    """
+    if max_row_size is None:
+        max_row_size = settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+    chunks = _iter_text(stream, chunk_size)
+    buffer = ''
+    for chunk in chunks:
+        buffer += chunk
+        if buffer.strip():
+            break
+    buffer = buffer.lstrip()
+    if buffer.startswith('['):
+        yield from _iter_array(buffer[1:], chunks, max_row_size)
+    else:
+        yield from _iter_lines(buffer, chunks, max_row_size)
+
+
+def _iter_lines(buffer, chunks, max_row_size=None):
+    number = 0
+    # Pieces of the line which is not finished yet
+    pending = []
+    pending_size = 0
+    too_long = False
+    chunk = buffer
+    while chunk is not None:
+        # Only the new chunk is searched for line ends
+        start = 0
+        end = chunk.find('\n')
+        while end != -1:
+            if too_long:
+                number += 1
+                yield number, _row_too_long(max_row_size)
+            else:
+                line = ''.join(pending) + chunk[start:end]
+                if line.strip():
+                    number += 1
+                    if (max_row_size is not None and
+                            len(line) > max_row_size):
+                        yield number, _row_too_long(max_row_size)
+                    else:
+                        yield number, _decode_line(line)
+            pending, pending_size, too_long = [], 0, False
+            start = end + 1
+            end = chunk.find('\n', start)
+        if not too_long:
+            pending.append(chunk[start:])
+            pending_size += len(chunk) - start
+            # The rest of the line is skipped up to its end
+            if max_row_size is not None and pending_size > max_row_size:
+                pending, too_long = [], True
+        chunk = next(chunks, None)
+    if too_long:
+        yield number + 1, _row_too_long(max_row_size)
+        return
+    line = ''.join(pending)
+    if line.strip():
+        yield number + 1, _decode_line(line)
+
+
+def _row_too_long(max_row_size):
+    return ValidationError(f'Row is longer than {max_row_size} characters')
+
+
+def _decode_line(line):
+    try:
+        return json.loads(line)
+    except ValueError as error:
+        return ValidationError(f'Invalid JSON: {error}')
+
+
+def _iter_array(buffer, chunks, max_row_size=None):
+    decoder = json.JSONDecoder()
+    number = 0
+    position = 0
+    finished = False
+    while True:
+        # Separators between values
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if position < len(buffer) and buffer[position] == ']':
+            return
+        try:
+            value, end = decoder.raw_decode(buffer, position)
+            # A number at the end of buffer may continue in the next chunk
+            if end < len(buffer) or finished:
+                number += 1
+                yield number, value
+                # Buffer is trimmed once per chunk, not once per row
+                position = end
+                continue
+        except ValueError as error:
+            if finished:
+                if buffer[position:].strip():
+                    yield number + 1, ValidationError(
+                        f'Invalid JSON: {error}')
+                return
+            if (max_row_size is not None and
+                    len(buffer) - position > max_row_size):
+                yield number + 1, _row_too_long(max_row_size)
+                return
+        chunk = next(chunks, None)
+        if chunk is None:
+            finished = True
+        else:
+            buffer = buffer[position:] + chunk
+            position = 0
+
+
+def build_product(data):
+    """Returns validated unsaved Product made of client data.
+
+    Existence of the shop is checked later for the whole batch.
+    """
+    if not isinstance(data, dict):
+        raise ValidationError('Row should be an object')
+    unknown = sorted(set(data) - set(INGEST_FIELDS))
+    if unknown:
+        raise ValidationError({field: ['Unknown field.'] for field in unknown})
+    product = Product(**_client_fields(data))
+    product.clean_fields(exclude=['image', 'shop'])
+    return product
+
+
+def _client_fields(data):
+    fields = dict(data)
+    if isinstance(fields.get('price'), float):
+        # JSON numbers are parsed as floats, 104.99 should stay 104.99
+        fields['price'] = repr(fields['price'])
+    if 'shop' in fields:
+        shop_id = fields.pop('shop')
+        fields['shop_id'] = None if shop_id is None else \
+            Product._meta.get_field('shop').to_python(shop_id)
+    return fields
+
+
+def clean_changes(data, allowed=UPDATE_FIELDS):
+    """Validates fields changed by client.
+
+    "version" is the version of product the client has read, if given.
+    Returns ({attname: value}, version or None).
+    Raises ValidationError on unknown field, wrong value or missing shop.
+    """
+    if not isinstance(data, dict):
+        raise ValidationError('Changes should be an object')
+    data = dict(data)
+    version = data.pop('version', None)
+    if version is not None:
+        version = Product._meta.get_field('version').to_python(version)
+    unknown = sorted(set(data) - set(allowed))
+    if unknown:
+        raise ValidationError({field: ['Unknown field.'] for field in unknown})
+    changes = _client_fields(data)
+    errors = {}
+    for name in set(changes) - {'shop_id'}:
+        try:
+            changes[name] = Product._meta.get_field(name).clean(
+                changes[name], None)
+        except ValidationError as error:
+            errors[name] = error.messages
+    shop_id = changes.get('shop_id')
+    if shop_id is not None and not Shop.objects.filter(pk=shop_id).exists():
+        errors['shop'] = [f'Shop {shop_id} does not exist.']
+    if errors:
+        raise ValidationError(errors)
+    return changes, version
+
+
+def update_product(pk, changes, version=None):
+    """Writes changed columns of product with single UPDATE.
+
+    Returns number of updated rows: 0 if product does not exist or
+    its version is not the expected one.
+    """
+    if 'image' in changes:
+        # Thumbnails of the previous image are not served for a new one
+        changes.setdefault('image_hash', '')
+    with transaction.atomic():
+        products = Product.objects.filter(pk=pk)
+        old_prices = []
+        if set(changes) & set(PRICE_FIELDS):
+            # Price statistics need the previous price of product, the row
+            # is locked so that it is the price our UPDATE replaces
+            old_prices = list(products.select_for_update()
+                                      .values('pk', *PRICE_FIELDS))
+        if version is not None:
+            products = products.filter(version=version)
+        updated = products.update(version=F('version') + 1, **changes)
+        if updated:
+            sync_updated_products([pk], changes, old_prices)
+            if changes.get('image') and not changes['image_hash']:
+                # product_app.thumbnails imports this module
+                from product_app.thumbnails import schedule_thumbnails
+                transaction.on_commit(partial(schedule_thumbnails, pk,
+                                              str(changes['image'])))
+    return updated
+
+
+def error_report(number, error):
+    if hasattr(error, 'error_dict'):
+        errors = error.message_dict
+    else:
+        errors = {'__all__': error.messages}
+    return {'row': number, 'errors': errors}
+
+
+def ingest_products(rows, batch_size=None):
+    """Validates and inserts products from rows.
+
+    rows - iterable of (row number, data) as yielded by iter_json_rows.
+    Returns (number of created products, list of error reports).
+    """
+    batch_size = batch_size or getattr(settings, 'BULK_CREATE_BATCH_SIZE',
+                                       1000)
+    created = 0
+    errors = []
+    batch = []
+    for number, data in rows:
+        try:
+            if isinstance(data, ValidationError):
+                raise data
+            batch.append((number, build_product(data)))
+        except ValidationError as error:
+            errors.append(error_report(number, error))
+        if len(batch) >= batch_size:
+            created += _create_batch(batch, errors)
+            batch = []
+    if batch:
+        created += _create_batch(batch, errors)
+    return created, errors
+
+
+def _create_batch(batch, errors):
+    shop_ids = {product.shop_id for _, product in batch
+                if product.shop_id is not None}
+    existing = set(Shop.objects.filter(pk__in=shop_ids)
+                               .values_list('pk', flat=True))
+    products = []
+    for number, product in batch:
+        if product.shop_id is not None and product.shop_id not in existing:
+            errors.append(error_report(number, ValidationError(
+                {'shop': [f'Shop {product.shop_id} does not exist.']})))
+        else:
+            products.append(product)
+    if not products:
+        return 0
+    with transaction.atomic():
+        create_products(products)
+    return len(products)
+
+
+def create_products(products):
+    """Inserts products and updates data derived from them.
+
+    Should be called inside a transaction.
+    """
+    if connection.features.can_return_rows_from_bulk_insert:
+        Product.objects.bulk_create(products)
+        pks = [product.pk for product in products]
+    elif connection.vendor == 'sqlite':
+        # SQLite has a single writer: the first INSERT locks the database
+        # until commit, so rows with the biggest primary keys right after
+        # the insert are the new ones.
+        assert connection.in_atomic_block
+        Product.objects.bulk_create(products)
+        pks = sorted(Product.objects.order_by('-pk')
+                                    .values_list('pk', flat=True)
+                                    [:len(products)])
+    else:
+        # Primary keys of bulk inserted rows are not known, rows are saved
+        # one by one and model signals update derived data.
+        for product in products:
+            product.save(force_insert=True)
+        return [product.pk for product in products]
+    sync_created_products(pks)
+    return pks
+
+
+def sync_created_products(pks, chunk_size=500):
+    """Updates derived data after products were inserted bypassing
+    model signals."""
+    bump_catalog_version(PRODUCTS)
+    # Rebuilt lazily on the next substring search
+    TRIGRAM_INDEXES[Product].reset()
+    for start in range(0, len(pks), chunk_size):
+        rows = list(Product.objects.filter(pk__in=pks[start:start +
+                                                       chunk_size])
+                                   .values('pk', *SYNCED_FIELDS))
+        if not uses_native_search():
+            index_products(rows)
+        add_prices(rows)
+
+
+def update_products_in_bulk(rows, batch_size=None):
+    """Applies changes of price and availability to many products.
+
+    rows - iterable of (row number, data), data holds "pk", changed fields
+    and optionally "version" the client has read.
+    Returns (number of updated products, list of error reports).
+    """
+    batch_size = batch_size or getattr(settings, 'BULK_UPDATE_BATCH_SIZE',
+                                       500)
+    updated = 0
+    errors = []
+    batch = []
+    for number, data in rows:
+        try:
+            if isinstance(data, ValidationError):
+                raise data
+            if not isinstance(data, dict):
+                raise ValidationError('Row should be an object')
+            data = dict(data)
+            pk = data.pop('pk', None)
+            if pk is None:
+                raise ValidationError({'pk': ['This field is required.']})
+            pk = Product._meta.pk.to_python(pk)
+            changes, version = clean_changes(data, BULK_UPDATE_FIELDS)
+            batch.append((number, pk, changes, version))
+        except ValidationError as error:
+            errors.append(error_report(number, error))
+        if len(batch) >= batch_size:
+            updated += _update_batch(batch, errors)
+            batch = []
+    if batch:
+        updated += _update_batch(batch, errors)
+    return updated, errors
+
+
+def _conflict(number):
+    return error_report(number, ValidationError(
+        {'version': ['Product was changed by another request.']}))
+
+
+@transaction.atomic
+def _update_batch(batch, errors):
+    # Rows are locked until commit, so versions and prices read here are
+    # the ones the UPDATE below replaces
+    current = {row['pk']: row for row in
+               Product.objects.select_for_update()
+                              .filter(pk__in=[pk for _, pk, _, _ in batch])
+                              .order_by('pk')
+                              .values('pk', 'version', *PRICE_FIELDS)}
+    accepted = {}
+    for number, pk, changes, version in batch:
+        row = current.get(pk)
+        if row is None:
+            errors.append(error_report(number, ValidationError(
+                {'pk': [f'Product {pk} does not exist.']})))
+        elif pk in accepted:
+            errors.append(error_report(number, ValidationError(
+                {'pk': [f'Product {pk} is changed twice in a batch.']})))
+        elif version is not None and version != row['version']:
+            errors.append(_conflict(number))
+        else:
+            accepted[pk] = (number, changes, row['version'])
+    if not accepted:
+        return 0
+
+    # One CASE WHEN per changed column, unchanged rows keep their values
+    columns = {}
+    for name in BULK_UPDATE_FIELDS:
+        whens = [When(pk=pk, then=Value(changes[name]))
+                 for pk, (_, changes, _) in accepted.items()
+                 if name in changes]
+        if whens:
+            columns[name] = Case(*whens, default=F(name),
+                                 output_field=Product._meta.get_field(name))
+    versions = Q()
+    for pk, (_, _, version) in accepted.items():
+        versions |= Q(pk=pk, version=version)
+    updated = Product.objects.filter(versions).update(
+        version=F('version') + 1, **columns)
+    old_prices = [current[pk] for pk, (_, changes, _) in accepted.items()
+                  if 'price' in changes]
+    sync_updated_products(list(accepted), columns, old_prices)
+    return updated
+
+
+def sync_updated_products(pks, changed, old_prices=(), chunk_size=500):
+    """Updates derived data after products were updated bypassing
+    model signals.
+
+    changed - names of changed fields (attnames)
+    old_prices - dicts with pk and previous price, category and shop_id
+    of products which price statistics are affected.
+    """
+    product_trigrams = TRIGRAM_INDEXES[Product]
+    if set(changed) & TRIGRAM_FIELDS:
+        bump_catalog_version(PRODUCTS)
+        # Rebuilt lazily on the next substring search
+        product_trigrams.reset()
+    else:
+        with product_trigrams.tracking():
+            bump_catalog_version(PRODUCTS)
+
+    if set(changed) & set(FIELD_WEIGHTS) and not uses_native_search():
+        for start in range(0, len(pks), chunk_size):
+            chunk = pks[start:start + chunk_size]
+            for pk in chunk:
+                unindex_product(pk)
+            index_products(list(Product.objects.filter(pk__in=chunk)
+                                               .values('pk', *FIELD_WEIGHTS)))
+    if old_prices:
+        remove_prices(old_prices)
+        priced = [row['pk'] for row in old_prices]
+        for start in range(0, len(priced), chunk_size):
+            add_prices(list(Product.objects.filter(
+                pk__in=priced[start:start + chunk_size])
+                .values(*PRICE_FIELDS)))
@@ -0,0 +1,65 @@
+"""Catalog versions used as validators for conditional GET requests.
+
+Every change of products or shops bumps version of the corresponding part
+of catalog (see product_app.signals). Listing and detail views are wrapped
+with django's condition() decorator, so If-None-Match and If-Modified-Since
+are answered with 304 after a single primary key lookup, without querying
+or serializing the rows.
+"""
+import hashlib
+from django.db.models import F
+from django.utils import timezone
+from product_app.models import CatalogVersion
+
+PRODUCTS = 'products'
+SHOPS = 'shops'
+
+
+def bump_catalog_version(*names):
+    """Increments versions of given parts of catalog."""
+    now = timezone.now()
+    for name in names:
+        updated = CatalogVersion.objects.filter(name=name).update(
+            version=F('version') + 1, modified=now)
+        if not updated:
+            CatalogVersion.objects.get_or_create(
+                name=name, defaults={'version': 1, 'modified': now})
+
+
+def get_catalog_version(request, name):
+    """Returns CatalogVersion of given part of catalog.
+
+    Result is memoized on request, thus ETag and Last-Modified
+    validators share a single query.
+    """
+    versions = request.__dict__.setdefault('_catalog_versions', {})
+    if name not in versions:
+        versions[name] = CatalogVersion.objects.filter(name=name).first()
+    return versions[name]
+
+
+def catalog_etag(name, include_body=False):
+    """Returns ETag function for condition() decorator.
+
+    Tag depends on full path of request too, because
+    query parameters (pagination, streaming) change the payload, and on
+    its body with include_body (filters sent in body of GET request).
+    """
+    def etag_func(request, *args, **kwargs):
+        catalog = get_catalog_version(request, name)
+        if catalog is None:
+            return None
+        digest = hashlib.md5(request.get_full_path().encode('utf-8'))
+        if include_body:
+            digest.update(b'\0' + request.body)
+        digest = digest.hexdigest()[:16]
+        return f'{name}-{catalog.version}-{digest}'
+    return etag_func
+
+
+def catalog_last_modified(name):
+    """Returns Last-Modified function for condition() decorator."""
+    def last_modified_func(request, *args, **kwargs):
+        catalog = get_catalog_version(request, name)
+        return catalog.modified if catalog else None
+    return last_modified_func
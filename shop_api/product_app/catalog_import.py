@@ -0,0 +1,237 @@
+"""Loading of large catalogs from CSV or NDJSON files.
+
+Shops are rows with name, city and owner. Products are rows with name,
+price, available, category, description and natural key of their shop:
+"shop_name" and "shop_city" columns of CSV or "shop": [name, city] in NDJSON
+(the same as in fixtures). Natural keys are resolved through an in-memory
+map of all shops instead of a query per row.
+
+Files are read as streams and loaded in chunks. On PostgreSQL products are
+loaded with COPY FROM STDIN, on other databases with bulk_create. Every
+chunk is committed together with the progress of its file (CatalogImport),
+so an interrupted import continues after the last committed chunk.
+
+Rows are inserted bypassing model signals, data derived from the catalog
+(search index, price statistics, catalog versions) is rebuilt once the
+import is finished, see finish_import.
+"""
+import csv
+import io
+import os
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from product_app.bulk import iter_json_rows, build_product, error_report
+from product_app.catalog import bump_catalog_version, PRODUCTS, SHOPS
+from product_app.models import Product, CatalogImport
+from product_app.price_stats import rebuild_price_stats
+from product_app.search import uses_native_search, rebuild_index
+from product_app.trigram import TRIGRAM_INDEXES
+from shop_app.models import Shop
+
+SHOP_FIELDS = ('name', 'city', 'owner')
+
+# Columns written by COPY, in this order
+COPY_COLUMNS = ('name', 'price', 'available', 'category', 'description',
+                'shop_id', 'image', 'image_hash', 'version')
+TEXT_COLUMNS = ('name', 'category', 'description', 'image', 'image_hash')
+
+BOOLEAN_VALUES = {'true': True, 't': True, '1': True, 'yes': True,
+                  'false': False, 'f': False, '0': False, 'no': False}
+
+
+def iter_rows(path):
+    """Yields (row number, dict) from CSV or NDJSON file.
+
+    Format is chosen by extension, ".csv" files are CSV.
+    Rows which can not be parsed are yielded as ValidationError.
+    """
+    if path.lower().endswith('.csv'):
+        with open(path, newline='', encoding='utf-8') as stream:
+            yield from enumerate(csv.DictReader(stream), 1)
+    else:
+        with open(path, 'rb') as stream:
+            yield from iter_json_rows(stream)
+
+
+def get_progress(kind, path, restart=False):
+    """Returns CatalogImport of file, creates it for a new file.
+
+    Raises ValidationError if the file was changed after its import started.
+    """
+    source = f'{kind}:{os.path.abspath(path)}'
+    size = os.path.getsize(path)
+    progress, created = CatalogImport.objects.get_or_create(
+        source=source, defaults={'size': size})
+    if restart or created:
+        progress.size, progress.rows, progress.finished = size, 0, False
+        progress.save()
+    elif progress.size != size:
+        raise ValidationError(f'{path} was changed since its import started, '
+                              f'import it from the beginning.')
+    return progress
+
+
+def get_shop_keys():
+    """Returns {(name, city): pk} of all shops."""
+    return {(name, city): pk for pk, name, city in
+            Shop.objects.values_list('pk', 'name', 'city').iterator()}
+
+
+def _chunks(rows, progress, chunk_size):
+    """Skips already imported rows and groups the rest into chunks."""
+    chunk = []
+    for number, row in rows:
+        if number <= progress.rows:
+            continue
+        chunk.append((number, row))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _commit_progress(progress, chunk):
+    progress.rows = chunk[-1][0]
+    progress.save(update_fields=['rows', 'modified'])
+
+
+def import_shops(path, chunk_size=10000, restart=False, report=None):
+    """Imports shops which are not in database yet.
+
+    report(imported rows, errors) is called after every chunk.
+    Returns (number of created shops, list of error reports).
+    """
+    progress = get_progress('shops', path, restart)
+    keys = set(get_shop_keys())
+    created = 0
+    errors = []
+    for chunk in _chunks(iter_rows(path), progress, chunk_size):
+        shops = []
+        for number, row in chunk:
+            try:
+                shop = _build_shop(row)
+            except ValidationError as error:
+                errors.append(error_report(number, error))
+                continue
+            if (shop.name, shop.city) not in keys:
+                keys.add((shop.name, shop.city))
+                shops.append(shop)
+        with transaction.atomic():
+            Shop.objects.bulk_create(shops)
+            _commit_progress(progress, chunk)
+        created += len(shops)
+        if report:
+            report(progress.rows, len(errors))
+    progress.finished = True
+    progress.save(update_fields=['finished', 'modified'])
+    return created, errors
+
+
+def _build_shop(row):
+    if isinstance(row, ValidationError):
+        raise row
+    if not isinstance(row, dict):
+        raise ValidationError('Row should be an object')
+    shop = Shop(**{field: row.get(field) for field in SHOP_FIELDS})
+    shop.clean_fields()
+    return shop
+
+
+def import_products(path, chunk_size=10000, restart=False, report=None):
+    """Imports products, shops are resolved by natural key.
+
+    report(imported rows, errors) is called after every chunk.
+    Returns (number of created products, list of error reports).
+    """
+    progress = get_progress('products', path, restart)
+    shop_keys = get_shop_keys()
+    if connection.vendor == 'postgresql':
+        load = _copy_products
+    else:
+        load = _create_products
+    created = 0
+    errors = []
+    for chunk in _chunks(iter_rows(path), progress, chunk_size):
+        products = []
+        for number, row in chunk:
+            try:
+                products.append(_build_product(row, shop_keys))
+            except ValidationError as error:
+                errors.append(error_report(number, error))
+        with transaction.atomic():
+            load(products)
+            _commit_progress(progress, chunk)
+        created += len(products)
+        if report:
+            report(progress.rows, len(errors))
+    progress.finished = True
+    progress.save(update_fields=['finished', 'modified'])
+    return created, errors
+
+
+def _build_product(row, shop_keys):
+    if isinstance(row, ValidationError):
+        raise row
+    if not isinstance(row, dict):
+        raise ValidationError('Row should be an object')
+    row = dict(row)
+    if 'shop' in row:
+        key = row.pop('shop')
+    else:
+        key = [row.pop('shop_name', None), row.pop('shop_city', None)]
+    if not isinstance(key, (list, tuple)) or len(key) != 2:
+        raise ValidationError({'shop': ['Shop should be [name, city].']})
+    shop_id = None
+    if any(key):
+        shop_id = shop_keys.get(tuple(key))
+        if shop_id is None:
+            raise ValidationError(
+                {'shop': [f'Shop {key[0]}, {key[1]} does not exist.']})
+    if row.get('available') in (None, ''):
+        row.pop('available', None)
+    elif isinstance(row['available'], str):
+        available = row['available'].strip().lower()
+        row['available'] = BOOLEAN_VALUES.get(available,
+                                              row['available'])
+    row['shop'] = shop_id
+    return build_product(row)
+
+
+def _create_products(products):
+    Product.objects.bulk_create(products, batch_size=1000)
+
+
+def _copy_products(products):
+    """Loads products with PostgreSQL COPY FROM STDIN."""
+    data = io.StringIO()
+    writer = csv.writer(data)
+    for product in products:
+        writer.writerow([
+            product.name, product.price, product.available, product.category,
+            product.description,
+            '' if product.shop_id is None else product.shop_id,
+            product.image or '', product.image_hash, product.version])
+    data.seek(0)
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(Product._meta.get_field(name).column)
+                        for name in COPY_COLUMNS)
+    # Empty unquoted values are NULL in CSV format of COPY,
+    # only shop may be NULL.
+    not_null = ', '.join(quote(Product._meta.get_field(name).column)
+                         for name in TEXT_COLUMNS)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(f'COPY {quote(Product._meta.db_table)} '
+                           f'({columns}) FROM STDIN WITH (FORMAT csv, '
+                           f'FORCE_NOT_NULL ({not_null}))', data)
+
+
+def finish_import():
+    """Rebuilds data derived from catalog after rows were imported."""
+    bump_catalog_version(SHOPS, PRODUCTS)
+    for index in TRIGRAM_INDEXES.values():
+        index.reset()
+    # PostgreSQL keeps its full-text index by itself.
+    if not uses_native_search():
+        rebuild_index()
+    rebuild_price_stats()
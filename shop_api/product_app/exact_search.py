@@ -0,0 +1,99 @@
+"""Allow-listed filters of exact search and cache of their compiled SQL.
+
+Exact search accepts only filters listed in EXACT_SEARCH_LOOKUPS, all of
+them are served by indexes of Product (see Product.Meta.indexes), so a
+client can not trigger a scan over an arbitrary column or relation.
+
+Requests that differ only in filter values share a filter shape (sorted
+filter names). SQL of every shape is compiled by ORM once and kept with its
+compiler, later requests of the same shape execute it with new values and
+only convert the returned rows. Plans are kept per thread, as compilers hold
+thread-local database connection.
+"""
+import threading
+from collections import namedtuple
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+from product_app.models import Product
+from product_app.serialization import product_values
+
+# filter name: allowed lookups
+EXACT_SEARCH_LOOKUPS = {
+    'name': ('exact',),
+    'category': ('exact',),
+    'available': ('exact',),
+    'price': ('exact', 'gt', 'gte', 'lt', 'lte'),
+    'shop': ('exact',),
+    'shop__name': ('exact',),
+}
+
+Plan = namedtuple('Plan', ['sql', 'compiler', 'names'])
+
+_plans = threading.local()
+
+
+def _get_field(name):
+    model, field = Product, None
+    for part in name.split('__'):
+        field = model._meta.get_field(part)
+        model = field.related_model
+    return field
+
+
+def parse_filters(data):
+    """Validates client filters against EXACT_SEARCH_LOOKUPS.
+
+    Returns list of (filter, value) sorted by filter name, filters are
+    normalized to "<field>__<lookup>" form and values to field types.
+    Raises ValidationError on unknown filter, lookup or wrong value.
+    """
+    if not isinstance(data, dict):
+        raise ValidationError('Filters should be an object')
+    filters = {}
+    for key, value in data.items():
+        name, lookup = key, 'exact'
+        if name not in EXACT_SEARCH_LOOKUPS and '__' in key:
+            name, lookup = key.rsplit('__', 1)
+        if lookup not in EXACT_SEARCH_LOOKUPS.get(name, ()):
+            raise ValidationError(f'Filter {key} is not supported')
+        if value is None:
+            raise ValidationError(f'Value of {key} is required')
+        filters[f'{name}__{lookup}'] = _get_field(name).to_python(value)
+    return sorted(filters.items())
+
+
+def _db_value(key, value, connection):
+    field = _get_field(key.rsplit('__', 1)[0])
+    return field.get_db_prep_value(field.get_prep_value(value), connection,
+                                   prepared=True)
+
+
+def search_products(filters):
+    """Returns values() rows of products matching parsed filters."""
+    queryset = product_values(Product.objects.all())
+    connection = connections[queryset.db]
+    shape = (queryset.db, tuple(key for key, _ in filters))
+    plans = _plans.__dict__.setdefault('plans', {})
+    plan = plans.get(shape)
+    params = [_db_value(key, value, connection) for key, value in filters]
+    if plan is None:
+        conditions = Q()
+        for key, value in filters:
+            conditions &= Q(**{key: value})
+        queryset = product_values(Product.objects.filter(conditions))
+        compiler = queryset.query.get_compiler(queryset.db)
+        sql, compiled_params = compiler.as_sql()
+        # Shape is cached only if its parameters are exactly the
+        # filter values in the same order.
+        if list(compiled_params) == params:
+            plans[shape] = Plan(sql, compiler, [
+                *queryset.query.extra_select,
+                *queryset.query.values_select,
+                *queryset.query.annotation_select])
+        return list(queryset)
+    with connection.cursor() as cursor:
+        cursor.execute(plan.sql, params)
+        rows = cursor.fetchall()
+    return [dict(zip(plan.names, row))
+            for row in plan.compiler.results_iter(results=[rows])]
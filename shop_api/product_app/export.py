@@ -0,0 +1,220 @@
+"""Streaming export of the whole catalog as NDJSON or CSV.
+
+Every product is exported with name and city of its shop:
+
+    id, name, price, available, category, description, shop_name, shop_city
+
+On PostgreSQL rows are produced by the database itself with
+COPY (SELECT ...) TO STDOUT, NDJSON lines are built with row_to_json.
+On other databases rows are read through QuerySet.iterator() chunk by chunk
+and formatted in Python to the same output. Either way only one chunk is
+held in memory, so memory does not depend on the size of catalog.
+Output can be gzipped while it is streamed.
+"""
+import csv
+import io
+import queue
+import threading
+import zlib
+from itertools import islice
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from product_app.models import Product
+from shop_app.models import Shop
+
+EXPORT_FIELDS = ('id', 'name', 'price', 'available', 'category',
+                 'description', 'shop_name', 'shop_city')
+
+_COLUMNS = ('pk', 'name', 'price', 'available', 'category', 'description',
+            'shop__name', 'shop__city')
+
+CONTENT_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+# Separators of COPY in CSV format which never occur in JSON,
+# so NDJSON lines are written as they are.
+_RAW_COPY_OPTIONS = "FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02'"
+
+
+def uses_copy():
+    return connection.vendor == 'postgresql'
+
+
+def _select_sql(output_format):
+    quote = connection.ops.quote_name
+    product = quote(Product._meta.db_table)
+    shop = quote(Shop._meta.db_table)
+
+    def column(table, model, name):
+        return f'{table}.{quote(model._meta.get_field(name).column)}'
+
+    available = column(product, Product, 'available')
+    if output_format == 'csv':
+        # Booleans are written as in Python export
+        available = f"CASE WHEN {available} THEN 'true' ELSE 'false' END"
+    return (f'SELECT {column(product, Product, "id")} AS id, '
+            f'{column(product, Product, "name")} AS name, '
+            f'{column(product, Product, "price")}::text AS price, '
+            f'{available} AS available, '
+            f'{column(product, Product, "category")} AS category, '
+            f'{column(product, Product, "description")} AS description, '
+            f'{column(shop, Shop, "name")} AS shop_name, '
+            f'{column(shop, Shop, "city")} AS shop_city '
+            f'FROM {product} LEFT OUTER JOIN {shop} '
+            f'ON {column(product, Product, "shop")} = '
+            f'{column(shop, Shop, "id")} '
+            f'ORDER BY {column(product, Product, "id")}')
+
+
+def copy_sql(output_format):
+    """Returns COPY TO STDOUT statement of export in given format."""
+    select = _select_sql(output_format)
+    if output_format == 'csv':
+        return f'COPY ({select}) TO STDOUT WITH (FORMAT csv, HEADER)'
+    select = f'SELECT row_to_json(catalog) FROM ({select}) AS catalog'
+    return f'COPY ({select}) TO STDOUT WITH ({_RAW_COPY_OPTIONS})'
+
+
+def _format_csv(rows, header=False):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    if header:
+        writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        row = list(row)
+        row[3] = 'true' if row[3] else 'false'
+        writer.writerow(row)
+    return buffer.getvalue()
+
+
+def _format_ndjson(rows):
+    encoder = DjangoJSONEncoder(separators=(',', ':'), ensure_ascii=False)
+    return ''.join(encoder.encode(dict(zip(EXPORT_FIELDS, row))) + '\n'
+                   for row in rows)
+
+
+def iter_python_export(output_format, chunk_size=None):
+    """Yields exported catalog chunk by chunk formatted in Python."""
+    chunk_size = chunk_size or getattr(settings, 'STREAMING_CHUNK_SIZE',
+                                       2000)
+    rows = (Product.objects.order_by('pk').values_list(*_COLUMNS)
+                           .iterator(chunk_size=chunk_size))
+    if output_format == 'csv':
+        yield _format_csv([], header=True).encode('utf-8')
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        if output_format == 'csv':
+            yield _format_csv(chunk).encode('utf-8')
+        else:
+            yield _format_ndjson(chunk).encode('utf-8')
+
+
+class _ExportCancelled(Exception):
+    pass
+
+
+class _QueueWriter:
+    """File-like object which passes written data to a bounded queue."""
+
+    def __init__(self, chunks, cancelled):
+        self.chunks = chunks
+        self.cancelled = cancelled
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        while not self.cancelled.is_set():
+            try:
+                self.chunks.put(data, timeout=1)
+                return len(data)
+            except queue.Full:
+                continue
+        raise _ExportCancelled()
+
+
+_DONE = object()
+
+
+def iter_copy_export(output_format, max_chunks=64):
+    """Yields output of COPY TO STDOUT while it is produced.
+
+    COPY runs in a separate thread and blocks when max_chunks written
+    pieces are not consumed yet. If consumer stops reading (client went
+    away), COPY is cancelled on the server and the connection, left in the
+    middle of COPY, is closed.
+    """
+    connection.ensure_connection()
+    # Django connection can not be shared between threads,
+    # the thread uses the underlying psycopg2 connection only.
+    raw_connection = connection.connection
+    chunks = queue.Queue(maxsize=max_chunks)
+    cancelled = threading.Event()
+    errors = []
+
+    def copy():
+        try:
+            with raw_connection.cursor() as cursor:
+                cursor.copy_expert(copy_sql(output_format),
+                                   _QueueWriter(chunks, cancelled))
+        except Exception as error:
+            raw_connection.close()
+            # Errors of cancelled COPY are expected
+            if not cancelled.is_set():
+                errors.append(error)
+        finally:
+            while not cancelled.is_set():
+                try:
+                    chunks.put(_DONE, timeout=1)
+                    break
+                except queue.Full:
+                    continue
+
+    worker = threading.Thread(target=copy, daemon=True)
+    worker.start()
+    finished = False
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is _DONE:
+                finished = True
+                break
+            yield chunk
+    finally:
+        cancelled.set()
+        if not finished:
+            raw_connection.cancel()
+        worker.join()
+        if raw_connection.closed:
+            # Django opens a new connection for the next query
+            connection.close()
+    if errors:
+        raise errors[0]
+
+
+def iter_export(output_format, chunk_size=None):
+    """Yields exported catalog as bytes."""
+    if uses_copy():
+        return iter_copy_export(output_format)
+    return iter_python_export(output_format, chunk_size)
+
+
+def write_export(stream, output_format, chunk_size=None):
+    """Writes exported catalog to binary stream."""
+    if uses_copy():
+        with connection.cursor() as cursor:
+            cursor.copy_expert(copy_sql(output_format), stream)
+        return
+    for chunk in iter_python_export(output_format, chunk_size):
+        stream.write(chunk)
+
+
+def gzip_chunks(chunks, level=6):
+    """Compresses stream of bytes into gzip stream."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
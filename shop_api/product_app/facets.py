@@ -0,0 +1,132 @@
+"""Facet counts of product search results.
+
+Counts by category, shop, availability and price bucket are read with a
+single query grouped by all four of them, counts of every facet are summed
+up from its groups. The number of groups is bounded by the number of
+distinct combinations, not by the number of products. Shop names are not
+unique, so shops are counted and filtered by id, with the name as label.
+
+Counts are cached per catalog version and filter combination, so every
+product or shop write (which bumps catalog version, see product_app.signals)
+invalidates them. Rarely used combinations are evicted by the cache itself.
+"""
+import hashlib
+import json
+from collections import OrderedDict
+from decimal import Decimal
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Case, When, Value, Count, CharField, Q
+from shop_api.cache import facet_counts
+
+FACETS = ('category', 'shop', 'available', 'price')
+
+# facet name: field of values() row
+FACET_FIELDS = {'category': 'category',
+                'shop': 'shop_id',
+                'available': 'available',
+                'price': 'price_bucket'}
+
+# facet name: field of values() row with label of the value
+FACET_LABELS = {'shop': 'shop__name'}
+
+
+def get_price_buckets():
+    """Returns OrderedDict {label: (lower, upper)} of price buckets.
+
+    Bounds are taken from settings.FACET_PRICE_BUCKETS,
+    lower bound is inclusive, upper one is exclusive.
+    """
+    bounds = [Decimal(str(bound)) for bound in
+              getattr(settings, 'FACET_PRICE_BUCKETS', [10, 50, 100, 500])]
+    buckets = OrderedDict()
+    lower = Decimal(0)
+    for upper in bounds:
+        buckets[f'{lower}-{upper}'] = (lower, upper)
+        lower = upper
+    buckets[f'{lower}-'] = (lower, None)
+    return buckets
+
+
+def _price_bucket_expression(buckets):
+    *bounded, (last, _) = buckets.items()
+    return Case(*[When(price__lt=upper, then=Value(label))
+                  for label, (_, upper) in bounded],
+                default=Value(last), output_field=CharField())
+
+
+def filter_products(queryset, filters):
+    """Narrows queryset down to the selected facet values.
+
+    filters - {facet: value}, e.g. {"category": "toys", "shop": 1,
+    "price": "10-50"}
+    Raises ValidationError on unknown facet or price bucket.
+    """
+    unknown = set(filters) - set(FACETS)
+    if unknown:
+        raise ValidationError(f'Unknown facets: {", ".join(sorted(unknown))}')
+    conditions = Q()
+    for facet, value in filters.items():
+        if facet == 'price':
+            buckets = get_price_buckets()
+            if value not in buckets:
+                raise ValidationError(f'Unknown price bucket: {value}')
+            lower, upper = buckets[value]
+            conditions &= Q(price__gte=lower)
+            if upper is not None:
+                conditions &= Q(price__lt=upper)
+        elif facet == 'available' and not isinstance(value, bool):
+            raise ValidationError('Availability should be true or false')
+        elif facet == 'shop' and (not isinstance(value, int) or
+                                  isinstance(value, bool)):
+            raise ValidationError('Shop should be given by its id')
+        else:
+            conditions &= Q(**{FACET_FIELDS[facet]: value})
+    return queryset.filter(conditions)
+
+
+def count_facets(queryset):
+    """Returns {facet: {value: number of products}} for queryset,
+    {value: {"label": label, "products": number of products}} for facets
+    with labels (shop)."""
+    buckets = get_price_buckets()
+    groups = (queryset.order_by()
+                      .annotate(price_bucket=_price_bucket_expression(buckets))
+                      .values(*FACET_FIELDS.values(), *FACET_LABELS.values())
+                      .annotate(products=Count('pk')))
+    facets = {facet: {} for facet in FACETS}
+    for group in groups:
+        for facet, field in FACET_FIELDS.items():
+            value = group[field]
+            if facet in FACET_LABELS:
+                counts = facets[facet].setdefault(
+                    value, {'label': group[FACET_LABELS[facet]],
+                            'products': 0})
+                counts['products'] += group['products']
+            else:
+                facets[facet][value] = facets[facet].get(value, 0) + \
+                    group['products']
+    # Buckets are listed in price order
+    facets['price'] = {label: facets['price'][label]
+                       for label in buckets if label in facets['price']}
+    return facets
+
+
+def _cache_key(version, filters):
+    raw = json.dumps(filters, sort_keys=True, default=str).encode('utf-8')
+    return f'{version}:{hashlib.md5(raw).hexdigest()}'
+
+
+def get_facet_counts(queryset, filters, version):
+    """Returns facet counts of queryset filtered with filters.
+
+    Counts are cached under catalog version, pass None to bypass the cache.
+    """
+    if version is None:
+        return count_facets(queryset)
+    key = _cache_key(version, filters)
+    facets = facet_counts.get(key)
+    if facets is None:
+        facets = count_facets(queryset)
+        facet_counts.set(key, facets)
+    return facets
@@ -0,0 +1,152 @@
+import time
+from decimal import Decimal
+from django.core import serializers
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from product_app.bulk import ingest_products, update_products_in_bulk
+from product_app.models import Product
+from product_app.serialization import (PRODUCT_FIELDS, product_values,
+                                       serialize_products)
+from product_app.trigram import substring_filter, TRIGRAM_INDEXES
+from shop_app.models import Shop
+
+
+def django_serializer(products):
+    return serializers.serialize('json',
+                                 products,
+                                 fields=PRODUCT_FIELDS,
+                                 indent=2,
+                                 use_natural_foreign_keys=True)
+
+
+def fast_serializer(products):
+    return serialize_products(product_values(products), indent=2)
+
+
+class QueryCounter:
+    """Counts executed queries without keeping them in memory."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def icontains_search(products):
+    return list(products.filter(name__icontains='duct 4242',
+                                description__icontains='of product')
+                        .values_list('pk', flat=True))
+
+
+def trigram_index_build(products):
+    TRIGRAM_INDEXES[Product].build()
+
+
+def trigram_search(products):
+    return list(substring_filter(products, {'name': 'duct 4242',
+                                            'description': 'of product'})
+                .values_list('pk', flat=True))
+
+
+INGEST_ROWS = 1000
+
+
+def _ingest_rows():
+    shop = Shop.objects.values_list('pk', flat=True).first()
+    return [{'name': f'ingested product {i}',
+             'price': str(Decimal(i % 10000) / 100),
+             'available': True,
+             'category': 'ingested',
+             'description': f'description of ingested product {i}',
+             'shop': shop}
+            for i in range(INGEST_ROWS)]
+
+
+def single_create(products):
+    for row in _ingest_rows():
+        row['shop_id'] = row.pop('shop')
+        with transaction.atomic():
+            Product.objects.create(**row)
+
+
+def bulk_ingest(products):
+    ingest_products(enumerate(_ingest_rows(), 1))
+
+
+def save_prices(products):
+    for product in products.order_by('pk')[:INGEST_ROWS]:
+        product.price += 1
+        with transaction.atomic():
+            product.save()
+
+
+def bulk_update_prices(products):
+    changes = [{'pk': pk, 'price': price + 1} for pk, price in
+               products.order_by('pk').values_list('pk', 'price')
+               [:INGEST_ROWS]]
+    update_products_in_bulk(enumerate(changes, 1))
+
+
+BENCHMARKS = [('serialize: django.core.serializers', django_serializer),
+              ('serialize: product_app.serialization', fast_serializer),
+              (f'ingest {INGEST_ROWS}: single create', single_create),
+              (f'ingest {INGEST_ROWS}: bulk', bulk_ingest),
+              (f'update {INGEST_ROWS} prices: save()', save_prices),
+              (f'update {INGEST_ROWS} prices: bulk', bulk_update_prices),
+              ('substring search: icontains scan', icontains_search),
+              ('substring search: trigram index build', trigram_index_build),
+              ('substring search: trigram index', trigram_search)]
+
+
+class Command(BaseCommand):
+    help = ('Measures time and number of queries of catalog hot paths '
+            'on generated products. Generated data is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', nargs='+', type=int,
+                            default=[10000, 100000],
+                            help='Sizes of generated catalog')
+        parser.add_argument('--shops', type=int, default=100,
+                            help='Number of generated shops')
+        parser.add_argument('--only', default='',
+                            help='Run benchmarks which names start with it, '
+                                 'for instance "substring search"')
+
+    def handle(self, *args, **options):
+        for rows in options['rows']:
+            with transaction.atomic():
+                self.populate(rows, options['shops'])
+                self.stdout.write(f'{rows} products:')
+                for name, benchmark in BENCHMARKS:
+                    if name.startswith(options['only']):
+                        self.run(name, benchmark)
+                transaction.set_rollback(True)
+            TRIGRAM_INDEXES[Product].reset()
+
+    def populate(self, rows, shops):
+        Shop.objects.bulk_create(
+            Shop(name=f'shop {i}', city=f'city {i % 10}', owner=f'owner {i}')
+            for i in range(shops))
+        # bulk_create does not set primary keys on every backend
+        shops = list(Shop.objects.order_by('-pk')[:shops])
+        Product.objects.bulk_create(
+            (Product(name=f'product {i}',
+                     price=Decimal(i % 10000) / 100,
+                     available=bool(i % 2),
+                     category=f'category {i % 50}',
+                     description=f'description of product {i}',
+                     shop=shops[i % len(shops)])
+             for i in range(rows)),
+            batch_size=500)
+
+    def run(self, name, benchmark):
+        products = Product.objects.all()
+        queries = QueryCounter()
+        with connection.execute_wrapper(queries):
+            started = time.perf_counter()
+            benchmark(products)
+            elapsed = time.perf_counter() - started
+        self.stdout.write(f'  {name:<45} {elapsed:8.3f} s '
+                          f'{queries.count:>8} queries')
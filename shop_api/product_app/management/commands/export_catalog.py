@@ -0,0 +1,34 @@
+import gzip
+import sys
+from django.core.management.base import BaseCommand
+from product_app.export import write_export, CONTENT_TYPES
+
+
+class Command(BaseCommand):
+    help = ('Exports all products with their shops as NDJSON or CSV. '
+            'On PostgreSQL rows are written by COPY TO STDOUT.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(CONTENT_TYPES),
+                            default='ndjson')
+        parser.add_argument('--output', default='-',
+                            help='Output file, "-" for standard output')
+        parser.add_argument('--gzip', action='store_true',
+                            help='Compress output with gzip')
+
+    def handle(self, *args, **options):
+        if options['output'] == '-':
+            stream = sys.stdout.buffer
+        else:
+            stream = open(options['output'], 'wb')
+        try:
+            if options['gzip']:
+                with gzip.GzipFile(fileobj=stream, mode='wb') as compressed:
+                    write_export(compressed, options['format'])
+            else:
+                write_export(stream, options['format'])
+        finally:
+            if stream is not sys.stdout.buffer:
+                stream.close()
+            else:
+                stream.flush()
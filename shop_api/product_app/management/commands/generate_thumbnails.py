@@ -0,0 +1,40 @@
+import os
+from concurrent.futures import as_completed
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from product_app.models import Product
+from product_app.thumbnails import (get_executor, generate_variants,
+                                    get_sizes, get_formats, store_image_hash)
+
+
+class Command(BaseCommand):
+    help = ('Generates thumbnails of product images which have none yet, '
+            'e.g. after loading fixtures or importing a catalog.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Check variants of every product image')
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='')
+        if not options['all']:
+            products = products.filter(image_hash='')
+        executor = get_executor()
+        sizes, formats = get_sizes(), get_formats()
+        futures = {}
+        for pk, image in products.values_list('pk', 'image').iterator():
+            future = executor.submit(
+                generate_variants, os.path.join(settings.MEDIA_ROOT, image),
+                settings.MEDIA_ROOT, sizes, formats)
+            futures[future] = (pk, image)
+        generated = failed = 0
+        for future in as_completed(futures):
+            pk, image = futures.pop(future)
+            try:
+                store_image_hash(pk, image, future.result())
+                generated += 1
+            except Exception as error:
+                failed += 1
+                self.stderr.write(f'Product {pk} ({image}): {error}')
+        self.stdout.write(f'Thumbnails of {generated} images were '
+                          f'generated, {failed} failed.')
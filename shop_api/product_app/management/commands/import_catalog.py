@@ -0,0 +1,49 @@
+import time
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from product_app.catalog_import import (import_shops, import_products,
+                                        finish_import)
+
+
+class Command(BaseCommand):
+    help = ('Imports shops and products from CSV or NDJSON files. '
+            'Interrupted import continues from the last committed chunk '
+            'when it is run again with the same files.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shops', help='File with shops')
+        parser.add_argument('--products', help='File with products')
+        parser.add_argument('--chunk-size', type=int, default=10000,
+                            help='Number of rows committed at once')
+        parser.add_argument('--restart', action='store_true',
+                            help='Import files from the beginning')
+        parser.add_argument('--max-errors', type=int, default=20,
+                            help='Number of rejected rows printed')
+
+    def handle(self, *args, **options):
+        if not options['shops'] and not options['products']:
+            raise CommandError('Nothing to import, use --shops '
+                               'and/or --products.')
+        imports = [('shops', import_shops), ('products', import_products)]
+        for kind, import_rows in imports:
+            if not options[kind]:
+                continue
+            started = time.perf_counter()
+
+            def report(rows, errors):
+                elapsed = time.perf_counter() - started
+                self.stdout.write(f'{kind}: {rows} rows read, '
+                                  f'{errors} rejected, {elapsed:.1f} s')
+            try:
+                created, errors = import_rows(
+                    options[kind], chunk_size=options['chunk_size'],
+                    restart=options['restart'], report=report)
+            except (OSError, ValidationError) as error:
+                raise CommandError(error)
+            self.stdout.write(f'{kind}: {created} created, '
+                              f'{len(errors)} rejected.')
+            for error in errors[:options['max_errors']]:
+                self.stderr.write(f'  row {error["row"]}: {error["errors"]}')
+        self.stdout.write('Rebuilding search index and price statistics...')
+        finish_import()
+        self.stdout.write('Import finished.')
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from product_app.models import PriceBucket
+from product_app.price_stats import rebuild_price_stats
+
+
+class Command(BaseCommand):
+    help = ('Recomputes price ranges of categories and shops and '
+            'equi-depth histogram of product prices.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buckets', type=int, default=None,
+                            help='Number of histogram buckets')
+
+    def handle(self, *args, **options):
+        rebuild_price_stats(options['buckets'])
+        buckets = PriceBucket.objects.count()
+        self.stdout.write(f'Price statistics were rebuilt: '
+                          f'{buckets} histogram buckets.')
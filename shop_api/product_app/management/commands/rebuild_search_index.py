@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from product_app.search import uses_native_search, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds full-text search index of products from scratch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help='Number of products indexed at once')
+
+    def handle(self, *args, **options):
+        if uses_native_search():
+            with connection.cursor() as cursor:
+                cursor.execute('REINDEX INDEX product_app_product_search_gin')
+            self.stdout.write('PostgreSQL full-text index was rebuilt.')
+            return
+        indexed = rebuild_index(
+            batch_size=options['batch_size'],
+            progress=lambda count: self.stdout.write(f'{count} indexed...'))
+        self.stdout.write(f'Search index was rebuilt: {indexed} products.')
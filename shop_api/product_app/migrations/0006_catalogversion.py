@@ -0,0 +1,30 @@
+# Generated by Django 3.0.3 on 2026-10-18 18:06
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def create_catalog_versions(apps, schema_editor):
+    CatalogVersion = apps.get_model('product_app', 'CatalogVersion')
+    for name in ('products', 'shops'):
+        CatalogVersion.objects.get_or_create(name=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_app', '0005_auto_20200210_1643'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('name', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('modified', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.RunPython(create_catalog_versions,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 3.0.3 on 2026-10-18 18:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Must match product_app.search.SEARCH_VECTOR_SQL,
+# otherwise PostgreSQL does not use the index.
+SEARCH_VECTOR_SQL = ("to_tsvector('english', coalesce(name, '') || ' ' || "
+                     "coalesce(category, '') || ' ' || "
+                     "coalesce(description, ''))")
+
+
+def create_gin_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX product_app_product_search_gin '
+        f'ON product_app_product USING GIN ({SEARCH_VECTOR_SQL})')
+
+
+def drop_gin_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'DROP INDEX IF EXISTS product_app_product_search_gin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_app', '0006_catalogversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('documents', models.PositiveIntegerField(default=0)),
+                ('total_length', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64, unique=True)),
+                ('documents', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchPosting',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('frequency', models.PositiveIntegerField()),
+                ('length', models.PositiveIntegerField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='product_app.Product')),
+                ('term', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='product_app.SearchTerm')),
+            ],
+            options={
+                'unique_together': {('term', 'product')},
+            },
+        ),
+        migrations.RunPython(create_gin_index, drop_gin_index),
+    ]
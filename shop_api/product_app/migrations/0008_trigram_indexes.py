@@ -0,0 +1,34 @@
+from django.db import migrations
+
+TABLE = 'product_app_product'
+FIELDS = ['name', 'category', 'description']
+
+
+def create_trigram_indexes(apps, schema_editor):
+    # icontains is compiled to UPPER(field::text) LIKE UPPER(%s)
+    # on PostgreSQL, thus indexes are built over the same expression.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for field in FIELDS:
+        schema_editor.execute(
+            f'CREATE INDEX {TABLE}_{field}_trgm '
+            f'ON {TABLE} USING GIN (UPPER({field}::text) gin_trgm_ops)')
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for field in FIELDS:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {TABLE}_{field}_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_app', '0007_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
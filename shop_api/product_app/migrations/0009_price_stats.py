@@ -0,0 +1,56 @@
+# Generated by Django 3.0.3 on 2026-10-18 18:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_app', '0008_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceBucket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lower', models.DecimalField(decimal_places=2, max_digits=19, null=True)),
+                ('upper', models.DecimalField(decimal_places=2, max_digits=19, null=True)),
+                ('products', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='PriceRange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('all', 'All products'), ('category', 'Category'), ('shop', 'Shop')], max_length=16)),
+                ('key', models.CharField(max_length=255)),
+                ('minimum', models.DecimalField(decimal_places=2, max_digits=19)),
+                ('maximum', models.DecimalField(decimal_places=2, max_digits=19)),
+                ('products', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['kind', 'key'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='price',
+            field=models.DecimalField(db_index=True, decimal_places=2, max_digits=19),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'price'], name='product_app_categor_d651ed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['shop', 'price'], name='product_app_shop_id_3abd47_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='pricerange',
+            unique_together={('kind', 'key')},
+        ),
+    ]
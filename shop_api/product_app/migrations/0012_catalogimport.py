@@ -0,0 +1,24 @@
+# Generated by Django 3.0.3 on 2026-10-18 18:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_app', '0011_product_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogImport',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=512, unique=True)),
+                ('size', models.BigIntegerField()),
+                ('rows', models.PositiveIntegerField(default=0)),
+                ('finished', models.BooleanField(default=False)),
+                ('modified', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
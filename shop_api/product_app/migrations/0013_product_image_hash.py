@@ -0,0 +1,18 @@
+# Generated by Django 3.0.3 on 2026-10-18 18:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_app', '0012_catalogimport'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
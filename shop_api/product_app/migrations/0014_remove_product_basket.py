@@ -0,0 +1,19 @@
+# Generated by Django 3.0.3 on 2026-10-18 18:46
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_app', '0013_product_image_hash'),
+        # Products in baskets are moved to basket items first
+        ('basket_app', '0010_basket_items_from_products'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='product',
+            name='basket',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.3 on 2026-10-18 19:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_app', '0014_remove_product_basket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pricerange',
+            name='stale',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -1,27 +1,40 @@
 from django.db import models
+from django.utils import timezone
 from shop_app.models import Shop
-from basket_app.models import Basket
 
 
 class Product(models.Model):
 
     name = models.CharField(max_length=255)
-    price = models.DecimalField(max_digits=19, decimal_places=2)
+    price = models.DecimalField(max_digits=19, decimal_places=2,
+                                db_index=True)
     available = models.BooleanField(default=False)
     category = models.CharField(max_length=255)
     image = models.ImageField()
+    # Content hash of the image which thumbnails are generated,
+    # empty until they are ready (see product_app.thumbnails)
+    image_hash = models.CharField(max_length=64, blank=True, default='')
     description = models.TextField()
     shop = models.ForeignKey(Shop,
                              unique=False,
                              null=True,
                              on_delete=models.CASCADE)
-    basket = models.ForeignKey(Basket,
-                               blank=True,
-                               null=True,
-                               on_delete=models.DO_NOTHING)
+    # Incremented by every update, clients pass the version they have read
+    # to detect concurrent changes (see product_app.bulk)
+    version = models.PositiveIntegerField(default=0)
 
     class Meta:
         ordering = ['name', 'price']
+        # Min/max price of category or shop is read from these indexes
+        # when price statistics are recomputed (see product_app.price_stats)
+        indexes = [models.Index(fields=['category', 'price']),
+                   models.Index(fields=['shop', 'price']),
+                   # Filters of exact search
+                   # (see product_app.exact_search)
+                   models.Index(fields=['name', 'price']),
+                   models.Index(fields=['category', 'available']),
+                   models.Index(fields=['shop', 'available']),
+                   models.Index(fields=['available', 'price'])]
 
     def natural_key(self):
         return (self.name,) + self.shop.natural_key()
@@ -31,3 +44,114 @@ class Product(models.Model):
     def __str__(self):
         return (f'Product: name={self.name}, '
                 f'price={self.price}, shop={self.shop}')
+
+
+class CatalogVersion(models.Model):
+    """Version of a part of catalog (products or shops).
+
+    It is bumped on every change of the part and used as a validator
+    for conditional GET requests.
+    """
+
+    name = models.CharField(max_length=32, primary_key=True)
+    version = models.PositiveIntegerField(default=0)
+    modified = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f'Catalog: name={self.name}, version={self.version}'
+
+
+class SearchTerm(models.Model):
+    """Term of full-text search inverted index.
+
+    documents - number of indexed products that contain the term.
+    """
+
+    term = models.CharField(max_length=64, unique=True)
+    documents = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'Term: {self.term}, documents={self.documents}'
+
+
+class SearchPosting(models.Model):
+    """Occurrence of term in product.
+
+    frequency - weighted number of occurrences of the term in the product,
+    length - weighted number of terms in the product. The latter is kept in
+    every posting, so relevance is ranked without joining products.
+    """
+
+    term = models.ForeignKey(SearchTerm, on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    frequency = models.PositiveIntegerField()
+    length = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = [['term', 'product']]
+
+
+class SearchStats(models.Model):
+    """Totals of inverted index used for ranking (single row)."""
+
+    documents = models.PositiveIntegerField(default=0)
+    total_length = models.BigIntegerField(default=0)
+
+
+class PriceRange(models.Model):
+    """Minimal and maximal price of products of category, shop or
+    whole catalog (kind="all", key="")."""
+
+    ALL = 'all'
+    CATEGORY = 'category'
+    SHOP = 'shop'
+    KINDS = [(ALL, 'All products'), (CATEGORY, 'Category'), (SHOP, 'Shop')]
+
+    kind = models.CharField(max_length=16, choices=KINDS)
+    key = models.CharField(max_length=255)
+    minimum = models.DecimalField(max_digits=19, decimal_places=2)
+    maximum = models.DecimalField(max_digits=19, decimal_places=2)
+    products = models.PositiveIntegerField(default=0)
+    # Minimum or maximum was removed, range is recomputed when read
+    stale = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = [['kind', 'key']]
+        ordering = ['kind', 'key']
+
+    def __str__(self):
+        return (f'Price range: {self.kind}={self.key}, '
+                f'from {self.minimum} to {self.maximum}')
+
+
+class PriceBucket(models.Model):
+    """Bucket of equi-depth histogram of product prices.
+
+    Contains products with lower <= price < upper,
+    None stands for unbounded side.
+    """
+
+    lower = models.DecimalField(max_digits=19, decimal_places=2, null=True)
+    upper = models.DecimalField(max_digits=19, decimal_places=2, null=True)
+    products = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['id']
+
+
+class CatalogImport(models.Model):
+    """Progress of import of a file by import_catalog command.
+
+    rows - number of rows of the file already imported, it is updated in
+    the same transaction as the imported rows, so an interrupted import
+    continues after the last committed chunk.
+    """
+
+    source = models.CharField(max_length=512, unique=True)
+    size = models.BigIntegerField()
+    rows = models.PositiveIntegerField(default=0)
+    finished = models.BooleanField(default=False)
+    modified = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Import: source={self.source}, rows={self.rows}'
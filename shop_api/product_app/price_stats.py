@@ -0,0 +1,274 @@
+"""Maintained price statistics of products.
+
+PriceRange keeps minimal and maximal price of every category, every shop
+and of the whole catalog. PriceBucket rows form an equi-depth histogram of
+prices: bucket bounds are chosen so that every bucket held the same number of
+products when the histogram was built, bucket counters are updated on every
+product write (see product_app.signals). Writes change counters with
+conditional UPDATEs and take no locks besides the rows they update; a range
+whose minimum or maximum was removed is marked stale and recomputed from
+(group, price) index when it is read (see get_price_ranges). Every
+product write updates the range of the whole catalog and a histogram bucket
+too, so concurrent product writes wait for each other on those rows until
+commit. The histogram
+is used to estimate the number of products in a price range without
+touching products table.
+
+Both structures are rebuilt from scratch with
+
+    python manage.py rebuild_price_stats
+"""
+from collections import Counter
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.db.models import (F, Q, Min, Max, Count, Value, Case, When,
+                              BooleanField)
+from django.db.models.functions import Least, Greatest, Cast
+from product_app.models import Product, PriceRange, PriceBucket
+
+
+def _groups(category, shop_id):
+    groups = [(PriceRange.ALL, ''), (PriceRange.CATEGORY, category)]
+    if shop_id is not None:
+        groups.append((PriceRange.SHOP, str(shop_id)))
+    return groups
+
+
+def _group_products(kind, key):
+    if kind == PriceRange.CATEGORY:
+        return Product.objects.filter(category=key)
+    if kind == PriceRange.SHOP:
+        return Product.objects.filter(shop_id=key)
+    return Product.objects.all()
+
+
+def _bucket_of(price):
+    return PriceBucket.objects.filter(
+        Q(lower__isnull=True) | Q(lower__lte=price),
+        Q(upper__isnull=True) | Q(upper__gt=price))
+
+
+def _widen_range(kind, key, minimum, maximum, products):
+    # Cast keeps comparison numeric on SQLite, where decimals
+    # are passed as strings.
+    price_field = Product._meta.get_field('price')
+    return PriceRange.objects.filter(kind=kind, key=key).update(
+        minimum=Least(F('minimum'), Cast(Value(minimum), price_field)),
+        maximum=Greatest(F('maximum'), Cast(Value(maximum), price_field)),
+        products=F('products') + products)
+
+
+def _add_to_range(kind, key, minimum, maximum, products):
+    if _widen_range(kind, key, minimum, maximum, products):
+        return
+    try:
+        with transaction.atomic():
+            PriceRange.objects.create(kind=kind, key=key, minimum=minimum,
+                                      maximum=maximum, products=products)
+    except IntegrityError:
+        # Range was created by a concurrent transaction meanwhile
+        _widen_range(kind, key, minimum, maximum, products)
+
+
+@transaction.atomic
+def add_price(price, category, shop_id):
+    """Accounts new product price in statistics."""
+    price = Decimal(str(price))
+    for kind, key in _groups(category, shop_id):
+        _add_to_range(kind, key, price, price, 1)
+    _bucket_of(price).update(products=F('products') + 1)
+
+
+def _group_prices(products):
+    """Returns ({(kind, key): (minimum, maximum, count)}, prices)."""
+    groups = {}
+    prices = []
+    for product in products:
+        price = Decimal(str(product['price']))
+        prices.append(price)
+        for group in _groups(product['category'], product['shop_id']):
+            minimum, maximum, count = groups.get(group, (price, price, 0))
+            groups[group] = (min(minimum, price), max(maximum, price),
+                             count + 1)
+    return groups, prices
+
+
+def _update_buckets(prices, sign):
+    buckets = list(PriceBucket.objects.all())
+    counts = Counter()
+    for price in prices:
+        for bucket in buckets:
+            if ((bucket.lower is None or bucket.lower <= price) and
+                    (bucket.upper is None or price < bucket.upper)):
+                counts[bucket.pk] += 1
+                break
+    for pk, count in counts.items():
+        PriceBucket.objects.filter(pk=pk).update(
+            products=F('products') + sign * count)
+
+
+@transaction.atomic
+def add_prices(products):
+    """Accounts prices of many new products in statistics.
+
+    products - dicts with price, category and shop_id.
+    Every affected group and histogram bucket is updated once.
+    """
+    groups, prices = _group_prices(products)
+    for (kind, key), (minimum, maximum, count) in groups.items():
+        _add_to_range(kind, key, minimum, maximum, count)
+    _update_buckets(prices, 1)
+
+
+def _remove_from_range(kind, key, minimum, maximum, products):
+    ranges = PriceRange.objects.filter(kind=kind, key=key)
+    removes_bound = Q(minimum__gte=minimum) | Q(maximum__lte=maximum)
+    ranges.filter(products__gt=products).update(
+        products=F('products') - products,
+        stale=Case(When(removes_bound, then=Value(True)),
+                   default=F('stale'), output_field=BooleanField()))
+    ranges.filter(products__lte=products).delete()
+
+
+@transaction.atomic
+def remove_price(price, category, shop_id):
+    """Removes price of changed or deleted product from statistics.
+
+    Ranges of groups where the price was minimum or maximum are marked stale.
+    """
+    price = Decimal(str(price))
+    for kind, key in _groups(category, shop_id):
+        _remove_from_range(kind, key, price, price, 1)
+    _bucket_of(price).update(products=F('products') - 1)
+
+
+@transaction.atomic
+def remove_prices(products):
+    """Removes prices of many changed or deleted products from statistics.
+
+    products - dicts with old price, category and shop_id.
+    Every affected group and histogram bucket is updated once.
+    """
+    groups, prices = _group_prices(products)
+    for (kind, key), (minimum, maximum, count) in groups.items():
+        _remove_from_range(kind, key, minimum, maximum, count)
+    _update_buckets(prices, -1)
+
+
+@transaction.atomic
+def rebuild_price_stats(buckets=None):
+    """Recomputes price ranges and equi-depth histogram of prices."""
+    buckets = buckets or getattr(settings, 'PRICE_HISTOGRAM_BUCKETS', 32)
+    PriceRange.objects.all().delete()
+    ranges = []
+    for kind, field in ((PriceRange.CATEGORY, 'category'),
+                        (PriceRange.SHOP, 'shop_id')):
+        grouped = (Product.objects.order_by().exclude(**{field: None})
+                                  .values(field)
+                                  .annotate(minimum=Min('price'),
+                                            maximum=Max('price'),
+                                            products=Count('pk')))
+        ranges.extend(PriceRange(kind=kind, key=str(row[field]),
+                                 minimum=row['minimum'],
+                                 maximum=row['maximum'],
+                                 products=row['products'])
+                      for row in grouped)
+    total = Product.objects.aggregate(minimum=Min('price'),
+                                      maximum=Max('price'),
+                                      products=Count('pk'))
+    if total['products']:
+        ranges.append(PriceRange(kind=PriceRange.ALL, key='', **total))
+    PriceRange.objects.bulk_create(ranges, batch_size=500)
+
+    PriceBucket.objects.all().delete()
+    PriceBucket.objects.bulk_create(_equi_depth_buckets(total['products'],
+                                                        buckets))
+
+
+def _equi_depth_buckets(products, buckets):
+    """Splits prices sorted by price index into buckets of equal size.
+
+    Equal prices always fall into the same bucket,
+    so buckets may be less than requested.
+    """
+    if not products:
+        return [PriceBucket(lower=None, upper=None, products=0)]
+    depth = max(products // buckets, 1)
+    prices = (Product.objects.order_by('price')
+                             .values_list('price', flat=True)
+                             .iterator(chunk_size=5000))
+    bounds, counts = [None], [0]
+    for price in prices:
+        if counts[-1] >= depth and price != bounds[-1] and \
+                len(counts) < buckets:
+            bounds.append(price)
+            counts.append(0)
+        counts[-1] += 1
+    uppers = bounds[1:] + [None]
+    return [PriceBucket(lower=lower, upper=upper, products=count)
+            for lower, upper, count in zip(bounds, uppers, counts)]
+
+
+def _refresh(price_range):
+    """Recomputes minimum and maximum of stale range.
+
+    Range is saved only if its counter was not changed meanwhile, otherwise
+    it stays stale and is recomputed on the next read.
+    """
+    prices = _group_products(price_range.kind, price_range.key).aggregate(
+        minimum=Min('price'), maximum=Max('price'))
+    if prices['minimum'] is None:
+        return
+    updated = PriceRange.objects.filter(
+        pk=price_range.pk, stale=True,
+        products=price_range.products).update(stale=False, **prices)
+    if updated:
+        # Prices as stored, aggregates on SQLite are not rounded to cents
+        price_range.refresh_from_db()
+
+
+def get_price_ranges(**filters):
+    """Returns PriceRanges matching filters, stale ones are recomputed."""
+    price_ranges = list(PriceRange.objects.filter(**filters))
+    for price_range in price_ranges:
+        if price_range.stale:
+            _refresh(price_range)
+    return price_ranges
+
+
+def get_price_range(kind=PriceRange.ALL, key=''):
+    price_ranges = get_price_ranges(kind=kind, key=key)
+    return price_ranges[0] if price_ranges else None
+
+
+def estimate_products_in_range(start_from=None, end_to=None):
+    """Estimates number of products with start_from <= price <= end_to.
+
+    Buckets partially covered by the range are interpolated linearly,
+    unbounded sides of edge buckets are limited by catalog minimum and
+    maximum. Returns None if histogram was not built yet.
+    """
+    buckets = list(PriceBucket.objects.all())
+    if not buckets:
+        return None
+    catalog = get_price_range()
+    if catalog is None:
+        return 0
+    start_from = catalog.minimum if start_from is None else start_from
+    end_to = catalog.maximum if end_to is None else end_to
+    estimate = 0.0
+    for bucket in buckets:
+        lower = catalog.minimum if bucket.lower is None else bucket.lower
+        upper = catalog.maximum if bucket.upper is None else bucket.upper
+        lower, upper = min(lower, upper), max(lower, upper)
+        covered_from = max(lower, start_from)
+        covered_to = min(upper, end_to)
+        if covered_from > covered_to or bucket.products <= 0:
+            continue
+        if upper == lower:
+            estimate += bucket.products
+        else:
+            share = (covered_to - covered_from) / (upper - lower)
+            estimate += bucket.products * float(share)
+    return round(estimate)
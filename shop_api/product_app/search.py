@@ -0,0 +1,266 @@
+"""Full-text search over name, category and description of products.
+
+On PostgreSQL native full-text search is used: products are matched
+against a GIN index over tsvector of their text fields (see migration
+0007_search_index) and ranked with ts_rank_cd.
+
+On other databases (SQLite for local testing) a tokenized inverted index
+is kept in SearchTerm / SearchPosting tables. It is updated incrementally on
+product save and delete (see product_app.signals) and can be rebuilt with
+
+    python manage.py rebuild_search_index
+
+Products are ranked with Okapi BM25 computed by the database in a single
+grouped query over postings of the query terms.
+"""
+import math
+import re
+from collections import Counter, defaultdict
+from django.db import connection, transaction
+from django.db.models import (Case, When, Value, F, Sum, FloatField,
+                              ExpressionWrapper)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast
+from product_app.models import (Product, SearchTerm, SearchPosting,
+                                SearchStats)
+
+# Term frequency multiplier of every indexed field
+FIELD_WEIGHTS = {'name': 3, 'category': 2, 'description': 1}
+
+TOKEN_RE = re.compile(r'\w+')
+MAX_TERM_LENGTH = 64
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Must match SEARCH_VECTOR_SQL of migration 0007_search_index,
+# otherwise PostgreSQL does not use the index.
+SEARCH_VECTOR_SQL = ("to_tsvector('english', "
+                     "coalesce(product_app_product.name, '') || ' ' || "
+                     "coalesce(product_app_product.category, '') || ' ' || "
+                     "coalesce(product_app_product.description, ''))")
+SEARCH_QUERY_SQL = "plainto_tsquery('english', %s)"
+
+
+def uses_native_search():
+    return connection.vendor == 'postgresql'
+
+
+def tokenize(text):
+    """Splits text into lowercase terms."""
+    return [token for token in TOKEN_RE.findall(text.lower())
+            if len(token) <= MAX_TERM_LENGTH]
+
+
+def product_terms(product):
+    """Returns Counter with weighted frequencies of terms of product.
+
+    Product is either model instance or dict from values().
+    """
+    if not isinstance(product, dict):
+        product = {field: getattr(product, field) for field in FIELD_WEIGHTS}
+    terms = Counter()
+    for field, weight in FIELD_WEIGHTS.items():
+        for token in tokenize(product[field] or ''):
+            terms[token] += weight
+    return terms
+
+
+def _get_term_ids(terms, chunk_size=500):
+    """Returns {term: id}, missing terms are created."""
+    term_ids = {}
+    for start in range(0, len(terms), chunk_size):
+        chunk = terms[start:start + chunk_size]
+        term_ids.update(SearchTerm.objects.filter(term__in=chunk)
+                                          .values_list('term', 'pk'))
+        missing = [term for term in chunk if term not in term_ids]
+        if missing:
+            SearchTerm.objects.bulk_create(
+                [SearchTerm(term=term) for term in missing],
+                ignore_conflicts=True)
+            term_ids.update(SearchTerm.objects.filter(term__in=missing)
+                                              .values_list('term', 'pk'))
+    return term_ids
+
+
+def _update_stats(documents, total_length):
+    updated = SearchStats.objects.filter(pk=1).update(
+        documents=F('documents') + documents,
+        total_length=F('total_length') + total_length)
+    if not updated:
+        SearchStats.objects.create(pk=1, documents=documents,
+                                   total_length=total_length)
+
+
+@transaction.atomic
+def index_product(product):
+    """Replaces postings of product with terms of its current state."""
+    unindex_product(product.pk)
+    terms = product_terms(product)
+    if not terms:
+        return
+    length = sum(terms.values())
+    term_ids = _get_term_ids(list(terms))
+    SearchPosting.objects.bulk_create(
+        SearchPosting(term_id=term_ids[term], product_id=product.pk,
+                      frequency=frequency, length=length)
+        for term, frequency in terms.items())
+    SearchTerm.objects.filter(pk__in=term_ids.values()).update(
+        documents=F('documents') + 1)
+    _update_stats(1, length)
+
+
+@transaction.atomic
+def unindex_product(pk):
+    """Removes postings of product with given primary key."""
+    postings = SearchPosting.objects.filter(product_id=pk)
+    rows = list(postings.values_list('term_id', 'length'))
+    if not rows:
+        return
+    SearchTerm.objects.filter(pk__in=[term for term, _ in rows]).update(
+        documents=F('documents') - 1)
+    _update_stats(-1, -rows[0][1])
+    postings.delete()
+
+
+@transaction.atomic
+def index_products(products):
+    """Adds postings of many new products.
+
+    products - dicts from values() with pk and indexed fields.
+    """
+    documents = Counter()
+    term_ids = {}
+    total_length = _index_batch(products, documents, term_ids)
+    # Terms with equal document counts are updated together
+    terms_by_count = defaultdict(list)
+    for term, count in documents.items():
+        terms_by_count[count].append(term_ids[term])
+    for count, pks in terms_by_count.items():
+        for start in range(0, len(pks), 500):
+            SearchTerm.objects.filter(pk__in=pks[start:start + 500]).update(
+                documents=F('documents') + count)
+    _update_stats(len(products), total_length)
+
+
+@transaction.atomic
+def rebuild_index(batch_size=2000, progress=None):
+    """Builds inverted index of all products from scratch.
+
+    Document frequencies of terms are accumulated in memory
+    and written once at the end.
+    """
+    SearchPosting.objects.all().delete()
+    SearchTerm.objects.all().delete()
+    SearchStats.objects.all().delete()
+    documents = Counter()
+    term_ids = {}
+    total_documents = total_length = 0
+    products = Product.objects.order_by().values('pk', *FIELD_WEIGHTS)
+    batch = []
+    for product in products.iterator(chunk_size=batch_size):
+        batch.append(product)
+        if len(batch) == batch_size:
+            total_length += _index_batch(batch, documents, term_ids)
+            total_documents += len(batch)
+            batch = []
+            if progress:
+                progress(total_documents)
+    if batch:
+        total_length += _index_batch(batch, documents, term_ids)
+        total_documents += len(batch)
+    SearchTerm.objects.bulk_update(
+        [SearchTerm(pk=term_ids[term], term=term, documents=count)
+         for term, count in documents.items()],
+        ['documents'], batch_size=batch_size)
+    SearchStats.objects.create(pk=1, documents=total_documents,
+                               total_length=total_length)
+    return total_documents
+
+
+def _index_batch(products, documents, term_ids):
+    """Writes postings of batch of products.
+
+    documents and term_ids are updated with terms of the batch.
+    """
+    terms_of_products = [(product['pk'], product_terms(product))
+                         for product in products]
+    new_terms = set()
+    for _, terms in terms_of_products:
+        new_terms.update(term for term in terms if term not in term_ids)
+    term_ids.update(_get_term_ids(list(new_terms)))
+    postings = []
+    total_length = 0
+    for pk, terms in terms_of_products:
+        length = sum(terms.values())
+        total_length += length
+        documents.update(terms.keys())
+        postings.extend((term_ids[term], pk, frequency, length)
+                        for term, frequency in terms.items())
+    # Plain executemany, model instances are too expensive for
+    # millions of postings.
+    with connection.cursor() as cursor:
+        cursor.executemany(_insert_postings_sql(), postings)
+    return total_length
+
+
+def _insert_postings_sql():
+    quote = connection.ops.quote_name
+    columns = ', '.join(
+        quote(SearchPosting._meta.get_field(name).column)
+        for name in ('term', 'product', 'frequency', 'length'))
+    return (f'INSERT INTO {quote(SearchPosting._meta.db_table)} '
+            f'({columns}) VALUES (%s, %s, %s, %s)')
+
+
+def _bm25_ranking(query, queryset):
+    """Returns postings grouped by product and annotated with BM25 score."""
+    terms = list(SearchTerm.objects.filter(term__in=set(tokenize(query)),
+                                           documents__gt=0))
+    stats = SearchStats.objects.filter(pk=1).first()
+    if not terms or stats is None or not stats.documents:
+        return None
+    average_length = stats.total_length / stats.documents
+    idf = Case(*[When(term_id=term.pk, then=Value(_idf(term, stats)))
+                 for term in terms],
+               output_field=FloatField())
+    frequency = Cast('frequency', FloatField())
+    length = Cast('length', FloatField())
+    score = ExpressionWrapper(
+        idf * frequency * Value(K1 + 1) /
+        (frequency + Value(K1 * (1 - B)) +
+         Value(K1 * B / average_length) * length),
+        output_field=FloatField())
+    postings = SearchPosting.objects.filter(term__in=terms)
+    if queryset.query.where:
+        postings = postings.filter(product__in=queryset.values('pk'))
+    return (postings.values('product_id')
+                    .annotate(score=Sum(score))
+                    .order_by('-score', 'product_id'))
+
+
+def _idf(term, stats):
+    return math.log(1 + (stats.documents - term.documents + 0.5) /
+                    (term.documents + 0.5))
+
+
+def search_product_ids(query, queryset=None, limit=50, offset=0):
+    """Returns primary keys of products from queryset that match query,
+    most relevant first."""
+    if queryset is None:
+        queryset = Product.objects.all()
+    if uses_native_search():
+        ranked = (queryset.annotate(rank=RawSQL(
+                      f'ts_rank_cd({SEARCH_VECTOR_SQL}, {SEARCH_QUERY_SQL})',
+                      [query]))
+                  .extra(where=[f'{SEARCH_VECTOR_SQL} @@ {SEARCH_QUERY_SQL}'],
+                         params=[query])
+                  .order_by('-rank', 'pk')
+                  .values_list('pk', flat=True))
+    else:
+        ranked = _bm25_ranking(query, queryset)
+        if ranked is None:
+            return []
+        ranked = ranked.values_list('product_id', flat=True)
+    return list(ranked[offset:offset + limit])
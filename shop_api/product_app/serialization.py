@@ -0,0 +1,88 @@
+"""Fast JSON serialization of products.
+
+django.core.serializers instantiates every product and resolves natural key
+of its shop with a separate query per row. Here only the needed columns are
+read with values() joined with shop's name and city in a single query and
+JSON is written straight from them. Output is the same as
+
+    serializers.serialize('json', products, fields=PRODUCT_FIELDS,
+                          use_natural_foreign_keys=True)
+
+except for products with generated thumbnails of their image, which
+have URLs of them in "thumbnails" key next to "fields"
+(see product_app.thumbnails).
+"""
+import json
+from itertools import islice
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from product_app.models import Product
+from product_app.thumbnails import get_thumbnail_urls
+
+# Serialized fields in the same order as they are declared in the model
+PRODUCT_FIELDS = ['name', 'price', 'available', 'category',
+                  'description', 'shop']
+
+MODEL_LABEL = Product._meta.label_lower
+
+_COLUMNS = ['pk', 'name', 'price', 'available', 'category',
+            'description', 'shop__name', 'shop__city', 'image_hash']
+
+
+def product_values(queryset, *extra):
+    """Projects queryset of products to dicts with serialized columns
+    and extra columns, if any."""
+    return queryset.values(*_COLUMNS, *extra)
+
+
+def to_dump_object(row):
+    """Converts row from product_values to the structure django
+    serializer produces for a product."""
+    shop = None
+    if row['shop__name'] is not None:
+        shop = [row['shop__name'], row['shop__city']]
+    dump_object = {'model': MODEL_LABEL,
+                   'pk': row['pk'],
+                   'fields': {'name': row['name'],
+                              'price': row['price'],
+                              'available': row['available'],
+                              'category': row['category'],
+                              'description': row['description'],
+                              'shop': shop}}
+    if row['image_hash']:
+        dump_object['thumbnails'] = get_thumbnail_urls(row['image_hash'])
+    return dump_object
+
+
+def serialize_products(rows, indent=None):
+    """Serializes rows from product_values to JSON string."""
+    if indent:
+        encoder = DjangoJSONEncoder(indent=indent, separators=(',', ': '))
+        objects = ',\n'.join(encoder.encode(to_dump_object(row))
+                             for row in rows)
+        return f'[\n{objects}\n]\n' if objects else '[\n]\n'
+    encoder = DjangoJSONEncoder()
+    objects = ', '.join(encoder.encode(to_dump_object(row)) for row in rows)
+    return f'[{objects}]'
+
+
+def iter_products_json(queryset, chunk_size=None):
+    """Yields JSON array of products chunk by chunk.
+
+    Rows are read through server-side cursor (on PostgreSQL),
+    so memory does not depend on the number of products.
+    """
+    chunk_size = chunk_size or getattr(settings, 'STREAMING_CHUNK_SIZE',
+                                       2000)
+    rows = product_values(queryset).iterator(chunk_size=chunk_size)
+    encoder = DjangoJSONEncoder()
+    yield '['
+    separator = ''
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        yield separator + ', '.join(encoder.encode(to_dump_object(row))
+                                    for row in chunk)
+        separator = ', '
+    yield ']'
@@ -0,0 +1,109 @@
+from decimal import Decimal
+from functools import partial
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (post_save, post_delete, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+from product_app.catalog import bump_catalog_version, PRODUCTS, SHOPS
+from product_app.models import Product
+from product_app.trigram import TRIGRAM_INDEXES
+from product_app.price_stats import add_price, remove_price
+from product_app.search import (uses_native_search, index_product,
+                                unindex_product)
+from product_app.thumbnails import schedule_thumbnails
+from shop_app.models import Shop
+
+
+@receiver([post_save, post_delete], sender=Product)
+def product_changed(sender, instance, signal, **kwargs):
+    product_trigrams = TRIGRAM_INDEXES[Product]
+    with product_trigrams.tracking() as synced:
+        bump_catalog_version(PRODUCTS)
+        if synced:
+            product_trigrams.update(instance,
+                                    deleted=signal is post_delete)
+
+
+@receiver(post_save, sender=Product)
+def index_saved_product(sender, instance, **kwargs):
+    # PostgreSQL keeps its full-text index by itself.
+    if not uses_native_search():
+        index_product(instance)
+
+
+@receiver(pre_delete, sender=Product)
+def unindex_deleted_product(sender, instance, **kwargs):
+    if not uses_native_search():
+        unindex_product(instance.pk)
+
+
+@receiver(pre_save, sender=Product)
+def remember_old_values(sender, instance, raw=False, **kwargs):
+    instance._old_price = None
+    instance._old_image = None
+    instance._new_version = None
+    # New products have no previous values, even with primary key given
+    if not instance._state.adding:
+        old_values = (Product.objects.filter(pk=instance.pk)
+                             .values_list('price', 'category', 'shop_id',
+                                          'image', 'version')
+                             .first())
+        if old_values is not None:
+            instance._old_price = old_values[:3]
+            instance._old_image = old_values[3]
+            # Fixtures keep their versions. Version is incremented by the
+            # UPDATE itself, the instance gets it after save.
+            if not raw:
+                instance.version = F('version') + 1
+                instance._new_version = old_values[4] + 1
+    # Thumbnails of the previous image are not served for a new one
+    if instance._old_image != (instance.image.name or ''):
+        instance.image_hash = ''
+
+
+@receiver(post_save, sender=Product)
+def set_saved_version(sender, instance, **kwargs):
+    # Saved instance holds the F() expression, not the new version
+    if getattr(instance, '_new_version', None) is not None:
+        instance.version = instance._new_version
+
+
+@receiver(post_save, sender=Product)
+def update_price_stats(sender, instance, **kwargs):
+    old_price = getattr(instance, '_old_price', None)
+    if old_price is not None:
+        price, category, shop_id = old_price
+        # new price may be assigned as float or string
+        if (price == Decimal(str(instance.price)) and
+                category == instance.category and
+                shop_id == instance.shop_id):
+            return
+        remove_price(price, category, shop_id)
+    add_price(instance.price, instance.category, instance.shop_id)
+
+
+@receiver(post_save, sender=Product)
+def generate_image_thumbnails(sender, instance, raw=False, **kwargs):
+    image = instance.image.name
+    # Fixtures and unchanged images keep their thumbnails
+    if raw or not image or instance.image_hash:
+        return
+    transaction.on_commit(partial(schedule_thumbnails, instance.pk, image))
+
+
+@receiver(post_delete, sender=Product)
+def remove_deleted_price(sender, instance, **kwargs):
+    remove_price(instance.price, instance.category, instance.shop_id)
+
+
+@receiver([post_save, post_delete], sender=Shop)
+def shop_changed(sender, instance, signal, **kwargs):
+    shop_trigrams = TRIGRAM_INDEXES[Shop]
+    # Products are serialized with natural key of the shop,
+    # so they are changed too.
+    with shop_trigrams.tracking() as synced, \
+            TRIGRAM_INDEXES[Product].tracking():
+        bump_catalog_version(SHOPS, PRODUCTS)
+        if synced:
+            shop_trigrams.update(instance, deleted=signal is post_delete)
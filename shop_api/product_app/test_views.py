@@ -1,6 +1,9 @@
 from django.test import TestCase, Client, tag
 from django.urls import reverse
 from product_app.models import Product
+from shop_app.models import Shop
+from product_app.catalog import bump_catalog_version, PRODUCTS
+from shop_api.pagination import decode_cursor, encode_cursor
 from django.contrib.auth.models import User
 from decimal import Decimal
 from django.core.exceptions import ObjectDoesNotExist
@@ -8,6 +11,10 @@ from django.http import QueryDict
 from django.core import serializers
 import json
 from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from io import StringIO
+import gzip
 
 
 class TestProductViews(TestCase):
@@ -31,6 +38,8 @@ class TestProductViews(TestCase):
                                               use_natural_foreign_keys=True)
         self.products = json.loads(self.products)
         self.query_str = QueryDict(mutable=True)
+        # cached details outlive rolled back test transactions
+        caches['detail'].clear()
 
     @tag('product_list')
     def test_get_list_of_all_products(self):
@@ -92,6 +101,23 @@ class TestProductViews(TestCase):
         self.assertEqual(product.price,
                          Decimal(99.99).quantize(Decimal('1.00')))
 
+    @tag('update_product_any_field')
+    def test_update_product_image_by_admin(self):
+        self.client.login(username=self.admin.username,
+                          password='admin_password')
+        Product.objects.filter(pk=2).update(image_hash='old')
+        data = {'image': 'products/new.png', 'description': 'New',
+                'version': Product.objects.get(pk=2).version}
+        response = self.client.put(reverse('update_product',
+                                           kwargs={'pk': 2}),
+                                   data,
+                                   content_type='application/json')
+        self.assertEqual(response.status_code, 204)
+        product = Product.objects.get(pk=2)
+        self.assertEqual((product.image.name, product.image_hash,
+                          product.description),
+                         ('products/new.png', '', 'New'))
+
     @tag('upd_prod_inv_val_auth')
     def test_update_product_by_admin_wrong_field(self):
         self.client.login(username=self.admin.username,
@@ -221,3 +247,488 @@ class TestProductViews(TestCase):
         query_str = '?' + self.query_str.urlencode()
         response = self.client.get(reverse('search_by_price') + query_str)
         self.assertEqual(response.status_code, 400)
+
+    @tag('product_list_paginated')
+    def test_get_list_of_products_by_pages(self):
+        response = self.client.get(reverse('product_list') + '?limit=2')
+        self.assertEqual(response.status_code, 200)
+        first_page = response.json()
+        self.assertEqual(len(first_page), 2)
+        self.assertEqual(first_page[0]['fields'], self.products[0]['fields'])
+        self.assertEqual(first_page[1]['fields'], self.products[1]['fields'])
+        cursor = response['X-Next-Cursor']
+
+        self.query_str.update({'after': cursor, 'limit': 2})
+        query_str = '?' + self.query_str.urlencode()
+        response = self.client.get(reverse('product_list') + query_str)
+        self.assertEqual(response.status_code, 200)
+        second_page = response.json()
+        self.assertEqual(len(second_page), 1)
+        self.assertEqual(second_page[0]['fields'], self.products[2]['fields'])
+        self.assertFalse(response.has_header('X-Next-Cursor'))
+
+    @tag('product_list_paginated_ties')
+    def test_pagination_with_equal_ordering_values(self):
+        for _ in range(3):
+            Product.objects.create(name='apple', price=12.40,
+                                   description='green', category='fruits')
+        pks, cursor = [], None
+        while True:
+            self.query_str.update({'limit': 2})
+            if cursor:
+                self.query_str['after'] = cursor
+            query_str = '?' + self.query_str.urlencode()
+            response = self.client.get(reverse('product_list') + query_str)
+            pks.extend(item['pk'] for item in response.json())
+            if not response.has_header('X-Next-Cursor'):
+                break
+            cursor = response['X-Next-Cursor']
+        self.assertEqual(len(pks), 6)
+        self.assertEqual(len(set(pks)), 6)
+
+    @tag('product_list_wrong_cursor')
+    def test_get_list_of_products_wrong_cursor(self):
+        response = self.client.get(reverse('product_list') +
+                                   '?after=broken&limit=2')
+        self.assertEqual(response.status_code, 400)
+        # Well-formed cursor with value which does not fit its field
+        response = self.client.get(reverse('product_list') + '?limit=2')
+        values = decode_cursor(response['X-Next-Cursor'], 3)
+        forged = encode_cursor(values[:-1] + ['abc'])
+        response = self.client.get(reverse('product_list'),
+                                   {'after': forged, 'limit': 2})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('product_list') + '?limit=-1')
+        self.assertEqual(response.status_code, 400)
+
+    @tag('product_list_stream')
+    def test_stream_list_of_all_products(self):
+        response = self.client.get(reverse('product_list') + '?stream=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode('utf-8')
+        expected = serializers.serialize('json',
+                                         Product.objects.all(),
+                                         fields=['name', 'price',
+                                                 'description', 'category',
+                                                 'shop', 'available'],
+                                         use_natural_foreign_keys=True)
+        self.assertEqual(content, expected)
+
+    @tag('product_list_stream_chunks')
+    def test_stream_products_by_small_chunks(self):
+        with self.settings(STREAMING_CHUNK_SIZE=2):
+            response = self.client.get(reverse('product_list') + '?stream=1')
+            content = b''.join(response.streaming_content)
+        data_to_compare = json.loads(content.decode('utf-8'))
+        self.assertEqual([item['fields'] for item in data_to_compare],
+                         [item['fields'] for item in self.products])
+
+    @tag('product_list_same_as_serializer')
+    def test_list_of_products_matches_django_serializer(self):
+        expected = serializers.serialize('json',
+                                         Product.objects.all(),
+                                         fields=['name', 'price',
+                                                 'description', 'category',
+                                                 'shop', 'available'],
+                                         indent=2,
+                                         use_natural_foreign_keys=True)
+        # catalog version lookup and products with shops in a single query
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('product_list'))
+        self.assertEqual(response.content.decode('utf-8'), expected)
+
+    @tag('detail_product_without_shop')
+    def test_get_detail_product_without_shop(self):
+        product = Product.objects.create(name='shirt', price=104.99,
+                                         description='white',
+                                         category='cloth')
+        response = self.client.get(reverse('detail_product',
+                                           kwargs={'pk': product.pk}))
+        self.assertEqual(response.status_code, 200)
+        data_to_compare = response.json()
+        self.assertIsNone(data_to_compare[0]['fields']['shop'])
+        self.assertEqual(data_to_compare[0]['fields']['price'], '104.99')
+
+    @tag('product_list_not_modified')
+    def test_get_list_of_products_not_modified(self):
+        response = self.client.get(reverse('product_list'))
+        etag = response['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('product_list'),
+                                       HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        Product.objects.filter(pk=2).first().save()
+        response = self.client.get(reverse('product_list'),
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    @tag('detail_product_not_modified')
+    def test_get_detail_product_not_modified(self):
+        response = self.client.get(reverse('detail_product', kwargs={'pk': 2}))
+        last_modified = response['Last-Modified']
+        response = self.client.get(reverse('detail_product', kwargs={'pk': 2}),
+                                   HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+        other = self.client.get(reverse('detail_product', kwargs={'pk': 1}))
+        self.assertNotEqual(other['ETag'], response['ETag'])
+
+    @tag('detail_product_cache')
+    def test_detail_product_cache_invalidation(self):
+        self.client.get(reverse('detail_product', kwargs={'pk': 2}))
+        # served from cache: only catalog version lookup is performed
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('detail_product',
+                                               kwargs={'pk': 2}))
+        self.assertEqual(response.json()[0]['fields'],
+                         self.products[2]['fields'])
+
+        product = Product.objects.get(pk=2)
+        product.shop.name = 'Renamed'
+        product.shop.save()
+        response = self.client.get(reverse('detail_product', kwargs={'pk': 2}))
+        self.assertEqual(response.json()[0]['fields']['shop'][0], 'Renamed')
+
+        # Changed by another process, its signals do not reach this one
+        Product.objects.filter(pk=2).update(name='Changed elsewhere')
+        bump_catalog_version(PRODUCTS)
+        response = self.client.get(reverse('detail_product', kwargs={'pk': 2}))
+        self.assertEqual(response.json()[0]['fields']['name'],
+                         'Changed elsewhere')
+
+        Product.objects.get(pk=2).shop.delete()
+        response = self.client.get(reverse('detail_product', kwargs={'pk': 2}))
+        self.assertEqual(response.status_code, 404)
+
+    @tag('cache_stats')
+    def test_cache_stats_by_admin(self):
+        self.client.get(reverse('detail_product', kwargs={'pk': 2}))
+        self.client.get(reverse('detail_product', kwargs={'pk': 2}))
+        response = self.client.get(reverse('cache_stats'))
+        self.assertEqual(response.status_code, 302)
+        self.client.login(username=self.admin.username,
+                          password='admin_password')
+        response = self.client.get(reverse('cache_stats'))
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(response.json()['product']['hits'], 1)
+
+    @tag('full_text_search')
+    def test_full_text_product_search(self):
+        response = self.client.generic('GET', reverse('approximate_search'),
+                                       json.dumps({'q': 'orange carrot'}),
+                                       content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        data_to_compare = response.json()
+        self.assertEqual(len(data_to_compare), 1)
+        self.assertEqual(data_to_compare[0]['fields'],
+                         self.products[2]['fields'])
+
+        response = self.client.generic('GET', reverse('approximate_search'),
+                                       json.dumps({'q': 'blue'}),
+                                       content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+    @tag('search_by_shop_body')
+    def test_search_product_by_shop_substring(self):
+        response = self.client.generic('GET', reverse('search_by_shop'),
+                                       json.dumps({'name': 'groc',
+                                                   'city': 'york'}),
+                                       content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        data_to_compare = response.json()
+        self.assertEqual(len(data_to_compare), 1)
+        self.assertEqual(data_to_compare[0]['fields'],
+                         self.products[1]['fields'])
+
+    @tag('search_prod_by_price_body')
+    def test_search_product_by_price_range_without_upper_bound(self):
+        with self.assertNumQueries(1):
+            response = self.client.generic('GET', reverse('search_by_price'),
+                                           json.dumps({'from': 30}),
+                                           content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        data_to_compare = [item['fields'] for item in response.json()]
+        self.assertEqual(data_to_compare, [self.products[2]['fields'],
+                                           self.products[1]['fields']])
+
+    @tag('search_prod_by_price_estimate')
+    def test_search_product_by_price_range_estimate(self):
+        call_command('rebuild_price_stats', stdout=StringIO())
+        response = self.client.generic('GET', reverse('search_by_price') +
+                                       '?estimate=only',
+                                       json.dumps({'from': 30, 'to': 60}),
+                                       content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('estimated_count', response.json())
+        response = self.client.generic('GET', reverse('search_by_price') +
+                                       '?estimate=1',
+                                       json.dumps({'from': 'test'}),
+                                       content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    @tag('price_statistics')
+    def test_get_price_statistics(self):
+        response = self.client.get(reverse('price_statistics'))
+        self.assertEqual(response.status_code, 200)
+        statistics = response.json()
+        self.assertEqual(statistics['all']['min'], '12.40')
+        self.assertEqual(statistics['all']['max'], '51.00')
+        self.assertEqual(statistics['category']['toys']['products'], 1)
+
+    @tag('facets')
+    def test_faceted_product_search(self):
+        response = self.client.generic('GET', reverse('facets'),
+                                       json.dumps({'price': '10-50'}),
+                                       content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        content = response.json()
+        self.assertEqual([item['fields'] for item in content['products']],
+                         [self.products[0]['fields'],
+                          self.products[2]['fields']])
+        self.assertEqual(content['facets'],
+                         {'category': {'fruits': 1, 'vegetables': 1},
+                          'shop': {'1': {'label': 'Walmart', 'products': 1},
+                                   '2': {'label': 'Apricot', 'products': 1}},
+                          'available': {'true': 2},
+                          'price': {'10-50': 2}})
+
+        for filters in ({'colour': 'red'}, {'shop': 'Walmart'}):
+            response = self.client.generic('GET', reverse('facets'),
+                                           json.dumps(filters),
+                                           content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
+    @tag('facets_shop_id')
+    def test_shops_of_same_name_are_separate_facet_values(self):
+        other = Shop.objects.create(name='Walmart', city='Berlin',
+                                    owner='Someone else')
+        ball = Product.objects.get(name='ball')
+        ball.shop = other
+        ball.save()
+        response = self.client.generic('GET', reverse('facets'),
+                                       json.dumps({'shop': other.pk}),
+                                       content_type='application/json')
+        content = response.json()
+        self.assertEqual([item['fields']['name']
+                          for item in content['products']], ['ball'])
+        self.assertEqual(content['facets']['shop'],
+                         {str(other.pk): {'label': 'Walmart',
+                                          'products': 1}})
+        response = self.client.get(reverse('facets'))
+        self.assertEqual(
+            response.json()['facets']['shop'][str(other.pk)]['products'], 1)
+
+    @tag('facets_etag_body')
+    def test_faceted_search_etag_depends_on_filters(self):
+        response = self.client.generic('GET', reverse('facets'),
+                                       json.dumps({'price': '10-50'}),
+                                       content_type='application/json')
+        etag = response['ETag']
+        response = self.client.generic('GET', reverse('facets'),
+                                       json.dumps({'price': '10-50'}),
+                                       content_type='application/json',
+                                       HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.generic('GET', reverse('facets'),
+                                       json.dumps({'price': '50-100'}),
+                                       content_type='application/json',
+                                       HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['facets']['price'], {'50-100': 1})
+
+    @tag('facets_cache')
+    def test_facet_counts_cache_invalidation(self):
+        self.client.get(reverse('facets'))
+        # catalog version and products, counts are cached
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('facets'))
+        self.assertEqual(response.json()['facets']['price'],
+                         {'10-50': 2, '50-100': 1})
+
+        product = Product.objects.get(name='ball')
+        product.price = 5
+        product.save()
+        response = self.client.get(reverse('facets'))
+        self.assertEqual(response.json()['facets']['price'],
+                         {'0-10': 1, '10-50': 2})
+
+    @tag('exact_search_filters')
+    def test_exact_search_product_by_allowed_filters(self):
+        filters = {'category': 'vegetables', 'available': True,
+                   'price__gte': '30'}
+        self.client.generic('GET', reverse('exact_search'),
+                            json.dumps(filters),
+                            content_type='application/json')
+        # the same filter shape is served from compiled SQL
+        filters['category'] = 'toys'
+        with self.assertNumQueries(1):
+            response = self.client.generic('GET', reverse('exact_search'),
+                                           json.dumps(filters),
+                                           content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['fields'] for item in response.json()],
+                         [self.products[1]['fields']])
+
+        filters['price__gte'] = '60'
+        response = self.client.generic('GET', reverse('exact_search'),
+                                       json.dumps(filters),
+                                       content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+    @tag('exact_search_not_allowed')
+    def test_exact_search_product_by_not_allowed_filters(self):
+        for filters in ({'description__icontains': 'red'},
+                        {'basket__user__username': 'admin'},
+                        {'price__gte': 'cheap'},
+                        {'available': 'maybe'}):
+            response = self.client.generic('GET', reverse('exact_search'),
+                                           json.dumps(filters),
+                                           content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
+    @tag('create_products_bulk')
+    def test_create_products_in_bulk_by_admin(self):
+        self.client.login(username=self.admin.username,
+                          password='admin_password')
+        rows = [{'name': 'shirt', 'price': 104.99, 'description': 'white',
+                 'category': 'cloth', 'shop': 1, 'available': True},
+                {'name': 'hat', 'price': 'free', 'description': 'black',
+                 'category': 'cloth', 'shop': 1},
+                {'name': 'socks', 'price': 5, 'description': 'grey',
+                 'category': 'cloth', 'shop': 100}]
+        body = '\n'.join(json.dumps(row) for row in rows) + '\n{broken'
+        response = self.client.post(reverse('create_products'), body,
+                                    content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 201)
+        report = response.json()
+        self.assertEqual(report['created'], 1)
+        self.assertEqual([error['row'] for error in report['errors']],
+                         [2, 4, 3])
+        self.assertIn('price', report['errors'][0]['errors'])
+        self.assertIn('shop', report['errors'][2]['errors'])
+        self.assertEqual(Product.objects.filter(name='shirt').count(), 1)
+
+        response = self.client.post(reverse('create_products'),
+                                    json.dumps(rows[1:]),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['created'], 0)
+
+    @tag('create_products_bulk_unauth')
+    def test_create_products_in_bulk_by_non_admin(self):
+        self.client.login(username=self.customer.username,
+                          password='cust_password')
+        response = self.client.post(reverse('create_products'), '[]',
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Product.objects.count(), 3)
+
+    @tag('product_version_after_save')
+    def test_saved_product_holds_its_new_version(self):
+        product = Product.objects.get(pk=2)
+        version = product.version
+        product.save()
+        self.assertEqual(product.version, version + 1)
+        product.price = Decimal('1.50')
+        product.save()
+        self.assertEqual(product.version, version + 2)
+        self.assertEqual(Product.objects.get(pk=2).version, version + 2)
+
+    @tag('update_product_partial')
+    def test_update_product_writes_changed_columns_only(self):
+        self.client.login(username=self.admin.username,
+                          password='admin_password')
+        response = self.client.get(reverse('detail_product',
+                                           kwargs={'pk': 2}))
+        version = response['X-Product-Version']
+        data = {'price': '40.10', 'version': version}
+        response = self.client.patch(reverse('update_product',
+                                             kwargs={'pk': 2}),
+                                     data, content_type='application/json')
+        self.assertEqual(response.status_code, 204)
+        product = Product.objects.get(pk=2)
+        self.assertEqual(product.price, Decimal('40.10'))
+        self.assertEqual(product.version, int(version) + 1)
+        response = self.client.get(reverse('detail_product',
+                                           kwargs={'pk': 2}))
+        self.assertEqual(response['X-Product-Version'], str(int(version) + 1))
+
+        # stale version
+        response = self.client.patch(reverse('update_product',
+                                             kwargs={'pk': 2}),
+                                     data, content_type='application/json')
+        self.assertEqual(response.status_code, 409)
+        response = self.client.patch(reverse('update_product',
+                                             kwargs={'pk': 2}),
+                                     {'price': 'free'},
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.patch(reverse('update_product',
+                                             kwargs={'pk': 200}),
+                                     {'price': 10},
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+    @tag('update_products_bulk')
+    def test_update_products_in_bulk_by_admin(self):
+        self.client.login(username=self.admin.username,
+                          password='admin_password')
+        rows = [{'pk': 1, 'price': 10.5, 'version': 0},
+                {'pk': 2, 'available': False},
+                {'pk': 3, 'price': 60, 'version': 5},
+                {'pk': 300, 'price': 1},
+                {'pk': 1, 'name': 'pear'}]
+        response = self.client.patch(reverse('update_products'),
+                                     json.dumps(rows),
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        report = response.json()
+        self.assertEqual(report['updated'], 2)
+        self.assertEqual(sorted(error['row'] for error in report['errors']),
+                         [3, 4, 5])
+        products = {product.pk: product for product in Product.objects.all()}
+        self.assertEqual(products[1].price, Decimal('10.50'))
+        self.assertFalse(products[2].available)
+        self.assertEqual(products[3].price, Decimal('51.00'))
+        self.assertEqual([products[pk].version for pk in (1, 2, 3)],
+                         [1, 1, 0])
+        response = self.client.get(reverse('price_statistics'))
+        self.assertEqual(response.json()['all']['min'], '10.50')
+
+    @tag('export_products')
+    def test_export_products_by_admin(self):
+        self.client.login(username=self.admin.username,
+                          password='admin_password')
+        response = self.client.get(reverse('export_products'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(json.loads(lines[0]),
+                         {'id': 1, 'name': 'apple', 'price': '12.40',
+                          'available': True, 'category': 'fruits',
+                          'description': 'green', 'shop_name': 'Walmart',
+                          'shop_city': 'Paris'})
+        self.assertEqual(len(lines), 3)
+
+        response = self.client.get(reverse('export_products') +
+                                   '?format=csv&compress=gzip')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        content = gzip.decompress(b''.join(response.streaming_content))
+        self.assertEqual(content.decode().splitlines()[:2],
+                         ['id,name,price,available,category,description,'
+                          'shop_name,shop_city',
+                          '1,apple,12.40,true,fruits,green,Walmart,Paris'])
+
+        response = self.client.get(reverse('export_products') +
+                                   '?format=xml')
+        self.assertEqual(response.status_code, 400)
+
+    @tag('export_products_unauth')
+    def test_export_products_by_customer(self):
+        self.client.login(username=self.customer.username,
+                          password='cust_password')
+        response = self.client.get(reverse('export_products'))
+        self.assertEqual(response.status_code, 302)
@@ -0,0 +1,107 @@
+from django.core.exceptions import ValidationError
+from django.test import TestCase, tag
+from product_app.bulk import (iter_json_rows, ingest_products,
+                              update_product, update_products_in_bulk)
+from product_app.catalog import PRODUCTS
+from product_app.models import Product, PriceRange, CatalogVersion
+from product_app.search import search_product_ids
+from product_app.trigram import substring_filter
+from shop_app.models import Shop
+from io import BytesIO
+import json
+
+
+class TestBulkIngest(TestCase):
+
+    def setUp(self):
+        self.shop = Shop.objects.create(name='Amigo', city='Madrid',
+                                        owner='Homer Sanchez')
+        self.rows = [{'name': f'Ball {i}', 'price': i, 'category': 'Toys',
+                      'description': 'Round and red.', 'shop': self.shop.pk}
+                     for i in range(1, 21)]
+
+    def parse(self, body, chunk_size=7):
+        return list(iter_json_rows(BytesIO(body.encode('utf-8')),
+                                   chunk_size=chunk_size))
+
+    @tag('bulk_parse_array')
+    def test_parse_json_array_by_small_chunks(self):
+        body = json.dumps(self.rows + [12.5, 'Käse'], indent=2)
+        rows = self.parse(body)
+        self.assertEqual([number for number, _ in rows], list(range(1, 23)))
+        self.assertEqual([row for _, row in rows], self.rows + [12.5, 'Käse'])
+
+        rows = self.parse('[{"name": "a"}, {"name": ]')
+        self.assertEqual(rows[0], (1, {'name': 'a'}))
+        self.assertIsInstance(rows[1][1], ValidationError)
+
+        # Unterminated row is not buffered up to the end of upload
+        stream = BytesIO(('[{"name": "a"}, {"name": "' + 'x' * 10000)
+                         .encode('utf-8'))
+        rows = list(iter_json_rows(stream, chunk_size=7, max_row_size=100))
+        self.assertEqual(rows[0], (1, {'name': 'a'}))
+        self.assertIsInstance(rows[1][1], ValidationError)
+        self.assertLess(stream.tell(), 200)
+
+    @tag('bulk_parse_ndjson')
+    def test_parse_ndjson_by_small_chunks(self):
+        body = '\n'.join(json.dumps(row) for row in self.rows)
+        rows = self.parse(body + '\n\n{"name": \n{"name": "last"}')
+        self.assertEqual([row for _, row in rows[:20]], self.rows)
+        self.assertIsInstance(rows[20][1], ValidationError)
+        self.assertEqual(rows[21], (22, {'name': 'last'}))
+        self.assertEqual(self.parse(''), [])
+
+        # Too long line is skipped, next lines are parsed
+        body = '{"name": "' + 'x' * 1000 + '"}\n{"name": "next"}\n'
+        rows = list(iter_json_rows(BytesIO(body.encode('utf-8')),
+                                   chunk_size=7, max_row_size=100))
+        self.assertEqual(len(rows), 2)
+        self.assertIsInstance(rows[0][1], ValidationError)
+        self.assertEqual(rows[1], (2, {'name': 'next'}))
+
+    @tag('bulk_ingest_derived_data')
+    def test_ingest_updates_derived_data(self):
+        Product.objects.create(name='Apple', price=50, category='Fruits',
+                               description='Green.', shop=self.shop)
+        version = CatalogVersion.objects.get(name=PRODUCTS).version
+        # builds trigram index before ingest
+        substring_filter(Product.objects.all(), {'name': 'apple'})
+
+        created, errors = ingest_products(enumerate(self.rows, 1),
+                                          batch_size=8)
+        self.assertEqual((created, errors), (20, []))
+        self.assertEqual(CatalogVersion.objects.get(name=PRODUCTS).version,
+                         version + 3)
+        toys = PriceRange.objects.get(kind=PriceRange.CATEGORY, key='Toys')
+        self.assertEqual((toys.minimum, toys.maximum, toys.products),
+                         (1, 20, 20))
+        catalog = PriceRange.objects.get(kind=PriceRange.ALL)
+        self.assertEqual((catalog.minimum, catalog.maximum, catalog.products),
+                         (1, 50, 21))
+        self.assertEqual(len(search_product_ids('red ball', limit=100)), 20)
+        found = substring_filter(Product.objects.all(), {'name': 'ball 1'})
+        self.assertEqual(found.count(), 11)
+
+    @tag('bulk_update_derived_data')
+    def test_updates_keep_derived_data(self):
+        ingest_products(enumerate(self.rows, 1))
+        substring_filter(Product.objects.all(), {'name': 'ball'})
+        ball = Product.objects.get(name='Ball 20')
+
+        self.assertEqual(update_product(ball.pk, {'name': 'Green apple'},
+                                        version=5), 0)
+        self.assertEqual(update_product(ball.pk, {'name': 'Green apple'},
+                                        version=0), 1)
+        self.assertEqual(search_product_ids('apple'), [ball.pk])
+        found = substring_filter(Product.objects.all(), {'name': 'apple'})
+        self.assertEqual(list(found), [Product.objects.get(pk=ball.pk)])
+
+        changes = [{'pk': product.pk, 'price': product.price + 100}
+                   for product in Product.objects.filter(price__gt=10)]
+        updated, errors = update_products_in_bulk(enumerate(changes, 1),
+                                                  batch_size=4)
+        self.assertEqual((updated, errors), (10, []))
+        toys = PriceRange.objects.get(kind=PriceRange.CATEGORY, key='Toys')
+        self.assertEqual((toys.minimum, toys.maximum, toys.products),
+                         (1, 120, 20))
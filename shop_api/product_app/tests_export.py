@@ -0,0 +1,100 @@
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, tag
+from django.urls import reverse
+from product_app.export import iter_python_export
+from product_app.models import Product
+from shop_app.models import Shop
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+
+class CopyingConnection:
+    """psycopg2 connection whose COPY writes rows until it is cancelled."""
+
+    def __init__(self):
+        self.cancelled = threading.Event()
+        self.closed = 0
+        self.rows = 0
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def copy_expert(self, sql, stream):
+        while not self.cancelled.is_set():
+            stream.write(b'{"id":1}\n')
+            self.rows += 1
+        raise Exception('canceling statement due to user request')
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def close(self):
+        self.closed = 1
+
+
+class TestCatalogExport(TestCase):
+
+    def setUp(self):
+        shop = Shop.objects.create(name='Amigo', city='Madrid',
+                                   owner='Homer Sanchez')
+        for i in range(25):
+            Product.objects.create(name=f'Ball "{i}", red',
+                                   price=i,
+                                   category='Toys',
+                                   description='Round\nand red.',
+                                   shop=shop if i % 5 else None)
+
+    @tag('export_chunks')
+    def test_export_by_small_chunks(self):
+        chunks = list(iter_python_export('ndjson', chunk_size=10))
+        self.assertEqual(len(chunks), 3)
+        rows = [json.loads(line) for chunk in chunks
+                for line in chunk.decode().splitlines()]
+        self.assertEqual([row['id'] for row in rows],
+                         sorted(Product.objects.values_list('pk',
+                                                            flat=True)))
+        self.assertIsNone(rows[0]['shop_name'])
+
+    @tag('export_catalog_command')
+    def test_export_catalog_command(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'products.csv.gz')
+        call_command('export_catalog', format='csv', output=path, gzip=True)
+        with gzip.open(path, 'rt', newline='') as stream:
+            content = stream.read()
+        self.assertTrue(content.startswith('id,name,price,available,'))
+        self.assertIn('"Ball ""1"", red",1.00,false,Toys,"Round\nand red.",'
+                      'Amigo,Madrid', content)
+
+    @tag('export_copy_abandoned')
+    def test_abandoned_copy_export_is_cancelled(self):
+        User.objects.create_user(username='admin', password='admin_password',
+                                 is_staff=True)
+        self.client.login(username='admin', password='admin_password')
+        with mock.patch('product_app.export.uses_copy', return_value=True):
+            response = self.client.get(reverse('export_products'))
+        raw_connection = CopyingConnection()
+        # COPY starts when the response is read
+        with mock.patch('product_app.export.connection') as connection:
+            connection.connection = raw_connection
+            chunks = iter(response.streaming_content)
+            self.assertEqual(next(chunks), b'{"id":1}\n')
+            # Client went away
+            response.close()
+        self.assertTrue(raw_connection.cancelled.is_set())
+        self.assertTrue(raw_connection.closed)
+        self.assertLess(raw_connection.rows, 100)
+        connection.close.assert_called_once_with()
@@ -0,0 +1,83 @@
+from django.core.management import call_command, CommandError
+from django.test import TestCase, tag
+from product_app.catalog_import import import_products, get_progress
+from product_app.models import Product, PriceRange, CatalogImport
+from product_app.search import search_product_ids
+from shop_app.models import Shop
+from io import StringIO
+import json
+import os
+import shutil
+import tempfile
+
+
+class TestCatalogImport(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.shops = self.write('shops.csv',
+                                'name,city,owner\n'
+                                'Amigo,Madrid,Homer Sanchez\n'
+                                'Amigo,Paris,Jean Valjean\n'
+                                ',Paris,Nobody\n')
+        products = [{'name': f'Ball {i}', 'price': f'{i}.50',
+                     'available': True, 'category': 'Toys',
+                     'description': 'Round and red.',
+                     'shop': ['Amigo', 'Paris' if i % 2 else 'Madrid']}
+                    for i in range(10)]
+        products.append({'name': 'Lost ball', 'price': '1',
+                         'category': 'Toys', 'description': 'Round.',
+                         'shop': ['Amigo', 'Rome']})
+        self.products = self.write('products.ndjson', '\n'.join(
+            json.dumps(product) for product in products))
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as stream:
+            stream.write(content)
+        return path
+
+    @tag('import_catalog')
+    def test_import_catalog_command(self):
+        out, err = StringIO(), StringIO()
+        call_command('import_catalog', shops=self.shops,
+                     products=self.products, chunk_size=4,
+                     stdout=out, stderr=err)
+        self.assertIn('shops: 2 created, 1 rejected.', out.getvalue())
+        self.assertIn('products: 10 created, 1 rejected.', out.getvalue())
+        self.assertIn('row 11', err.getvalue())
+        self.assertEqual(Product.objects.filter(
+            shop__city='Paris').count(), 5)
+        self.assertEqual(len(search_product_ids('ball', limit=100)), 10)
+        catalog = PriceRange.objects.get(kind=PriceRange.ALL)
+        self.assertEqual((catalog.minimum, catalog.maximum, catalog.products),
+                         (0.5, 9.5, 10))
+
+        # finished files are not imported twice
+        call_command('import_catalog', shops=self.shops,
+                     products=self.products, stdout=StringIO(),
+                     stderr=StringIO())
+        self.assertEqual(Shop.objects.count(), 2)
+        self.assertEqual(Product.objects.count(), 10)
+
+    @tag('import_catalog_resume')
+    def test_import_continues_after_committed_rows(self):
+        call_command('import_catalog', shops=self.shops, stdout=StringIO(),
+                     stderr=StringIO())
+        # previous run committed the first 4 rows and failed
+        progress = get_progress('products', self.products)
+        progress.rows = 4
+        progress.save()
+        created, errors = import_products(self.products, chunk_size=3)
+        self.assertEqual((created, len(errors)), (6, 1))
+        self.assertEqual(sorted(Product.objects.values_list('name',
+                                                            flat=True)),
+                         [f'Ball {i}' for i in range(4, 10)])
+        self.assertTrue(CatalogImport.objects.get(
+            source__startswith='products:').finished)
+
+        self.write('products.ndjson', '{"name": "changed"}')
+        with self.assertRaises(CommandError):
+            call_command('import_catalog', products=self.products,
+                         stdout=StringIO(), stderr=StringIO())
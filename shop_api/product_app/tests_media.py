@@ -0,0 +1,126 @@
+from django.http import FileResponse
+from django.test import TestCase, tag, override_settings
+from django.urls import reverse
+from django.utils.http import http_date
+from http import HTTPStatus
+from shop_api.media import parse_range, UnsatisfiableRange, ByteRange
+import os
+import shutil
+import tempfile
+
+CONTENT = bytes(range(256)) * 40
+
+HASH = 'ab' + 'c' * 62
+
+
+class TestMediaServing(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings = override_settings(MEDIA_ROOT=self.media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        with open(os.path.join(self.media_root, 'ball.png'), 'wb') as image:
+            image.write(CONTENT)
+        self.url = reverse('media', args=['ball.png'])
+
+    def get(self, url=None, **headers):
+        response = self.client.get(url or self.url, **headers)
+        content = b''
+        if response.status_code in (HTTPStatus.OK, HTTPStatus.PARTIAL_CONTENT):
+            content = b''.join(response.streaming_content)
+        response.close()
+        return response, content
+
+    @tag('media_whole_file')
+    def test_whole_file_is_served_from_file_object(self):
+        response, content = self.get()
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(content, CONTENT)
+        self.assertIsInstance(response, FileResponse)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response['Content-Length'], str(len(CONTENT)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+
+    @tag('media_range')
+    def test_byte_ranges(self):
+        response, content = self.get(HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, HTTPStatus.PARTIAL_CONTENT)
+        self.assertEqual(content, CONTENT[100:200])
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(response['Content-Range'],
+                         f'bytes 100-199/{len(CONTENT)}')
+
+        response, content = self.get(HTTP_RANGE='bytes=-10')
+        self.assertEqual(content, CONTENT[-10:])
+        response, content = self.get(HTTP_RANGE='bytes=10000-')
+        self.assertEqual(content, CONTENT[10000:])
+
+        response, _ = self.get(HTTP_RANGE=f'bytes={len(CONTENT)}-')
+        self.assertEqual(response.status_code,
+                         HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response['Content-Range'],
+                         f'bytes */{len(CONTENT)}')
+
+        # Several ranges are answered with the whole file
+        response, content = self.get(HTTP_RANGE='bytes=0-1,5-6')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(content, CONTENT)
+
+    @tag('media_if_range')
+    def test_if_range_with_outdated_etag_sends_whole_file(self):
+        etag = self.get()[0]['ETag']
+        response, content = self.get(HTTP_RANGE='bytes=0-9',
+                                     HTTP_IF_RANGE=etag)
+        self.assertEqual(content, CONTENT[:10])
+        response, content = self.get(HTTP_RANGE='bytes=0-9',
+                                     HTTP_IF_RANGE='"outdated"')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(content, CONTENT)
+
+    @tag('media_conditional')
+    def test_conditional_requests(self):
+        response, _ = self.get()
+        response, content = self.get(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertEqual(content, b'')
+        last_modified = response['Last-Modified']
+        response, _ = self.get(HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+        os.utime(os.path.join(self.media_root, 'ball.png'))
+        response, _ = self.get(HTTP_IF_NONE_MATCH='"outdated"')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        response, _ = self.get(HTTP_IF_MATCH='"outdated"')
+        self.assertEqual(response.status_code, HTTPStatus.PRECONDITION_FAILED)
+        response, _ = self.get(HTTP_IF_UNMODIFIED_SINCE=http_date(24 * 60 * 60))
+        self.assertEqual(response.status_code, HTTPStatus.PRECONDITION_FAILED)
+
+    @tag('media_content_addressed')
+    def test_thumbnails_are_cached_forever(self):
+        name = f'thumbnails/ab/{HASH}/64.webp'
+        os.makedirs(os.path.join(self.media_root, os.path.dirname(name)))
+        with open(os.path.join(self.media_root, name), 'wb') as image:
+            image.write(CONTENT)
+        response, _ = self.get(reverse('media', args=[name]))
+        self.assertEqual(response['Cache-Control'],
+                         'public, max-age=31536000, immutable')
+        self.assertEqual(response['Content-Type'], 'image/webp')
+
+    @tag('media_not_found')
+    def test_files_out_of_media_root_are_not_served(self):
+        for path in ['missing.png', '../settings.py', 'thumbnails']:
+            response = self.client.get(f'/media/{path}')
+            self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    @tag('media_parse_range')
+    def test_parse_range(self):
+        self.assertEqual(parse_range('bytes=0-', 10), ByteRange(0, 10))
+        self.assertEqual(parse_range('bytes=5-100', 10), ByteRange(5, 5))
+        self.assertEqual(parse_range('bytes=-100', 10), ByteRange(0, 10))
+        self.assertIsNone(parse_range('bytes=5-4', 10))
+        self.assertIsNone(parse_range('items=0-1', 10))
+        with self.assertRaises(UnsatisfiableRange):
+            parse_range('bytes=-0', 10)
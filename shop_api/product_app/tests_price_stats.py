@@ -0,0 +1,87 @@
+from unittest import mock
+from django.core.management import call_command
+from django.test import TestCase, tag
+from product_app.models import Product, PriceRange, PriceBucket
+from product_app import price_stats
+from product_app.price_stats import (estimate_products_in_range,
+                                     get_price_range, add_price)
+from shop_app.models import Shop
+from decimal import Decimal
+from io import StringIO
+
+
+class TestPriceStats(TestCase):
+
+    def setUp(self):
+        self.shop = Shop.objects.create(name='Amigo', city='Madrid',
+                                        owner='Homer Sanchez')
+        for price in range(1, 101):
+            Product.objects.create(name=f'Product {price}',
+                                   price=price,
+                                   category='Toys' if price % 2 else 'Fruits',
+                                   description='',
+                                   shop=self.shop)
+
+    def get_range(self, kind, key=''):
+        return get_price_range(kind, key)
+
+    @tag('price_ranges_on_write')
+    def test_price_ranges_maintained_on_write(self):
+        catalog = self.get_range(PriceRange.ALL)
+        self.assertEqual((catalog.minimum, catalog.maximum, catalog.products),
+                         (1, 100, 100))
+        toys = self.get_range(PriceRange.CATEGORY, 'Toys')
+        self.assertEqual((toys.minimum, toys.maximum), (1, 99))
+
+        Product.objects.get(price=1).delete()
+        product = Product.objects.get(price=99)
+        product.price = 150.5
+        product.save()
+        # Removed minimum is recomputed on read
+        toys = PriceRange.objects.get(kind=PriceRange.CATEGORY, key='Toys')
+        self.assertEqual((toys.minimum, toys.stale), (1, True))
+        self.assertFalse(self.get_range(PriceRange.CATEGORY, 'Fruits').stale)
+        toys = self.get_range(PriceRange.CATEGORY, 'Toys')
+        self.assertEqual((toys.minimum, toys.maximum),
+                         (3, Decimal('150.50')))
+        self.assertEqual((toys.products, toys.stale), (49, False))
+        shop = self.get_range(PriceRange.SHOP, str(self.shop.pk))
+        self.assertEqual((shop.minimum, shop.maximum),
+                         (2, Decimal('150.50')))
+
+    @tag('price_range_created_concurrently')
+    def test_range_created_meanwhile_is_updated(self):
+        widen_range = price_stats._widen_range
+        calls = []
+
+        def created_meanwhile(kind, key, *args):
+            # The first UPDATE runs before the other transaction commits
+            if kind == PriceRange.CATEGORY:
+                calls.append(key)
+                if len(calls) == 1:
+                    return 0
+            return widen_range(kind, key, *args)
+
+        with mock.patch('product_app.price_stats._widen_range',
+                        created_meanwhile):
+            add_price(Decimal('0.50'), 'Toys', None)
+        self.assertEqual(calls, ['Toys', 'Toys'])
+        toys = self.get_range(PriceRange.CATEGORY, 'Toys')
+        self.assertEqual((toys.minimum, toys.products),
+                         (Decimal('0.50'), 51))
+
+    @tag('price_histogram')
+    def test_rebuild_and_estimate(self):
+        self.assertIsNone(estimate_products_in_range(10, 20))
+        call_command('rebuild_price_stats', buckets=10, stdout=StringIO())
+        self.assertEqual(PriceBucket.objects.count(), 10)
+        self.assertEqual(estimate_products_in_range(), 100)
+        self.assertAlmostEqual(estimate_products_in_range(21, 60), 40,
+                               delta=2)
+
+        for _ in range(10):
+            Product.objects.create(name='Cheap', price=Decimal('0.5'),
+                                   category='Toys', description='')
+        # bucket counters follow writes
+        self.assertEqual(estimate_products_in_range(), 110)
+        self.assertEqual(PriceBucket.objects.first().products, 20)
@@ -0,0 +1,116 @@
+from django.core.management import call_command
+from django.test import TestCase, tag
+from product_app.models import Product, SearchTerm, SearchPosting
+from product_app.search import search_product_ids, tokenize
+from product_app.trigram import substring_filter, trigrams, TRIGRAM_INDEXES
+from io import StringIO
+
+
+class TestProductSearch(TestCase):
+
+    def setUp(self):
+        self.product_1 = Product.objects.create(
+            name='Red ball',
+            price=15,
+            category='Toys',
+            description='Round and red.')
+
+        self.product_2 = Product.objects.create(
+            name='Ball',
+            price=20.34,
+            category='Toys',
+            description='Round and multicolored.')
+
+        self.product_3 = Product.objects.create(
+            name='Apple',
+            price=10,
+            category='Fruits',
+            description='Fresh red apples from Poland')
+
+    @tag('search_tokenize')
+    def test_tokenize(self):
+        self.assertEqual(tokenize('Fresh, RED apples!'),
+                         ['fresh', 'red', 'apples'])
+
+    @tag('search_ranking')
+    def test_search_most_relevant_first(self):
+        pks = search_product_ids('red ball')
+        self.assertEqual(pks[0], self.product_1.pk)
+        self.assertEqual(set(pks), {self.product_1.pk, self.product_2.pk,
+                                    self.product_3.pk})
+        self.assertEqual(search_product_ids('red ball', limit=1, offset=1),
+                         pks[1:2])
+        self.assertEqual(search_product_ids('unknown'), [])
+
+    @tag('search_filtered_queryset')
+    def test_search_in_filtered_products(self):
+        fruits = Product.objects.filter(category='Fruits')
+        self.assertEqual(search_product_ids('red', fruits),
+                         [self.product_3.pk])
+
+    @tag('search_incremental_update')
+    def test_index_updated_on_save_and_delete(self):
+        self.product_3.description = 'Green'
+        self.product_3.save()
+        self.assertNotIn(self.product_3.pk, search_product_ids('red'))
+        self.assertEqual(search_product_ids('green'), [self.product_3.pk])
+
+        self.product_1.delete()
+        self.assertEqual(search_product_ids('red'), [])
+        term = SearchTerm.objects.get(term='ball')
+        self.assertEqual(term.documents, 1)
+
+    @tag('search_rebuild')
+    def test_rebuild_search_index(self):
+        SearchPosting.objects.all().delete()
+        self.assertEqual(search_product_ids('ball'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(set(search_product_ids('ball')),
+                         {self.product_1.pk, self.product_2.pk})
+        self.assertEqual(SearchTerm.objects.get(term='round').documents, 2)
+
+
+class TestSubstringSearch(TestCase):
+
+    def setUp(self):
+        self.carrot = Product.objects.create(name='Carrot', price=1,
+                                             category='Vegetables',
+                                             description='Orange')
+        self.car = Product.objects.create(name='Toy car', price=10,
+                                          category='Toys',
+                                          description='Red')
+        self.apple = Product.objects.create(name='Apple', price=2,
+                                            category='Fruits',
+                                            description='Green')
+
+    @tag('trigrams')
+    def test_trigrams(self):
+        self.assertEqual(trigrams('Cart'), {'car', 'art'})
+        self.assertEqual(trigrams('ca'), set())
+
+    @tag('substring_search')
+    def test_substring_filter(self):
+        found = substring_filter(Product.objects.all(), {'name': 'CAR'})
+        self.assertEqual(set(found), {self.carrot, self.car})
+        found = substring_filter(Product.objects.all(),
+                                 {'name': 'car', 'category': 'toy'})
+        self.assertEqual(list(found), [self.car])
+        # too short to be looked up in index
+        found = substring_filter(Product.objects.all(), {'name': 'ap'})
+        self.assertEqual(list(found), [self.apple])
+
+    @tag('substring_search_update')
+    def test_trigram_index_updated_on_save_and_delete(self):
+        candidates = TRIGRAM_INDEXES[Product].candidates({'name': 'car'})
+        self.assertEqual(candidates, {self.carrot.pk, self.car.pk})
+        self.apple.name = 'Caramel apple'
+        self.apple.save()
+        self.car.delete()
+        candidates = TRIGRAM_INDEXES[Product].candidates({'name': 'car'})
+        self.assertEqual(candidates, {self.carrot.pk, self.apple.pk})
+        self.carrot.name = 'Beet'
+        self.carrot.save()
+        candidates = TRIGRAM_INDEXES[Product].candidates({'name': 'car'})
+        self.assertEqual(candidates, {self.apple.pk})
+        self.assertIsNone(
+            TRIGRAM_INDEXES[Product]._postings['name'].get('rro'))
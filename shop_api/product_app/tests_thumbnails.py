@@ -0,0 +1,135 @@
+from django.core.management import call_command
+from django.test import TestCase, tag, override_settings
+from django.urls import reverse
+from PIL import Image
+from product_app.models import Product
+from product_app.thumbnails import (generate_variants, generate_thumbnails,
+                                    get_executor, content_hash, variant_name)
+from io import StringIO
+import json
+import os
+import shutil
+import tempfile
+
+SIZES = [16, 64]
+FORMATS = ['webp', 'jpeg']
+
+
+class TestThumbnails(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings = override_settings(MEDIA_ROOT=self.media_root,
+                                     THUMBNAIL_SIZES=SIZES,
+                                     THUMBNAIL_FORMATS=FORMATS,
+                                     THUMBNAIL_WORKERS=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.image = self.write_image('ball.png', (120, 80))
+        self.product = Product.objects.create(name='Ball', price=10,
+                                              category='Toys',
+                                              description='Round')
+
+    def write_image(self, name, size, mode='RGB'):
+        Image.new(mode, size, 'red').save(os.path.join(self.media_root,
+                                                       name))
+        return name
+
+    def variant_path(self, digest, size, output_format):
+        return os.path.join(self.media_root,
+                            variant_name(digest, size, output_format))
+
+    @tag('thumbnail_variants')
+    def test_variants_are_written_by_content_hash(self):
+        source = os.path.join(self.media_root, self.image)
+        digest = generate_variants(source, self.media_root, SIZES, FORMATS)
+        self.assertEqual(digest, content_hash(source))
+        for size in SIZES:
+            for output_format in FORMATS:
+                with Image.open(self.variant_path(digest, size,
+                                                  output_format)) as image:
+                    self.assertEqual(image.format, output_format.upper())
+                    self.assertEqual(max(image.size), size)
+        # The same content is not resized again
+        path = self.variant_path(digest, 64, 'webp')
+        modified = os.path.getmtime(path) - 10
+        os.utime(path, (modified, modified))
+        copy = self.write_image('copy.png', (120, 80))
+        self.assertEqual(generate_variants(
+            os.path.join(self.media_root, copy), self.media_root, SIZES,
+            FORMATS), digest)
+        self.assertEqual(os.path.getmtime(path), modified)
+
+    @tag('thumbnail_small_transparent_image')
+    def test_transparent_image_is_not_enlarged(self):
+        image = self.write_image('icon.png', (40, 20), mode='RGBA')
+        digest = generate_variants(os.path.join(self.media_root, image),
+                                   self.media_root, SIZES, FORMATS)
+        with Image.open(self.variant_path(digest, 64, 'jpeg')) as variant:
+            self.assertEqual(variant.size, (40, 20))
+            self.assertEqual(variant.mode, 'RGB')
+
+    @tag('thumbnail_urls_serialized')
+    def test_thumbnail_urls_are_serialized_once_generated(self):
+        self.product.image = self.image
+        self.product.save()
+        response = self.client.get(reverse('detail_product',
+                                           args=[self.product.pk]))
+        self.assertNotIn('thumbnails', json.loads(response.content)[0])
+        version = response['X-Product-Version']
+
+        digest = generate_thumbnails(self.product.pk, self.image)
+        response = self.client.get(reverse('detail_product',
+                                           args=[self.product.pk]))
+        product = json.loads(response.content)[0]
+        self.assertEqual(product['thumbnails']['64']['webp'],
+                         f'/media/thumbnails/{digest[:2]}/{digest}/64.webp')
+        self.assertEqual(sorted(product['thumbnails']), ['16', '64'])
+        self.assertNotEqual(response['X-Product-Version'], version)
+
+    @tag('thumbnail_new_image')
+    def test_new_image_drops_thumbnails_of_previous_one(self):
+        self.product.image = self.image
+        self.product.save()
+        generate_thumbnails(self.product.pk, self.image)
+        self.product.refresh_from_db()
+        self.assertTrue(self.product.image_hash)
+
+        self.product.name = 'Red ball'
+        self.product.save()
+        self.product.refresh_from_db()
+        self.assertTrue(self.product.image_hash)
+
+        self.product.image = self.write_image('other.png', (30, 30))
+        self.product.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.image_hash, '')
+        # Variants of the previous image are not stored for the new one
+        generate_thumbnails(self.product.pk, self.image)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.image_hash, '')
+
+    @tag('thumbnail_command')
+    def test_command_generates_missing_thumbnails(self):
+        Product.objects.filter(pk=self.product.pk).update(image=self.image)
+        broken = Product.objects.create(name='Cube', price=5,
+                                        category='Toys', description='',
+                                        image='missing.png')
+        out, err = StringIO(), StringIO()
+        call_command('generate_thumbnails', stdout=out, stderr=err)
+        self.assertIn('Thumbnails of 1 images were generated, 1 failed.',
+                      out.getvalue())
+        self.assertIn(f'Product {broken.pk}', err.getvalue())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.image_hash, content_hash(
+            os.path.join(self.media_root, self.image)))
+
+    @tag('thumbnail_process_pool')
+    def test_variants_are_generated_in_worker_process(self):
+        source = os.path.join(self.media_root, self.image)
+        future = get_executor().submit(generate_variants, source,
+                                       self.media_root, SIZES, FORMATS)
+        digest = future.result(timeout=60)
+        self.assertTrue(os.path.exists(self.variant_path(digest, 16,
+                                                         'jpeg')))
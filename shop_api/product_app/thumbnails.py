@@ -0,0 +1,185 @@
+"""Thumbnails of product images generated off request.
+
+Every size of settings.THUMBNAIL_SIZES is generated in every format of
+settings.THUMBNAIL_FORMATS by a pool of settings.THUMBNAIL_WORKERS processes,
+so resizing never blocks a request worker. Generation is scheduled when
+a product is saved with a new image (see product_app.signals).
+
+Variants are stored in MEDIA_ROOT under SHA-256 of the image content:
+
+    thumbnails/<hash[:2]>/<hash>/<size>.<format>
+
+so the same image uploaded twice is resized once and variant URLs never
+change their content. Once variants are written the hash is stored in
+Product.image_hash and their URLs are serialized with the product.
+"""
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from django.conf import settings
+from django.db import connections
+from django.db.models import F
+from PIL import Image, ImageOps
+from product_app.bulk import sync_updated_products
+from product_app.models import Product
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_DIRECTORY = 'thumbnails'
+
+# format: (Pillow format, save options)
+FORMATS = {'webp': ('WEBP', {'quality': 80, 'method': 4}),
+           'jpeg': ('JPEG', {'quality': 85, 'optimize': True,
+                             'progressive': True})}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_sizes():
+    return sorted(getattr(settings, 'THUMBNAIL_SIZES', [64, 256, 1024]))
+
+
+def get_formats():
+    return list(getattr(settings, 'THUMBNAIL_FORMATS', ['webp', 'jpeg']))
+
+
+def content_hash(path, chunk_size=1 << 16):
+    """Returns SHA-256 hex digest of file content."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as stream:
+        for chunk in iter(partial(stream.read, chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def variant_name(digest, size, output_format):
+    """Returns path of variant relative to MEDIA_ROOT."""
+    return '/'.join([THUMBNAIL_DIRECTORY, digest[:2], digest,
+                     f'{size}.{output_format}'])
+
+
+def get_thumbnail_urls(digest):
+    """Returns {size: {format: URL}} of variants of image with digest."""
+    return {str(size): {output_format: settings.MEDIA_URL +
+                        variant_name(digest, size, output_format)
+                        for output_format in get_formats()}
+            for size in get_sizes()}
+
+
+def _save(image, path, output_format):
+    pillow_format, options = FORMATS[output_format]
+    if output_format == 'jpeg' and image.mode not in ('RGB', 'L'):
+        # JPEG has no transparency, transparent pixels become white
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1])
+        image = background
+    elif image.mode not in ('RGB', 'RGBA', 'L'):
+        image = image.convert('RGBA')
+    # Written under a temporary name, so a variant is either complete
+    # or missing, even if another worker writes it too.
+    temporary = f'{path}.{os.getpid()}.tmp'
+    image.save(temporary, format=pillow_format, **options)
+    os.replace(temporary, path)
+
+
+def generate_variants(source, root, sizes, formats):
+    """Writes missing variants of source image to root.
+
+    Runs in a worker process, so it does not touch the database.
+    Returns content hash of the image.
+    """
+    digest = content_hash(source)
+    paths = {(size, output_format):
+             os.path.join(root, *variant_name(digest, size,
+                                              output_format).split('/'))
+             for size in sizes for output_format in formats}
+    missing = {key: path for key, path in paths.items()
+               if not os.path.exists(path)}
+    if not missing:
+        return digest
+    os.makedirs(os.path.dirname(next(iter(missing.values()))), exist_ok=True)
+    with Image.open(source) as original:
+        original = ImageOps.exif_transpose(original)
+        for size in sorted({size for size, _ in missing}):
+            # Images smaller than the size are not enlarged
+            image = original.copy()
+            image.thumbnail((size, size), Image.LANCZOS)
+            for output_format in formats:
+                if (size, output_format) in missing:
+                    _save(image, missing[size, output_format], output_format)
+    return digest
+
+
+def store_image_hash(pk, image, digest):
+    """Stores hash of generated variants if the product still has image.
+
+    Product version is incremented and cached data of products is
+    invalidated, as variant URLs are part of serialized product.
+    """
+    updated = (Product.objects.filter(pk=pk, image=image)
+                              .exclude(image_hash=digest)
+                              .update(image_hash=digest,
+                                      version=F('version') + 1))
+    if updated:
+        sync_updated_products([pk], ['image_hash'])
+    return bool(updated)
+
+
+def generate_thumbnails(pk, image):
+    """Generates variants of product image in the calling process."""
+    digest = generate_variants(os.path.join(settings.MEDIA_ROOT, image),
+                               settings.MEDIA_ROOT, get_sizes(),
+                               get_formats())
+    store_image_hash(pk, image, digest)
+    return digest
+
+
+def get_executor():
+    """Returns process pool of thumbnail workers, created on first use.
+
+    Without configured workers the pool has one per CPU.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=getattr(settings, 'THUMBNAIL_WORKERS', 2) or None)
+        return _executor
+
+
+def _generated(pk, image, scheduled_by, future):
+    # Called in a thread of this process once the worker is done,
+    # or right away in the scheduling thread if it is done already.
+    try:
+        store_image_hash(pk, image, future.result())
+    except Exception:
+        logger.exception('Thumbnails of product %s (%s) were not generated',
+                         pk, image)
+    finally:
+        if threading.get_ident() != scheduled_by:
+            connections.close_all()
+
+
+def schedule_thumbnails(pk, image):
+    """Generates variants of product image in the process pool.
+
+    With THUMBNAIL_WORKERS = 0 they are generated right away.
+    """
+    if not getattr(settings, 'THUMBNAIL_WORKERS', 2):
+        try:
+            generate_thumbnails(pk, image)
+        except Exception:
+            logger.exception('Thumbnails of product %s (%s) were not '
+                             'generated', pk, image)
+        return None
+    future = get_executor().submit(
+        generate_variants, os.path.join(settings.MEDIA_ROOT, image),
+        settings.MEDIA_ROOT, get_sizes(), get_formats())
+    future.add_done_callback(partial(_generated, pk, image,
+                                     threading.get_ident()))
+    return future
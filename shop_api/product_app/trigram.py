@@ -0,0 +1,168 @@
+"""Trigram index for substring (icontains) search.
+
+On PostgreSQL upper-cased text fields of products and shops are covered by
+pg_trgm GIN indexes (see migrations), which serve
+"UPPER(field::text) LIKE UPPER('%value%')" queries generated by icontains.
+
+On other databases (SQLite for local testing) an in-process index maps every
+trigram of lowercased field values to primary keys of the rows containing
+it. Rows that contain all trigrams of the searched value are candidates,
+they are verified by the same icontains query restricted to candidate
+primary keys. The index is built lazily on first search, updated on save
+and delete (see product_app.signals) and rebuilt if the catalog was changed
+by another process. Trigrams of every row are kept too, so a change of a
+row updates only posting lists of its old and new trigrams. Memory of the
+index is proportional to the size of indexed text, so it is meant for local
+databases only.
+"""
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from django.conf import settings
+from product_app.catalog import PRODUCTS, SHOPS
+from product_app.models import Product, CatalogVersion
+from product_app.search import uses_native_search
+from shop_app.models import Shop
+
+
+def trigrams(text):
+    """Returns set of trigrams of lowercased text."""
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex:
+    """In-process trigram index over text fields of a model."""
+
+    def __init__(self, model, fields, catalog):
+        self.model = model
+        self.fields = fields
+        self.catalog = catalog
+        self._postings = None
+        # {pk: [trigrams of every field]} to update postings of a row only
+        self._rows = None
+        self._version = None
+        self._lock = threading.RLock()
+
+    def _current_version(self):
+        return (CatalogVersion.objects.filter(name=self.catalog)
+                                      .values_list('version', 'modified')
+                                      .first())
+
+    def build(self):
+        """Reads all rows and builds index from scratch."""
+        with self._lock:
+            version = self._current_version()
+            self._postings = {field: defaultdict(set)
+                              for field in self.fields}
+            self._rows = {}
+            rows = (self.model.objects.order_by()
+                                      .values_list('pk', *self.fields)
+                                      .iterator(chunk_size=5000))
+            for pk, *values in rows:
+                self._add(pk, values)
+            self._version = version
+
+    def _add(self, pk, values):
+        row = []
+        for field, value in zip(self.fields, values):
+            field_trigrams = trigrams(value or '')
+            for trigram in field_trigrams:
+                self._postings[field][trigram].add(pk)
+            row.append(field_trigrams)
+        self._rows[pk] = row
+
+    def _remove(self, pk):
+        for field, field_trigrams in zip(self.fields,
+                                         self._rows.pop(pk, ())):
+            field_postings = self._postings[field]
+            for trigram in field_trigrams:
+                field_postings[trigram].discard(pk)
+                if not field_postings[trigram]:
+                    del field_postings[trigram]
+
+    @contextmanager
+    def tracking(self):
+        """Wraps local change of catalog version.
+
+        Yields True if index is built and in sync with catalog. In this case
+        index keeps being in sync after the change, otherwise it is dropped
+        and rebuilt on the next search.
+        """
+        with self._lock:
+            if self._postings is None:
+                yield False
+                return
+            synced = self._version == self._current_version()
+            yield synced
+            if synced:
+                self._version = self._current_version()
+            else:
+                self.reset()
+
+    def update(self, instance, deleted=False):
+        """Applies change of a single row to built index."""
+        with self._lock:
+            self._remove(instance.pk)
+            if not deleted:
+                self._add(instance.pk, [getattr(instance, field)
+                                        for field in self.fields])
+
+    def reset(self):
+        with self._lock:
+            self._postings = None
+            self._rows = None
+            self._version = None
+
+    def candidates(self, values):
+        """Returns set of primary keys of rows that may contain every value
+        in its field, or None if values are too short to narrow the search.
+
+        values - {field: substring}
+        """
+        with self._lock:
+            if (self._postings is None or
+                    self._version != self._current_version()):
+                self.build()
+            posting_lists = []
+            for field, value in values.items():
+                if field in self._postings:
+                    field_postings = self._postings[field]
+                    posting_lists.extend(field_postings.get(gram, set())
+                                         for gram in trigrams(str(value)))
+            if not posting_lists:
+                return None
+            # Intersection starts from the rarest trigram of all fields,
+            # set intersection iterates over the smaller set only.
+            posting_lists.sort(key=len)
+            found = set(posting_lists[0])
+            for pks in posting_lists[1:]:
+                if not found:
+                    break
+                found &= pks
+            return found
+
+
+TRIGRAM_INDEXES = {
+    Product: TrigramIndex(Product, ('name', 'category', 'description'),
+                          PRODUCTS),
+    Shop: TrigramIndex(Shop, ('name', 'city', 'owner'), SHOPS),
+}
+
+
+def substring_filter(queryset, values):
+    """Filters queryset by case-insensitive substrings of fields.
+
+    values - {field: substring}
+    """
+    queryset = queryset.filter(**{f'{field}__icontains': value
+                                  for field, value in values.items()})
+    index = TRIGRAM_INDEXES.get(queryset.model)
+    if index is None or uses_native_search():
+        return queryset
+    candidates = index.candidates(values)
+    max_candidates = getattr(settings, 'TRIGRAM_MAX_CANDIDATES', 5000)
+    if candidates is None or len(candidates) > max_candidates:
+        # Not selective enough, plain scan is not slower.
+        return queryset
+    return queryset.filter(pk__in=candidates)
@@ -1,13 +1,18 @@
 from django.urls import path
 from product_app.views import (create_new_product_in_db,
+                               create_products_in_bulk,
                                get_list_of_all_products,
                                update_existing_product,
+                               update_products_in_bulk_view,
                                delete_product_from_db,
                                get_particular_product,
                                exact_search_for_product,
                                approximate_product_search,
                                product_search_by_shop,
-                               product_search_by_price_range)
+                               product_search_by_price_range,
+                               get_price_statistics,
+                               faceted_product_search,
+                               export_products)
 
 
 urlpatterns = [path('product-list/',
@@ -19,9 +24,15 @@ urlpatterns = [path('product-list/',
                path('create-product/',
                     create_new_product_in_db,
                     name='create_product'),
+               path('create-products/',
+                    create_products_in_bulk,
+                    name='create_products'),
                path('update-product/<int:pk>',
                     update_existing_product,
                     name='update_product'),
+               path('update-products/',
+                    update_products_in_bulk_view,
+                    name='update_products'),
                path('delete-product/<int:pk>',
                     delete_product_from_db,
                     name='delete_product'),
@@ -35,4 +46,13 @@ urlpatterns = [path('product-list/',
                     name='search_by_shop'),
                path('search-by-price/',
                     product_search_by_price_range,
-                    name='search_by_price')]
+                    name='search_by_price'),
+               path('price-statistics/',
+                    get_price_statistics,
+                    name='price_statistics'),
+               path('facets/',
+                    faceted_product_search,
+                    name='facets'),
+               path('export/',
+                    export_products,
+                    name='export_products')]
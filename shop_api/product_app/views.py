@@ -1,54 +1,138 @@
 from django.views.decorators.csrf import csrf_exempt
 import json
 from django.contrib.auth.decorators import login_required, permission_required
-from django.views.decorators.http import require_http_methods
-from django.core import serializers
-from django.http import HttpResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from django.views.decorators.http import require_http_methods, condition
+from django.http import HttpResponse, StreamingHttpResponse, JsonResponse
 from http import HTTPStatus
-from product_app.models import Product
+from product_app.models import Product, PriceRange
+from shop_app.models import Shop
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
-from django.db.models import Q, Max
+from django.db.models import Q
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from shop_api.pagination import (paginate_queryset, get_limit, get_offset,
+                                 NEXT_CURSOR_HEADER)
+from shop_api.streaming import is_streaming_requested
+from shop_api.cache import product_details
+from product_app.catalog import (catalog_etag, catalog_last_modified,
+                                 get_catalog_version, PRODUCTS)
+from product_app.bulk import (iter_json_rows, ingest_products,
+                              clean_changes, update_product,
+                              update_products_in_bulk, UPDATE_FIELDS)
+from product_app.exact_search import parse_filters, search_products
+from product_app.export import iter_export, gzip_chunks, CONTENT_TYPES
+from product_app.facets import filter_products, get_facet_counts
+from product_app.search import search_product_ids
+from product_app.price_stats import (estimate_products_in_range,
+                                     get_price_ranges)
+from product_app.trigram import substring_filter
+from product_app.serialization import (product_values, serialize_products,
+                                       iter_products_json)
+
+ESTIMATED_COUNT_HEADER = 'X-Estimated-Count'
+PRODUCT_VERSION_HEADER = 'X-Product-Version'
+
+
+def _products_response(request, products):
+    """Serializes products from queryset.
+
+    Page of products can be requested via ?after=<cursor>&limit=N,
+    cursor for the next page (if any) is returned in X-Next-Cursor header.
+    If limit and cursor are absent, all products are returned, with ?stream=1
+    they are streamed in chunks straight from database cursor.
+    Returns None if there is nothing to return.
+    """
+    if is_streaming_requested(request) and get_limit(request) is None:
+        if not products.exists():
+            return None
+        return StreamingHttpResponse(iter_products_json(products),
+                                     status=HTTPStatus.OK,
+                                     content_type='application/json')
+    page = paginate_queryset(request, product_values(products))
+    if not page.rows:
+        return None
+    data_to_return = serialize_products(page.rows, indent=2)
+    response = HttpResponse(data_to_return,
+                            status=HTTPStatus.OK,
+                            content_type='application/json')
+    if page.next_cursor:
+        response[NEXT_CURSOR_HEADER] = page.next_cursor
+    return response
+
+
+def _full_text_search_response(request, query, products):
+    """Returns products matching full-text query, most relevant first."""
+    try:
+        limit = get_limit(request) or settings.PAGINATION_DEFAULT_LIMIT
+        offset = get_offset(request)
+    except ValidationError:
+        return HttpResponse('Wrong pagination parameters.',
+                            status=HTTPStatus.BAD_REQUEST)
+    pks = search_product_ids(str(query), products, limit, offset)
+    if not pks:
+        return HttpResponse('Nothing was found', status=HTTPStatus.NOT_FOUND)
+    rows = product_values(Product.objects.filter(pk__in=pks))
+    position = {pk: index for index, pk in enumerate(pks)}
+    rows = sorted(rows, key=lambda row: position[row['pk']])
+    return HttpResponse(serialize_products(rows, indent=2),
+                        status=HTTPStatus.OK,
+                        content_type='application/json')
 
 
 @require_http_methods(['GET'])
+@condition(etag_func=catalog_etag(PRODUCTS),
+           last_modified_func=catalog_last_modified(PRODUCTS))
 def get_list_of_all_products(request):
-    """Returns list of all products"""
+    """Returns list of all products.
+
+    Supports keyset pagination via ?after=<cursor>&limit=N query parameters
+    and streaming of the whole list via ?stream=1.
+    Answers conditional requests (If-None-Match, If-Modified-Since)
+    with 304 status if catalog was not changed.
+    """
 
     products = Product.objects.all()
-    data_to_return = serializers.serialize('json',
-                                           products,
-                                           fields=['name', 'price',
-                                                   'description', 'category',
-                                                   'shop', 'available'],
-                                           indent=2,
-                                           use_natural_foreign_keys=True)
-    return HttpResponse(data_to_return,
-                        status=HTTPStatus.OK, content_type='application/json')
+    try:
+        response = _products_response(request, products)
+    except ValidationError:
+        return HttpResponse('Wrong pagination parameters.',
+                            status=HTTPStatus.BAD_REQUEST)
+    if response is None:
+        response = HttpResponse('[]', status=HTTPStatus.OK,
+                                content_type='application/json')
+    return response
 
 
 @require_http_methods(['GET'])
+@condition(etag_func=catalog_etag(PRODUCTS),
+           last_modified_func=catalog_last_modified(PRODUCTS))
 def get_particular_product(request, pk=None):
     """Returns particular product with details
 
     Takes a primary key (pk) as a second parameter.
     If product was not found 404 status is returned
-
+    Answers conditional requests with 304 status if catalog was not changed.
+    Serialized product is kept in detail cache until catalog is changed.
+    Version of product is returned in X-Product-Version header.
     """
-    product = Product.objects.filter(pk=pk)
-    if product:
-        data_to_return = serializers.serialize('json',
-                                               product,
-                                               fields=['name', 'price',
-                                                       'description',
-                                                       'category',
-                                                       'shop', 'available'],
-                                               indent=2,
-                                               use_natural_foreign_keys=True)
-        return HttpResponse(data_to_return,
+    catalog = get_catalog_version(request, PRODUCTS)
+    catalog_version = catalog.version if catalog else None
+    cached = product_details.get(pk, catalog_version)
+    if cached is None:
+        product = product_values(Product.objects.filter(pk=pk), 'version')
+        if not product:
+            return HttpResponse(status=HTTPStatus.NOT_FOUND)
+        data_to_return = serialize_products(product,
+                                            indent=2).encode('utf-8')
+        cached = (data_to_return, product[0]['version'])
+        product_details.set(pk, cached, catalog_version)
+    data_to_return, version = cached
+    response = HttpResponse(data_to_return,
                             status=HTTPStatus.OK,
                             content_type='application/json')
-
-    return HttpResponse(status=HTTPStatus.NOT_FOUND)
+    response[PRODUCT_VERSION_HEADER] = str(version)
+    return response
 
 
 @csrf_exempt
@@ -71,6 +155,29 @@ def create_new_product_in_db(request):
         return HttpResponse(message, status=HTTPStatus.BAD_REQUEST)
 
 
+@csrf_exempt
+@login_required(login_url='/login/')
+@permission_required(['product_app.add_product'])
+@require_http_methods(['POST'])
+def create_products_in_bulk(request):
+    """Creates many products from a single request.
+    Require admin's permission.
+
+    Body is either NDJSON (one product per line) or a json array of
+    products in the same format as for "create_new_product_in_db", shop is
+    given by its primary key. Body is parsed incrementally and products are
+    inserted in batches, one transaction per batch.
+    Returns json in a look like
+        {"created": <number>, "errors": [{"row": <number>,
+                                          "errors": {"<field>": [...]}}]}
+    with 201 status if any product was created, otherwise with 400 status.
+    """
+    created, errors = ingest_products(iter_json_rows(request))
+    status = HTTPStatus.CREATED if created else HTTPStatus.BAD_REQUEST
+    return JsonResponse({'created': created, 'errors': errors},
+                        status=status)
+
+
 @login_required(login_url='/login/')
 @permission_required(['product_app.change_product'])
 @require_http_methods(['PUT', 'PATCH'])
@@ -79,33 +186,61 @@ def update_existing_product(request, pk=None):
     Require admin's permissions.
     Takes a primary key (pk) as a second parameter.
 
-   The are three possible output:
-       if fields are absent in product model - custom message and 400 status
+    Only changed columns are written with a single UPDATE, product is not
+    loaded before. If json contains "version" (X-Product-Version header of
+    product details), product is updated only if it was not changed since.
+
+   The are four possible output:
+       if fields are absent in product model or values are wrong - custom
+       message and 400 status
 
        if product was not found via primary key - custom message and 404 status
 
+       if product was changed by another request - custom message and
+       409 status
+
        if product was successfully updated - custom message and 204 status
     """
     data = json.loads(request.body.decode(encoding='utf-8'))
-    product = Product.objects.filter(pk=pk).first()
-    if product:
-        try:
-
-            for k, v in data.items():
-                if hasattr(product, k):
-                    setattr(product, k, v)
-                else:
-                    raise AttributeError('Wrong field name')
-        except AttributeError:
-            return HttpResponse('You tried update fields that do not exist!',
-                                status=HTTPStatus.BAD_REQUEST)
-        else:
-            product.save()
-            content = f"Product: name={product.name} updated"
-            return HttpResponse(content, status=HTTPStatus.NO_CONTENT)
+    if set(data) - {*UPDATE_FIELDS, 'version'}:
+        return HttpResponse('You tried update fields that do not exist!',
+                            status=HTTPStatus.BAD_REQUEST)
+    try:
+        changes, version = clean_changes(data)
+    except ValidationError:
+        return HttpResponse('Wrong fields values.',
+                            status=HTTPStatus.BAD_REQUEST)
+    if update_product(pk, changes, version):
+        content = f"Product: pk={pk} updated"
+        return HttpResponse(content, status=HTTPStatus.NO_CONTENT)
+    if version is not None and Product.objects.filter(pk=pk).exists():
+        return HttpResponse('Product was changed by another request.',
+                            status=HTTPStatus.CONFLICT)
     return HttpResponse(status=HTTPStatus.NOT_FOUND)
 
 
+@login_required(login_url='/login/')
+@permission_required(['product_app.change_product'])
+@require_http_methods(['PATCH'])
+def update_products_in_bulk_view(request):
+    """Changes price and availability of many products.
+    Require admin's permissions.
+
+    Body is either NDJSON or json array of changes in a look like
+        {"pk": <product_pk>, "price": <price>, "available": <bool>,
+         "version": <version>}
+    "version" is optional, with it product is changed only if it was not
+    changed since the client has read it. Changes are applied in batches
+    with one UPDATE per batch.
+    Returns json in a look like
+        {"updated": <number>, "errors": [{"row": <number>,
+                                          "errors": {"<field>": [...]}}]}
+    """
+    updated, errors = update_products_in_bulk(iter_json_rows(request))
+    return JsonResponse({'updated': updated, 'errors': errors},
+                        status=HTTPStatus.OK)
+
+
 @login_required(login_url='/login/')
 @permission_required(['product_app.delete_product'])
 @require_http_methods(['DELETE'])
@@ -139,28 +274,38 @@ def exact_search_for_product(request):
         {"fieldname": "value"},
         than it is being converted to a dict and forwarding for further
         model querying.
+    Only filters from product_app.exact_search.EXACT_SEARCH_LOOKUPS are
+    accepted (e.g. "category", "available", "shop", "price__gte").
     if either filter name or filter value not correct or absent
     it returns BAD_REQUEST or NOT_FOUND
 
+    All search views support keyset pagination
+    via ?after=<cursor>&limit=N query parameters and streaming via ?stream=1.
     """
     data = json.loads(request.body.decode(encoding='utf-8'))
     try:
-        products = Product.objects.filter(**data).all()
+        filters = parse_filters(data)
     except ValidationError:
         return HttpResponse('Wrong fields values.',
                             status=HTTPStatus.BAD_REQUEST)
-    if len(products) > 0:
-        data_to_return = serializers.serialize('json',
-                                               products,
-                                               fields=['name', 'price',
-                                                       'description',
-                                                       'category',
-                                                       'shop', 'available'],
-                                               indent=2,
-                                               use_natural_foreign_keys=True)
-        return HttpResponse(data_to_return,
-                            status=HTTPStatus.OK,
-                            content_type='application/json')
+    try:
+        if get_limit(request) is None and \
+                not is_streaming_requested(request):
+            # SQL of the same set of filters is compiled only once
+            rows = search_products(filters)
+            response = None
+            if rows:
+                response = HttpResponse(serialize_products(rows, indent=2),
+                                        status=HTTPStatus.OK,
+                                        content_type='application/json')
+        else:
+            products = Product.objects.filter(**dict(filters))
+            response = _products_response(request, products)
+    except ValidationError:
+        return HttpResponse('Wrong pagination parameters.',
+                            status=HTTPStatus.BAD_REQUEST)
+    if response:
+        return response
     return HttpResponse('Nothing was found', status=HTTPStatus.NOT_FOUND)
 
 
@@ -169,24 +314,25 @@ def approximate_product_search(request):
     For instance:
         if client requests for {"name": "car"} it returns all db items
         that contains this part of word (carrot, car, cartoon etc.)
+
+    Free text query {"q": "red ball"} is looked up in full-text index
+    over name, category and description. Products are returned most
+    relevant first, page is selected with ?limit=N&offset=M.
     """
 
     data = json.loads(request.body.decode(encoding='utf-8'))
-    # adding __icontains is equal caseinsensitive SQL method LIKE
-    data = {k + '__icontains': v for k, v in data.items()}
-    products = Product.objects.filter(**data).all()
-    if len(products) > 0:
-        data_to_return = serializers.serialize('json',
-                                               products,
-                                               fields=['name', 'price',
-                                                       'description',
-                                                       'category',
-                                                       'shop', 'available'],
-                                               indent=2,
-                                               use_natural_foreign_keys=True)
-        return HttpResponse(data_to_return,
-                            status=HTTPStatus.OK,
-                            content_type='application/json')
+    query = data.pop('q', None)
+    # icontains (caseinsensitive SQL method LIKE) narrowed by trigram index
+    products = substring_filter(Product.objects.all(), data)
+    if query is not None:
+        return _full_text_search_response(request, query, products)
+    try:
+        response = _products_response(request, products)
+    except ValidationError:
+        return HttpResponse('Wrong pagination parameters.',
+                            status=HTTPStatus.BAD_REQUEST)
+    if response:
+        return response
     return HttpResponse('Nothing was found', status=HTTPStatus.NOT_FOUND)
 
 
@@ -195,22 +341,18 @@ def product_search_by_shop(request):
     Implements the same functionality as "approximate_product_search".
     the main difference between this and mentioned above is a way of modifying
     filtername due to shop is relational object to product.
+    Shops are looked up first and then products of found shops are returned.
     """
     data = json.loads(request.body.decode(encoding='utf-8'))
-    data = {'shop__' + k + '__icontains': v for k, v in data.items()}
-    products = Product.objects.filter(**data).all()
-    if len(products) > 0:
-        data_to_return = serializers.serialize('json',
-                                               products,
-                                               fields=['name', 'price',
-                                                       'description',
-                                                       'category',
-                                                       'shop', 'available'],
-                                               indent=2,
-                                               use_natural_foreign_keys=True)
-        return HttpResponse(data_to_return,
-                            status=HTTPStatus.OK,
-                            content_type='application/json')
+    shops = substring_filter(Shop.objects.all(), data)
+    products = Product.objects.filter(shop__in=shops).all()
+    try:
+        response = _products_response(request, products)
+    except ValidationError:
+        return HttpResponse('Wrong pagination parameters.',
+                            status=HTTPStatus.BAD_REQUEST)
+    if response:
+        return response
     return HttpResponse('Nothing was found', status=HTTPStatus.NOT_FOUND)
 
 
@@ -222,31 +364,140 @@ def product_search_by_price_range(request):
     imported and implemented. Method Q allows to use AND and OR statement in
     djanto ORM queries.
 
+    If "to" is absent, products up to the most expensive one are returned.
+    With ?estimate=1 estimated number of found products is returned in
+    X-Estimated-Count header, ?estimate=only returns just the estimate
+    without fetching products. Estimate is read from price histogram.
     """
     data = json.loads(request.body.decode(encoding='utf-8'))
-    start_from = data.get('from', 0)
-    # The following code block retrieve max price from DB if the latter was not
-    # provided by the user
-    end_to = data.get('to',
-                      Product.objects.all().aggregate(
-                          Max('price'))['price__max'])
     try:
-        products = Product.objects.filter(
-            Q(price__gte=start_from) & Q(price__lte=end_to)
-            ).all().order_by('price')
+        start_from = _parse_price(data.get('from', 0))
+        end_to = data.get('to')
+        end_to = end_to if end_to is None else _parse_price(end_to)
     except ValidationError:
         return HttpResponse('Only digits are acceptable',
                             status=HTTPStatus.BAD_REQUEST)
-    if len(products) > 0:
-        data_to_return = serializers.serialize('json',
-                                               products,
-                                               fields=['name', 'price',
-                                                       'description',
-                                                       'category',
-                                                       'shop', 'available'],
-                                               indent=2,
-                                               use_natural_foreign_keys=True)
-        return HttpResponse(data_to_return,
-                            status=HTTPStatus.OK,
-                            content_type='application/json')
+    estimate = request.GET.get('estimate')
+    estimated_count = None
+    if estimate:
+        estimated_count = estimate_products_in_range(start_from, end_to)
+    if estimate == 'only':
+        return JsonResponse({'estimated_count': estimated_count},
+                            status=HTTPStatus.OK)
+
+    # Range is read from price index, upper bound is not needed
+    # if the client did not provide it.
+    price_range = Q(price__gte=start_from)
+    if end_to is not None:
+        price_range &= Q(price__lte=end_to)
+    products = Product.objects.filter(price_range).all().order_by('price')
+    try:
+        response = _products_response(request, products)
+    except ValidationError:
+        return HttpResponse('Wrong pagination parameters.',
+                            status=HTTPStatus.BAD_REQUEST)
+    if response:
+        if estimated_count is not None:
+            response[ESTIMATED_COUNT_HEADER] = str(estimated_count)
+        return response
     return HttpResponse('Nothing was found', status=HTTPStatus.NOT_FOUND)
+
+
+def _parse_price(value):
+    try:
+        price = Decimal(str(value))
+    except InvalidOperation:
+        raise ValidationError('Price should be a number')
+    if not price.is_finite():
+        raise ValidationError('Price should be a number')
+    return price
+
+
+@require_http_methods(['GET'])
+def get_price_statistics(request):
+    """Returns minimal and maximal prices of the whole catalog,
+    of every category and of every shop (by shop primary key)."""
+    statistics = {PriceRange.ALL: None,
+                  PriceRange.CATEGORY: {},
+                  PriceRange.SHOP: {}}
+    for price_range in get_price_ranges():
+        prices = {'min': price_range.minimum,
+                  'max': price_range.maximum,
+                  'products': price_range.products}
+        if price_range.kind == PriceRange.ALL:
+            statistics[PriceRange.ALL] = prices
+        else:
+            statistics[price_range.kind][price_range.key] = prices
+    return JsonResponse(statistics, status=HTTPStatus.OK)
+
+
+@require_http_methods(['GET'])
+@condition(etag_func=catalog_etag(PRODUCTS, include_body=True))
+def faceted_product_search(request):
+    """Returns products matching selected facets together with facet counts.
+
+    Receives json in a look like
+        {"category": "toys", "shop": <shop id>, "available": true,
+         "price": "10-50"}
+    every key is optional. Returns json in a look like
+        {"facets": {"category": {"toys": 1, ...},
+                    "shop": {"<shop id>": {"label": "<shop name>",
+                                           "products": 1}, ...},
+                    "available": {...}, "price": {"10-50": 1, ...}},
+         "products": [<same items as in product list>]}
+    Facet counts are computed over all found products, products themselves
+    can be paginated via ?after=<cursor>&limit=N.
+    """
+    body = request.body.decode(encoding='utf-8')
+    try:
+        filters = json.loads(body) if body else {}
+        if not isinstance(filters, dict):
+            raise ValidationError('Filters should be an object')
+        products = filter_products(Product.objects.all(), filters)
+    except (ValueError, ValidationError):
+        return HttpResponse('Wrong facet values.',
+                            status=HTTPStatus.BAD_REQUEST)
+    try:
+        page = paginate_queryset(request, product_values(products))
+    except ValidationError:
+        return HttpResponse('Wrong pagination parameters.',
+                            status=HTTPStatus.BAD_REQUEST)
+    catalog = get_catalog_version(request, PRODUCTS)
+    facets = get_facet_counts(products, filters,
+                              catalog.version if catalog else None)
+    content = (f'{{"facets": {json.dumps(facets)}, '
+               f'"products": {serialize_products(page.rows)}}}')
+    response = HttpResponse(content, status=HTTPStatus.OK,
+                            content_type='application/json')
+    if page.next_cursor:
+        response[NEXT_CURSOR_HEADER] = page.next_cursor
+    return response
+
+
+@staff_member_required(login_url='/login/')
+@require_http_methods(['GET'])
+def export_products(request):
+    """Streams the whole catalog for downstream systems.
+    Require staff permissions.
+
+    ?format=ndjson (default) or ?format=csv selects output format,
+    ?compress=gzip compresses output while it is streamed.
+    Every product is exported with name and city of its shop.
+    """
+    output_format = request.GET.get('format', 'ndjson')
+    compress = request.GET.get('compress')
+    if output_format not in CONTENT_TYPES or \
+            compress not in (None, 'gzip'):
+        return HttpResponse('Wrong export parameters.',
+                            status=HTTPStatus.BAD_REQUEST)
+    chunks = iter_export(output_format)
+    filename = f'products.{output_format}'
+    content_type = CONTENT_TYPES[output_format]
+    if compress:
+        chunks = gzip_chunks(chunks)
+        filename += '.gz'
+        content_type = 'application/gzip'
+    response = StreamingHttpResponse(chunks, status=HTTPStatus.OK,
+                                     content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,74 @@
+"""Cache of serialized detail responses.
+
+Serialized bytes of product and shop details are stored in a separate
+django cache ("detail" alias in settings.CACHES). LocMemCache evicts least
+recently used entries when MAX_ENTRIES is reached and entries expire after
+TIMEOUT seconds.
+
+Entries are keyed by catalog version (see product_app.catalog) and become
+unreachable once the catalog is changed, so caches of other processes are
+not served stale either. Facet counts of product search (see
+product_app.facets) share the same cache.
+"""
+import threading
+from django.conf import settings
+from django.core.cache import caches
+
+DETAIL_CACHE_ALIAS = 'detail'
+
+
+class DetailCache:
+    """Serialized responses of a single model keyed by primary key.
+
+    Counts hits and misses of the current process.
+    """
+
+    def __init__(self, prefix, alias=DETAIL_CACHE_ALIAS):
+        self.prefix = prefix
+        self.alias = alias
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def make_key(self, pk, version=None):
+        if version is None:
+            return f'{self.prefix}:{pk}'
+        return f'{self.prefix}:{pk}:{version}'
+
+    def get(self, pk, version=None):
+        """Returns content cached under catalog version or None."""
+        content = self.cache.get(self.make_key(pk, version))
+        with self._lock:
+            if content is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return content
+
+    def set(self, pk, content, version=None):
+        self.cache.set(self.make_key(pk, version), content)
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / requests if requests else None}
+
+
+product_details = DetailCache('product')
+shop_details = DetailCache('shop')
+facet_counts = DetailCache('facets')
+
+
+def get_detail_cache_stats():
+    """Returns hit/miss counters of all detail caches and cache limits."""
+    options = settings.CACHES.get(DETAIL_CACHE_ALIAS, {})
+    return {'max_entries': options.get('OPTIONS', {}).get('MAX_ENTRIES'),
+            'timeout': options.get('TIMEOUT'),
+            'product': product_details.stats(),
+            'shop': shop_details.stats(),
+            'facets': facet_counts.stats()}
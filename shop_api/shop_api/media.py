@@ -0,0 +1,169 @@
+"""Serving of files stored in MEDIA_ROOT (product images and thumbnails).
+
+Files are returned with FileResponse, so WSGI servers which provide
+wsgi.file_wrapper (gunicorn, uWSGI) send them with os.sendfile() straight
+from disk to socket. A byte range is served from a file object positioned
+at its start and limited to its length, Content-Length tells the server
+how many bytes to send.
+
+Every file has a strong ETag built from its size and modification time,
+conditional requests (If-None-Match, If-Modified-Since, If-Match,
+If-Unmodified-Since) and If-Range are answered against it. Content of
+content-addressed files (thumbnails are stored under hash of their image)
+never changes, they are cached by clients for a year without revalidation.
+"""
+import mimetypes
+import os
+import re
+from collections import namedtuple
+from http import HTTPStatus
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.http import parse_http_date_safe
+
+ByteRange = namedtuple('ByteRange', ['start', 'length'])
+
+# Files under these paths are named by hash of their content
+CONTENT_ADDRESSED = re.compile(r'^thumbnails/[0-9a-f]{2}/[0-9a-f]{64}/')
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Not known to mimetypes of older Pythons
+mimetypes.add_type('image/webp', '.webp')
+
+
+class UnsatisfiableRange(Exception):
+    pass
+
+
+def file_etag(stat):
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def content_type(path):
+    guessed, encoding = mimetypes.guess_type(path)
+    # Compressed files are sent as they are
+    if encoding:
+        return 'application/octet-stream'
+    return guessed or 'application/octet-stream'
+
+
+def cache_control(path):
+    """Returns Cache-Control header value of media file."""
+    if CONTENT_ADDRESSED.match(path):
+        return f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    max_age = getattr(settings, 'MEDIA_CACHE_MAX_AGE', 3600)
+    return f'public, max-age={max_age}'
+
+
+def parse_range(header, size):
+    """Returns ByteRange requested by Range header value.
+
+    Returns None if the whole file should be sent: header is empty,
+    malformed or has several ranges (they are allowed to be ignored).
+    Raises UnsatisfiableRange if the range is out of the file.
+    """
+    match = _RANGE.match(header or '')
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        # Suffix range: last N bytes
+        length = min(int(last), size)
+        if length == 0:
+            raise UnsatisfiableRange()
+        return ByteRange(size - length, length)
+    start = int(first)
+    end = size - 1 if not last else min(int(last), size - 1)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise UnsatisfiableRange()
+    return ByteRange(start, end - start + 1)
+
+
+def if_range_matches(header, etag, last_modified):
+    """Checks If-Range header against validators of the file."""
+    if not header:
+        return True
+    if header.startswith('"'):
+        return header == etag
+    modified_since = parse_http_date_safe(header)
+    return modified_since is not None and \
+        int(last_modified) <= modified_since
+
+
+def content_range(byte_range, size):
+    last = byte_range.start + byte_range.length - 1
+    return f'bytes {byte_range.start}-{last}/{size}'
+
+
+def unsatisfied_range(size):
+    return f'bytes */{size}'
+
+
+class RangeFile:
+    """Binary file limited to a byte range.
+
+    Exposes fileno(), so the range can still be sent with sendfile()
+    from the current position for Content-Length bytes.
+    """
+
+    def __init__(self, file, byte_range):
+        self.file = file
+        self.file.seek(byte_range.start)
+        self.remaining = byte_range.length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def media_path(path):
+    """Returns absolute path of media file, None if it is out of
+    MEDIA_ROOT or is not a regular file."""
+    root = os.path.abspath(settings.MEDIA_ROOT)
+    full_path = os.path.abspath(os.path.join(root, path))
+    if os.path.commonpath([root, full_path]) != root or \
+            not os.path.isfile(full_path):
+        return None
+    return full_path
+
+
+def file_response(request, full_path, stat, etag):
+    """Returns response with the whole file or the requested range of it."""
+    byte_range = None
+    if if_range_matches(request.META.get('HTTP_IF_RANGE'), etag,
+                        stat.st_mtime):
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'),
+                                     stat.st_size)
+        except UnsatisfiableRange:
+            response = HttpResponse(
+                status=HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            response['Content-Range'] = unsatisfied_range(stat.st_size)
+            return response
+    file = open(full_path, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type(full_path))
+        response['Content-Length'] = stat.st_size
+        return response
+    response = FileResponse(RangeFile(file, byte_range),
+                            status=HTTPStatus.PARTIAL_CONTENT,
+                            content_type=content_type(full_path))
+    response['Content-Length'] = byte_range.length
+    response['Content-Range'] = content_range(byte_range, stat.st_size)
+    return response
@@ -0,0 +1,182 @@
+"""Keyset (cursor) pagination shared by the listing and search views.
+
+A page is requested with ``?limit=N`` and continued with
+``?after=<cursor>&limit=N``. The cursor is an opaque, url-safe token that
+holds the ordering values of the last row of the previous page, so the next
+page is fetched with a ``WHERE (key) > (cursor)`` condition instead of an
+OFFSET scan and every page costs the same as the first one.
+"""
+import base64
+import binascii
+import json
+from collections import namedtuple
+from django.conf import settings
+from django.core.exceptions import ValidationError, FieldDoesNotExist
+from django.db.models import Q
+
+Page = namedtuple('Page', ['rows', 'next_cursor'])
+
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+def encode_cursor(values):
+    """Packs ordering values of a row into an opaque url-safe token."""
+    raw = json.dumps([str(value) for value in values],
+                     separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    """Unpacks token created by encode_cursor.
+
+    Raises ValidationError if token is broken or does not match
+    the number of ordering fields.
+    """
+    padding = '=' * (-len(cursor) % 4)
+    try:
+        raw = base64.urlsafe_b64decode(cursor + padding)
+        values = json.loads(raw.decode('utf-8'))
+    except (binascii.Error, ValueError):
+        raise ValidationError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != size:
+        raise ValidationError('Invalid cursor')
+    return values
+
+
+def get_keyset_ordering(queryset):
+    """Returns ordering of queryset with primary key as a tiebreaker.
+
+    Explicit order_by() takes precedence over model's Meta.ordering.
+    """
+    ordering = list(queryset.query.order_by or
+                    queryset.model._meta.ordering)
+    names = [field.lstrip('-') for field in ordering]
+    if 'pk' not in names and queryset.model._meta.pk.name not in names:
+        ordering.append('pk')
+    return ordering
+
+
+def _keyset_filter(ordering, values):
+    """Builds lexicographic "row comes after values" condition.
+
+    For ordering (a, b, pk) it is equal to:
+        a > x OR (a = x AND b > y) OR (a = x AND b = y AND pk > z)
+    """
+    condition = Q()
+    equal_part = {}
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = '__lt' if field.startswith('-') else '__gt'
+        condition |= Q(**equal_part, **{name + lookup: value})
+        equal_part[name] = value
+    return condition
+
+
+def _ordering_field(model, name):
+    """Returns model field of ordering name, following relations, or None
+    for names which are not fields (annotations)."""
+    if name == 'pk':
+        return model._meta.pk
+    field = None
+    for part in name.split('__'):
+        if field is not None:
+            if not field.is_relation:
+                return None
+            model = field.related_model
+        try:
+            field = model._meta.get_field(part)
+        except FieldDoesNotExist:
+            return None
+    return field
+
+
+def _cursor_values(model, ordering, values):
+    """Converts decoded cursor strings to python values of ordering fields.
+
+    Raises ValidationError if a value does not fit its field.
+    """
+    converted = []
+    for field, value in zip(ordering, values):
+        field = _ordering_field(model, field.lstrip('-'))
+        if field is not None:
+            try:
+                value = field.to_python(value)
+            except ValidationError:
+                raise ValidationError('Invalid cursor')
+        converted.append(value)
+    return converted
+
+
+def _row_values(row, ordering, model):
+    """Reads ordering values from model instance or from values() dict."""
+    values = []
+    for field in ordering:
+        name = field.lstrip('-')
+        if isinstance(row, dict):
+            values.append(row[name])
+            continue
+        if name == 'pk':
+            name = model._meta.pk.attname
+        else:
+            name = model._meta.get_field(name).attname
+        values.append(getattr(row, name))
+    return values
+
+
+def get_limit(request):
+    """Reads and validates "limit" query parameter.
+
+    Returns None if pagination was not requested by client.
+    """
+    limit = request.GET.get('limit')
+    if limit is None:
+        if 'after' not in request.GET:
+            return None
+        return getattr(settings, 'PAGINATION_DEFAULT_LIMIT', 50)
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise ValidationError('Limit should be a positive integer')
+    if limit < 1:
+        raise ValidationError('Limit should be a positive integer')
+    return min(limit, getattr(settings, 'PAGINATION_MAX_LIMIT', 500))
+
+
+def get_offset(request):
+    """Reads and validates "offset" query parameter."""
+    try:
+        offset = int(request.GET.get('offset', 0))
+    except ValueError:
+        raise ValidationError('Offset should be a non-negative integer')
+    if offset < 0:
+        raise ValidationError('Offset should be a non-negative integer')
+    return offset
+
+
+def paginate_queryset(request, queryset, default_limit=None):
+    """Returns Page with rows after the cursor from request.
+
+    If client did not ask for pagination the first default_limit rows are
+    returned, without default_limit the whole queryset is returned as
+    a single page without next cursor.
+    """
+    limit = get_limit(request) or default_limit
+    if limit is None:
+        return Page(queryset, None)
+
+    ordering = get_keyset_ordering(queryset)
+    queryset = queryset.order_by(*ordering)
+    cursor = request.GET.get('after')
+    if cursor:
+        values = _cursor_values(queryset.model, ordering,
+                                decode_cursor(cursor, len(ordering)))
+        queryset = queryset.filter(_keyset_filter(ordering, values))
+
+    # One extra row tells whether next page exists.
+    rows = list(queryset[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(
+            _row_values(rows[-1], ordering, queryset.model))
+    return Page(rows, next_cursor)
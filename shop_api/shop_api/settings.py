@@ -94,6 +94,25 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+# "detail" keeps serialized product and shop details (see shop_api/cache.py)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'detail': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'detail-responses',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        }
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -131,5 +150,72 @@ USE_TZ = False
 # https://docs.djangoproject.com/en/3.0/howto/static-files/
 
 STATIC_URL = '/static/'
+
+# Product images and their thumbnails
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+MEDIA_URL = '/media/'
+# max-age of media files which are not named by their content
+# (see shop_api/media.py)
+MEDIA_CACHE_MAX_AGE = 3600
 FIXTURE_DIRS = [os.path.join(BASE_DIR, 'shop_api', 'fixtures')]
 FIXTURES = ['product_samples.json', 'shop_samples.json']
+
+# Keyset pagination of listing and search views
+# (see shop_api/pagination.py)
+PAGINATION_DEFAULT_LIMIT = 50
+PAGINATION_MAX_LIMIT = 500
+
+# Number of rows fetched from server-side cursor per chunk
+# when listing is streamed (see shop_api/streaming.py)
+STREAMING_CHUNK_SIZE = 2000
+
+# Substring search falls back to a plain scan when trigram index
+# (see product_app/trigram.py) finds more candidates than this
+TRIGRAM_MAX_CANDIDATES = 5000
+
+# Number of buckets of equi-depth histogram of product prices
+# (see product_app/price_stats.py)
+PRICE_HISTOGRAM_BUCKETS = 32
+
+# Upper bounds of price buckets counted by faceted search
+# (see product_app/facets.py)
+FACET_PRICE_BUCKETS = [10, 50, 100, 500]
+
+# Number of products written per transaction by bulk ingest and bulk
+# update (see product_app/bulk.py)
+BULK_CREATE_BATCH_SIZE = 1000
+BULK_UPDATE_BATCH_SIZE = 500
+
+# Thumbnails of product images, generated by a pool of THUMBNAIL_WORKERS
+# processes, 0 generates them in the saving process
+# (see product_app/thumbnails.py)
+THUMBNAIL_SIZES = [64, 256, 1024]
+THUMBNAIL_FORMATS = ['webp', 'jpeg']
+THUMBNAIL_WORKERS = 2
+
+# Storage of active baskets, e.g. Redis with changes written to the database
+# every 5 seconds (see basket_app/cart_store.py):
+# {'BACKEND': 'basket_app.cart_store.RedisCartStore',
+#  'OPTIONS': {'url': 'redis://localhost:6379/0', 'flush_interval': 5}}
+CART_STORE = {
+    'BACKEND': 'basket_app.cart_store.DatabaseCartStore',
+}
+
+# Seconds responses of requests with Idempotency-Key header are kept for
+# (see basket_app/idempotency.py)
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+
+# Queue of jobs run after requests, e.g. finalization of paid baskets
+# (see basket_app/jobs.py and "manage.py run_workers")
+JOB_WORKERS = 2
+JOB_POLL_INTERVAL = 1
+JOB_LEASE = 60
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_DELAY = 10
+
+# Seconds discount rules cached by a process are used without checking
+# whether another process has changed them (see basket_app/pricing.py)
+PRICING_RULES_CHECK_INTERVAL = 5
+
+# Baskets quoted at once by batch quotes (see basket_app/quotes.py)
+QUOTE_CHUNK_SIZE = 5000
@@ -0,0 +1,50 @@
+"""Streaming JSON responses for large listings.
+
+Rows are read with QuerySet.iterator(), which uses a server-side cursor on
+PostgreSQL, and serialized chunk by chunk, so worker memory does not depend
+on the number of rows. Output is the same as serializers.serialize('json')
+without indentation.
+"""
+from itertools import islice
+from django.conf import settings
+from django.core import serializers
+from django.http import StreamingHttpResponse
+from http import HTTPStatus
+
+TRUE_VALUES = ('1', 'true', 'yes')
+
+
+def is_streaming_requested(request):
+    """Checks ?stream=1 query parameter."""
+    return request.GET.get('stream', '').lower() in TRUE_VALUES
+
+
+def iter_json_chunks(queryset, chunk_size=None, **options):
+    """Yields JSON array of serialized objects piece by piece.
+
+    Every chunk of chunk_size rows is serialized with django serializer,
+    surrounding brackets are stripped and chunks are joined with the same
+    separator serializer uses between objects.
+    """
+    chunk_size = chunk_size or getattr(settings, 'STREAMING_CHUNK_SIZE',
+                                       2000)
+    rows = queryset.iterator(chunk_size=chunk_size)
+    yield '['
+    separator = ''
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        data = serializers.serialize('json', chunk, **options)
+        yield separator + data[1:-1]
+        separator = ', '
+    yield ']'
+
+
+def stream_json_response(queryset, chunk_size=None, **options):
+    """Returns StreamingHttpResponse with serialized queryset."""
+    return StreamingHttpResponse(iter_json_chunks(queryset,
+                                                  chunk_size,
+                                                  **options),
+                                 status=HTTPStatus.OK,
+                                 content_type='application/json')
@@ -13,17 +13,22 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
-from shop_api.views import healthcheck, index, signup_page, login_page
+from shop_api.views import (healthcheck, index, signup_page, login_page,
+                            cache_stats, serve_media)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('healthcheck/', healthcheck, name='healthcheck'),
+    path('cache-stats/', cache_stats, name='cache_stats'),
     path('products/', include('product_app.urls')),
     path('baskets/', include('basket_app.urls')),
     path('shops/', include('shop_app.urls')),
     path('', index, name='index'),
     path('login/', login_page, name='login_page'),
-    path('signup/', signup_page, name='signup_page')
+    path('signup/', signup_page, name='signup_page'),
+    path(f'{settings.MEDIA_URL.lstrip("/")}<path:path>', serve_media,
+         name='media')
 ]
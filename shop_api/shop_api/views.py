@@ -1,11 +1,18 @@
 import json
+import os
 from django.core.exceptions import ValidationError
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse, Http404
 from http import HTTPStatus
 from django.views.decorators.http import require_http_methods
 from django.contrib.auth.models import User, Permission
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth import authenticate, login
+from django.contrib.admin.views.decorators import staff_member_required
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from shop_api.cache import get_detail_cache_stats
+from shop_api.media import (media_path, file_etag, file_response,
+                            cache_control)
 
 
 def healthcheck(request):
@@ -51,3 +58,33 @@ def login_page(request):
         return HttpResponse(message, status=HTTPStatus.OK)
     return HttpResponse('Incorrect login/password!',
                         status=HTTPStatus.BAD_REQUEST)
+
+
+@staff_member_required(login_url='/login/')
+@require_http_methods(['GET'])
+def cache_stats(request):
+    """Returns hit/miss counters of detail caches of the current process."""
+    return JsonResponse(get_detail_cache_stats(), status=HTTPStatus.OK)
+
+
+@require_http_methods(['GET', 'HEAD'])
+def serve_media(request, path):
+    """Serves file from MEDIA_ROOT, see shop_api.media.
+
+    Supports single byte ranges and conditional requests.
+    """
+    full_path = media_path(path)
+    if full_path is None:
+        raise Http404('File does not exist')
+    stat = os.stat(full_path)
+    etag = file_etag(stat)
+    last_modified = int(stat.st_mtime)
+    response = get_conditional_response(request, etag=etag,
+                                        last_modified=last_modified)
+    if response is None:
+        response = file_response(request, full_path, stat, etag)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = cache_control(path)
+    response['Accept-Ranges'] = 'bytes'
+    return response
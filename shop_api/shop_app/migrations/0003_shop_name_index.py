@@ -0,0 +1,18 @@
+# Generated by Django 3.0.3 on 2026-10-18 18:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop_app', '0002_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='shop',
+            name='name',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+    ]
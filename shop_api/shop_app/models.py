@@ -3,7 +3,8 @@ from django.db import models
 
 class Shop(models.Model):
     city = models.CharField(max_length=255)
-    name = models.CharField(max_length=255)
+    # products are looked up by exact name of their shop
+    name = models.CharField(max_length=255, db_index=True)
     owner = models.CharField(max_length=255)
 
     class Meta:
@@ -4,6 +4,7 @@ from shop_app.models import Shop
 from django.http import QueryDict
 from django.urls import reverse
 from django.conf import settings
+from django.core.cache import caches
 from django.core import serializers
 import json
 
@@ -26,6 +27,8 @@ class TestShopViews(TestCase):
                                            use_natural_foreign_keys=True)
         self.shops = json.loads(self.shops)
         self.query_str = QueryDict(mutable=True)
+        # cached details outlive rolled back test transactions
+        caches['detail'].clear()
 
     @tag('admin_add_new_shop')
     def test_admin_add_new_shop(self):
@@ -80,3 +83,32 @@ class TestShopViews(TestCase):
         self.assertEqual(data_to_compare[0], self.shops[0]['fields'])
         self.assertEqual(data_to_compare[1], self.shops[1]['fields'])
         self.assertEqual(data_to_compare[2], self.shops[2]['fields'])
+
+    @tag('stream_shops_list')
+    def test_stream_list_of_all_shops(self):
+        response = self.client.get(reverse('get_shop_list') + '?stream=1')
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content).decode('utf-8')
+        expected = serializers.serialize('json',
+                                         Shop.objects.all(),
+                                         fields=['name', 'city', 'owner'],
+                                         use_natural_foreign_keys=True)
+        self.assertEqual(content, expected)
+
+    @tag('shops_list_not_modified')
+    def test_get_list_of_shops_not_modified(self):
+        response = self.client.get(reverse('get_shop_list'))
+        etag = response['ETag']
+        response = self.client.get(reverse('get_shop_list'),
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.client.login(username=self.admin.username,
+                          password='admin_password')
+        self.client.put(reverse('change_existing_shop',
+                                kwargs={'shop_pk': 1}),
+                        {'owner': 'Ivan Bohun'},
+                        content_type='application/json')
+        response = self.client.get(reverse('get_shop_list'),
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
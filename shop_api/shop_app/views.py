@@ -1,10 +1,14 @@
 import json
 from django.contrib.auth.decorators import login_required, permission_required
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.http import require_http_methods, condition
 from django.core import serializers
 from django.http import HttpResponse
 from http import HTTPStatus
 from shop_app.models import Shop
+from product_app.catalog import (catalog_etag, catalog_last_modified,
+                                 get_catalog_version, SHOPS)
+from shop_api.cache import shop_details
+from shop_api.streaming import is_streaming_requested, stream_json_response
 from django.core.exceptions import ValidationError, ObjectDoesNotExist
 
 
@@ -54,10 +58,21 @@ def change_existing_shop_view(request, shop_pk=None):
 
 
 @require_http_methods(['GET'])
+@condition(etag_func=catalog_etag(SHOPS),
+           last_modified_func=catalog_last_modified(SHOPS))
 def get_list_of_all_shops(request):
-    """Returns list of all shops in JSON."""
+    """Returns list of all shops in JSON.
+
+    With ?stream=1 shops are streamed in chunks straight from database cursor.
+    Answers conditional requests (If-None-Match, If-Modified-Since)
+    with 304 status if shops were not changed.
+    """
 
     shops = Shop.objects.all()
+    if is_streaming_requested(request):
+        return stream_json_response(shops,
+                                    fields=['name', 'city', 'owner'],
+                                    use_natural_foreign_keys=True)
     data_to_return = serializers.serialize('json',
                                            shops,
                                            fields=['name', 'city', 'owner'],
@@ -73,16 +88,21 @@ def get_particular_shop(request, shop_pk=None):
 
     Takes a primary key (pk) as a second parameter.
     If shop was not found 404 status is returned
-
+    Serialized shop is kept in detail cache until shops are changed.
     """
-    shop = Shop.objects.filter(pk=shop_pk)
-    if shop:
+    catalog = get_catalog_version(request, SHOPS)
+    catalog_version = catalog.version if catalog else None
+    data_to_return = shop_details.get(shop_pk, catalog_version)
+    if data_to_return is None:
+        shop = Shop.objects.filter(pk=shop_pk)
+        if not shop:
+            return HttpResponse(status=HTTPStatus.NOT_FOUND)
         data_to_return = serializers.serialize('json',
                                                shop,
                                                indent=2,
                                                use_natural_foreign_keys=True)
-        return HttpResponse(data_to_return,
-                            status=HTTPStatus.OK,
-                            content_type='application/json')
-
-    return HttpResponse(status=HTTPStatus.NOT_FOUND)
+        data_to_return = data_to_return.encode('utf-8')
+        shop_details.set(shop_pk, data_to_return, catalog_version)
+    return HttpResponse(data_to_return,
+                        status=HTTPStatus.OK,
+                        content_type='application/json')